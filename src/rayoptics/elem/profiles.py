@@ -12,6 +12,7 @@ from math import sqrt, copysign, sin, acos
 from scipy import optimize
 
 from rayoptics.util.misc_math import normalize
+from rayoptics.raytr import tracestats
 from rayoptics.raytr.traceerror import TraceError, TraceMissedSurfaceError
 
 
@@ -68,6 +69,37 @@ class SurfaceProfile:
         """Returns the sagitta (z coordinate) of the surface at x, y. """
         pass
 
+    def f_array(self, p):
+        """Returns the profile surface function at the (N, 3) points *p*. """
+        return np.array([self.f(pi) for pi in p])
+
+    def df_array(self, p):
+        """Returns the (N, 3) gradients at the (N, 3) points *p*. """
+        grad = np.empty((len(p), 3))
+        for i in range(len(p)):
+            grad[i] = self.df(p[i])
+        return grad
+
+    def normal_array(self, p):
+        """Returns an (N, 3) array of unit normals at the (N, 3) points *p*. """
+        grad = self.df_array(p)
+        return grad/np.linalg.norm(grad, axis=1)[:, np.newaxis]
+
+    def sag_array(self, x, y):
+        """Returns the sagitta of the surface at the arrays x, y.
+
+        Points that lie outside the surface definition return NaN.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        z = np.full(x.shape, np.nan)
+        for i in np.ndindex(x.shape):
+            try:
+                z[i] = self.sag(x[i], y[i])
+            except TraceMissedSurfaceError:
+                pass
+        return z
+
     def profile(self, sd, dir=1, steps=6):
         """Return a 2d polyline approximating the surface profile.
 
@@ -99,6 +131,27 @@ class SurfaceProfile:
         '''
         return self.intersect_spencer(p0, d, eps, z_dir)
 
+    def intersect_array(self, p0, d, eps, z_dir):
+        ''' Intersect a profile with an array of rays.
+
+        The default implementation uses :meth:`intersect_spencer_array`.
+
+        Args:
+            p0:  (N, 3) array of ray start points in the profile's
+                 coordinate system
+            d:  (N, 3) array of ray direction cosines in the profile's
+                coordinate system
+            z_dir: +1 if propagation positive direction, -1 if otherwise
+            eps: numeric tolerance for convergence of any iterative procedure
+
+        Returns:
+            tuple: (N,) distances to the intersection points *s1*, (N, 3)
+            intersection points *p*, and an (N,) boolean *miss* mask that is
+            True for rays that missed the profile
+        '''
+        s1, p, miss, iters = self.intersect_spencer_array(p0, d, eps, z_dir)
+        return s1, p, miss
+
     def intersect_welford(self, p, d, eps, z_dir):
         ''' Intersect a profile, starting from an arbitrary point.
 
@@ -138,6 +191,8 @@ class SurfaceProfile:
             p1 = p2
             iter += 1
         # print('intersect iter =', iter)
+        if tracestats.recorder is not None:
+            tracestats.recorder.record_iterations(iter)
         s1 = norm(p1 - p)
         return s1, p1
 
@@ -172,8 +227,54 @@ class SurfaceProfile:
             s1 = s2
             iter += 1
         # print('intersect iter =', iter)
+        if tracestats.recorder is not None:
+            tracestats.recorder.record_iterations(iter)
         return s1, p
 
+    def intersect_spencer_array(self, p0, d, eps, z_dir, max_iter=1000):
+        ''' Intersect a profile with an array of rays.
+
+        This is a batched version of :meth:`intersect_spencer`. All rays are
+        iterated together and each ray is frozen once it has converged.
+
+        Args:
+            p0:  (N, 3) array of ray start points in the profile's
+                 coordinate system
+            d:  (N, 3) array of ray direction cosines in the profile's
+                coordinate system
+            z_dir: +1 if propagation positive direction, -1 if otherwise
+            eps: numeric tolerance for convergence of any iterative procedure
+            max_iter: the maximum number of Newton iterations
+
+        Returns:
+            tuple: (N,) distances to the intersection points *s1*, (N, 3)
+            intersection points *p*, (N,) boolean *miss* mask and (N,)
+            number of iterations for each ray
+        '''
+        num_rays = len(p0)
+        p = np.array(p0, dtype=float)
+        iters = np.zeros(num_rays, dtype=int)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s1 = -self.f_array(p)/np.sum(d*self.df_array(p), axis=1)
+            active = np.flatnonzero(np.abs(s1) > eps)
+            iter = 0
+            while len(active) > 0 and iter < max_iter:
+                d_active = d[active]
+                p_active = p0[active] + s1[active, np.newaxis]*d_active
+                p[active] = p_active
+                s2 = s1[active] - (self.f_array(p_active) /
+                                   np.sum(d_active*self.df_array(p_active),
+                                          axis=1))
+                delta = np.abs(s2 - s1[active])
+                s1[active] = s2
+                iters[active] += 1
+                active = active[delta > eps]
+                iter += 1
+        miss = ~(np.isfinite(s1) & np.all(np.isfinite(p), axis=1))
+        if tracestats.recorder is not None:
+            tracestats.recorder.record_iterations_array(iters)
+        return s1, p, miss, iters
+
     def intersect_scipy(self, p0, d, eps, z_dir):
         ''' Intersect a profile, starting from an arbitrary point.
 
@@ -304,6 +405,22 @@ class Spherical(SurfaceProfile):
         p1 = p + s*d
         return s, p1
 
+    def intersect_array(self, p, d, eps, z_dir):
+        ''' Intersection with a sphere for an array of rays. '''
+        ax2 = self.cv
+        cx2 = self.cv * np.sum(p*p, axis=1) - 2*p[:, 2]
+        b = self.cv * np.sum(d*p, axis=1) - d[:, 2]
+        disc = b*b - ax2*cx2
+        miss = disc < 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Use z_dir to pick correct root
+            s = cx2/(z_dir*np.sqrt(np.where(miss, 0.0, disc)) - b)
+        miss |= ~np.isfinite(s)
+        s[miss] = np.nan
+
+        p1 = p + s[:, np.newaxis]*d
+        return s, p1, miss
+
     def f(self, p):
         return p[2] - 0.5*self.cv*(np.dot(p, p))
 
@@ -323,6 +440,25 @@ class Spherical(SurfaceProfile):
         else:
             return 0
 
+    def normal_array(self, p):
+        nrml = np.empty((len(p), 3))
+        nrml[:, 0] = -self.cv*p[:, 0]
+        nrml[:, 1] = -self.cv*p[:, 1]
+        nrml[:, 2] = 1.0 - self.cv*p[:, 2]
+        return nrml/np.linalg.norm(nrml, axis=1)[:, np.newaxis]
+
+    def sag_array(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        if self.cv != 0.0:
+            r = 1/self.cv
+            adj_sqr = r*r - x*x - y*y
+            with np.errstate(invalid='ignore'):
+                adj = np.sqrt(np.where(adj_sqr < 0.0, np.nan, adj_sqr))
+            return r*(1 - np.abs(adj/r))
+        else:
+            return np.zeros(x.shape)
+
     def profile(self, sd, dir=1, steps=6):
         '''Generate a profile curve for the segment sd.
         '''
@@ -509,6 +645,25 @@ class Conic(SurfaceProfile):
         p1 = p + s*d
         return s, p1
 
+    def intersect_array(self, p, d, eps, z_dir):
+        ''' Intersection with a conic for an array of rays. '''
+        ec = self.ec
+        ax2 = self.cv*(1. + self.cc*d[:, 2]*d[:, 2])
+        cx2 = self.cv*(p[:, 0]*p[:, 0] + p[:, 1]*p[:, 1] +
+                       ec*p[:, 2]*p[:, 2]) - 2.0*p[:, 2]
+        b = self.cv*(d[:, 0]*p[:, 0] + d[:, 1]*p[:, 1] +
+                     ec*d[:, 2]*p[:, 2]) - d[:, 2]
+        disc = b*b - ax2*cx2
+        miss = disc < 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Use z_dir to pick correct root
+            s = cx2/(z_dir*np.sqrt(np.where(miss, 0.0, disc)) - b)
+        miss |= ~np.isfinite(s)
+        s[miss] = np.nan
+
+        p1 = p + s[:, np.newaxis]*d
+        return s, p1, miss
+
     def f(self, p):
         return p[2] - 0.5*self.cv*(p[0]*p[0] +
                                    p[1]*p[1] +
@@ -528,6 +683,20 @@ class Conic(SurfaceProfile):
             raise TraceMissedSurfaceError
         return z
 
+    def normal_array(self, p):
+        nrml = np.empty((len(p), 3))
+        nrml[:, 0] = -self.cv*p[:, 0]
+        nrml[:, 1] = -self.cv*p[:, 1]
+        nrml[:, 2] = 1.0 - (self.cc+1.0)*self.cv*p[:, 2]
+        return nrml/np.linalg.norm(nrml, axis=1)[:, np.newaxis]
+
+    def sag_array(self, x, y):
+        r2 = np.asarray(x, dtype=float)**2 + np.asarray(y, dtype=float)**2
+        arg = 1. - (self.cc+1.0)*self.cv*self.cv*r2
+        with np.errstate(invalid='ignore'):
+            z = self.cv*r2/(1. + np.sqrt(np.where(arg < 0.0, np.nan, arg)))
+        return z
+
     def profile(self, sd, dir=1, steps=6):
         prf = []
         if len(sd) == 1:
@@ -765,6 +934,41 @@ class EvenPolynomial(SurfaceProfile):
         e_tot = e + e_asp
         return np.array([-e_tot*p[0], -e_tot*p[1], 1.0])
 
+    def sag_array(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        r2 = x*x + y*y
+        arg = 1. - (self.cc+1.0)*self.cv*self.cv*r2
+        with np.errstate(invalid='ignore'):
+            # sphere + conic contribution
+            z = self.cv*r2/(1. + np.sqrt(np.where(arg < 0.0, np.nan, arg)))
+
+        # polynomial asphere contribution - compute using Horner's Rule
+        z_asp = np.zeros_like(r2)
+        for coef in reversed(self.coefs[:self.max_nonzero_coef]):
+            z_asp = (z_asp + coef)*r2
+
+        return z + z_asp
+
+    def f_array(self, p):
+        return p[:, 2] - self.sag_array(p[:, 0], p[:, 1])
+
+    def df_array(self, p):
+        # sphere + conic contribution
+        r2 = p[:, 0]*p[:, 0] + p[:, 1]*p[:, 1]
+        arg = 1. - self.ec*self.cv*self.cv*r2
+        with np.errstate(invalid='ignore'):
+            e = self.cv/np.sqrt(np.where(arg < 0.0, np.nan, arg))
+
+        # polynomial asphere contribution - compute using Horner's Rule
+        e_asp = np.zeros_like(r2)
+        for i in reversed(range(self.max_nonzero_coef)):
+            e_asp = e_asp*r2 + 2.0*(i+1)*self.coefs[i]
+
+        e_tot = e + e_asp
+        return np.column_stack((-e_tot*p[:, 0], -e_tot*p[:, 1],
+                                np.ones_like(r2)))
+
     def profile(self, sd, dir=1, steps=21):
         return aspheric_profile(self, sd, dir, steps)
 
@@ -974,6 +1178,48 @@ class RadialPolynomial(SurfaceProfile):
         e_tot = e + e_asp
         return np.array([-e_tot*p[0], -e_tot*p[1], 1.0])
 
+    def sag_array(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        r2 = x*x + y*y
+        r = np.sqrt(r2)
+        arg = 1. - self.ec*self.cv*self.cv*r2
+        with np.errstate(invalid='ignore'):
+            # sphere + conic contribution
+            z = self.cv*r2/(1. + np.sqrt(np.where(arg < 0.0, np.nan, arg)))
+
+        # polynomial asphere contribution - compute using Horner's Rule
+        z_asp = np.zeros_like(r2)
+        for coef in reversed(self.coefs[:self.max_nonzero_coef]):
+            z_asp = (z_asp + coef)*r
+
+        return z + z_asp
+
+    def f_array(self, p):
+        return p[:, 2] - self.sag_array(p[:, 0], p[:, 1])
+
+    def df_array(self, p):
+        # sphere + conic contribution
+        r2 = p[:, 0]*p[:, 0] + p[:, 1]*p[:, 1]
+        r = np.sqrt(r2)
+        arg = 1. - self.ec*self.cv*self.cv*r2
+        with np.errstate(invalid='ignore'):
+            e = self.cv/np.sqrt(np.where(arg < 0.0, np.nan, arg))
+
+        # polynomial asphere contribution - compute using Horner's Rule
+        # The result is divided by r because we multiply by r's components
+        # p[0] and p[1] at the final normalization step.
+        e_asp = np.zeros_like(r2)
+        for i in reversed(range(self.max_nonzero_coef)):
+            e_asp = e_asp*r + (i+1)*self.coefs[i]
+        on_axis = r == 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            e_asp = np.where(on_axis, e_asp, e_asp/np.where(on_axis, 1.0, r))
+
+        e_tot = e + e_asp
+        return np.column_stack((-e_tot*p[:, 0], -e_tot*p[:, 1],
+                                np.ones_like(r2)))
+
     def profile(self, sd, dir=1, steps=21):
         return aspheric_profile(self, sd, dir, steps)
 
@@ -1193,13 +1439,63 @@ class YToroid(SurfaceProfile):
             c_coef += 2.0
             y_pow *= y2
 
-        dfdY = e + e_asp
+        dfdY = e + p[1]*e_asp
         Fx = -self.cR*p[0]
         Fy = (self.cR*self.fY(p[1]) - 1)*(dfdY)
         Fz = 1 - self.cR*p[2]
 
         return np.array([Fx, Fy, Fz])
 
+    def sag_array(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        fY = self.fY_array(y)
+        if self.cR == 0:
+            return fY
+        else:
+            rRp = self.rR - fY
+            arg = rRp*rRp - x*x
+            with np.errstate(invalid='ignore'):
+                z = rRp - np.sqrt(np.where(arg < 0.0, np.nan, arg))
+            return z + fY
+
+    def fY_array(self, y):
+        y2 = y*y
+        arg = 1. - (self.cc+1.0)*self.cv*self.cv*y2
+        with np.errstate(invalid='ignore'):
+            # sphere + conic contribution
+            z = self.cv*y2/(1. + np.sqrt(np.where(arg < 0.0, np.nan, arg)))
+
+        # polynomial asphere contribution - compute using Horner's Rule
+        z_asp = np.zeros_like(y2)
+        for coef in reversed(self.coefs[:self.max_nonzero_coef]):
+            z_asp = (z_asp + coef)*y2
+
+        return z + z_asp
+
+    def f_array(self, p):
+        fY = self.fY_array(p[:, 1])
+        return (p[:, 2] - fY -
+                self.cR*(p[:, 0]*p[:, 0] + p[:, 2]*p[:, 2] - fY*fY)/2)
+
+    def df_array(self, p):
+        # sphere + conic contribution
+        y2 = p[:, 1]*p[:, 1]
+        arg = 1. - (self.cc+1.0)*self.cv*self.cv*y2
+        with np.errstate(invalid='ignore'):
+            e = (self.cv*p[:, 1])/np.sqrt(np.where(arg < 0.0, np.nan, arg))
+
+        # polynomial asphere contribution - compute using Horner's Rule
+        e_asp = np.zeros_like(y2)
+        for i in reversed(range(self.max_nonzero_coef)):
+            e_asp = e_asp*y2 + 2.0*(i+1)*self.coefs[i]
+
+        dfdY = e + p[:, 1]*e_asp
+        Fx = -self.cR*p[:, 0]
+        Fy = (self.cR*self.fY_array(p[:, 1]) - 1)*(dfdY)
+        Fz = 1 - self.cR*p[:, 2]
+        return np.column_stack((Fx, Fy, Fz))
+
     def profile(self, sd, dir=1, steps=21):
         return aspheric_profile(self, sd, dir, steps)
 
@@ -1227,12 +1523,6 @@ class XToroid(YToroid):
         """
         super().__init__(c, cR, cc, r, rR, ec, coefs)
 
-    def normal(self, p):
-        """Returns the unit normal of the profile at point *p*. """
-
-        # note that normal() uses df() which takes care of reordering x & y
-        return super().normal(np.array([p[1], p[0], p[2]]))
-
     def sag(self, x, y):
         return super().sag(y, x)
 
@@ -1243,6 +1533,15 @@ class XToroid(YToroid):
         grad = super().df(np.array([p[1], p[0], p[2]]))
         return np.array([grad[1], grad[0], grad[2]])
 
+    def sag_array(self, x, y):
+        return super().sag_array(y, x)
+
+    def f_array(self, p):
+        return super().f_array(p[:, [1, 0, 2]])
+
+    def df_array(self, p):
+        return super().df_array(p[:, [1, 0, 2]])[:, [1, 0, 2]]
+
 
 dispatch = {
   (Spherical, Spherical): Spherical.copyDataFrom,
@@ -196,6 +196,15 @@ class Surface(interface.Interface):
 
         return is_inside
 
+    def point_inside_array(self, x, y):
+        if len(self.clear_apertures) > 0:
+            is_inside = np.ones(np.shape(x), dtype=bool)
+            for ca in self.clear_apertures:
+                is_inside &= ca.point_inside_array(x, y)
+            return is_inside
+        else:
+            return super().point_inside_array(x, y)
+
     def get_y_aperture_extent(self):
         """ returns [y_min, y_max] for the union of apertures """
         od = [1.0e10, -1.0e10]
@@ -249,6 +258,15 @@ class Surface(interface.Interface):
     def normal(self, p):
         return self.profile.normal(p)
 
+    def intersect_array(self, p0, d, eps=1.0e-12, z_dir=1.0):
+        return self.profile.intersect_array(p0, d, eps, z_dir)
+
+    def normal_array(self, p):
+        return self.profile.normal_array(p)
+
+    def sag_array(self, x, y):
+        return self.profile.sag_array(x, y)
+
 
 class DecenterData():
     """ Maintains data and actions for position and orientation changes.
@@ -361,6 +379,11 @@ class Aperture():
     def point_inside(self, x, y):
         pass
 
+    def point_inside_array(self, x, y):
+        """ Returns a boolean array, True if (x[i], y[i]) is inside. """
+        return np.array([bool(self.point_inside(xi, yi))
+                         for xi, yi in zip(x, y)], dtype=bool)
+
     def bounding_box(self):
         center = np.array([self.x_offset, self.y_offset])
         extent = np.array(self.dimension())
@@ -371,8 +394,8 @@ class Aperture():
         self.y_offset *= scale_factor
 
     def tform(self, x, y):
-        x -= self.x_offset
-        y -= self.y_offset
+        x = x - self.x_offset
+        y = y - self.y_offset
         return x, y
 
 
@@ -399,6 +422,10 @@ class Circular(Aperture):
         x, y = self.tform(x, y)
         return sqrt(x*x + y*y) <= self.radius
 
+    def point_inside_array(self, x, y):
+        x, y = self.tform(np.asarray(x), np.asarray(y))
+        return np.sqrt(x*x + y*y) <= self.radius
+
     def apply_scale_factor(self, scale_factor):
         super().apply_scale_factor(scale_factor)
         self.radius *= scale_factor
@@ -427,6 +454,11 @@ class Rectangular(Aperture):
         x, y = self.tform(x, y)
         return abs(x) <= self.x_half_width and abs(y) <= self.y_half_width
 
+    def point_inside_array(self, x, y):
+        x, y = self.tform(np.asarray(x), np.asarray(y))
+        return ((np.abs(x) <= self.x_half_width) &
+                (np.abs(y) <= self.y_half_width))
+
     def apply_scale_factor(self, scale_factor):
         super().apply_scale_factor(scale_factor)
         self.x_half_width *= scale_factor
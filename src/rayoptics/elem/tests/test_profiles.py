@@ -9,7 +9,10 @@ Created on Wed Oct 18 10:59:29 2017
 
 import unittest
 from pytest import approx
-from rayoptics.elem.profiles import Spherical, EvenPolynomial
+from rayoptics.elem.profiles import (Spherical, Conic, EvenPolynomial,
+                                     RadialPolynomial, YToroid, XToroid)
+from rayoptics.elem.surface import Surface
+from rayoptics.raytr.traceerror import TraceMissedSurfaceError
 from rayoptics.util.misc_math import normalize
 import numpy as np
 import numpy.testing as npt
@@ -154,5 +157,88 @@ class SphericalProfileTestCase(unittest.TestCase):
         npt.assert_allclose(dir_p1s1, dir_p1s1_truth, rtol=1e-14)
 
 
+class ArrayProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        y = np.linspace(-12., 12., 25)
+        self.p0 = np.array([[0., yi, -1.] for yi in y])
+        self.d0 = np.array([normalize(np.array([0., 0.02*yi, 1.]))
+                            for yi in y])
+        self.eps = 1.0e-12
+        self.z_dir = 1.0
+
+    def compare_to_scalar(self, prf):
+        s, p, miss = prf.intersect_array(self.p0, self.d0,
+                                         self.eps, self.z_dir)
+        for i in range(len(self.p0)):
+            try:
+                s_i, p_i = prf.intersect(self.p0[i], self.d0[i],
+                                         self.eps, self.z_dir)
+            except TraceMissedSurfaceError:
+                self.assertTrue(miss[i])
+                continue
+            self.assertFalse(miss[i])
+            self.assertAlmostEqual(s[i], s_i, places=12)
+            npt.assert_allclose(p[i], p_i, rtol=1e-12, atol=1e-12)
+            npt.assert_allclose(prf.normal_array(p[i:i+1])[0],
+                                prf.normal(p_i), rtol=1e-12, atol=1e-12)
+            self.assertAlmostEqual(prf.sag_array(p[i, 0], p[i, 1]),
+                                   prf.sag(p_i[0], p_i[1]), places=12)
+        return miss
+
+    def test_spherical(self):
+        miss = self.compare_to_scalar(Spherical(r=10.))
+        self.assertTrue(np.any(miss))
+        self.assertFalse(np.all(miss))
+        self.compare_to_scalar(Spherical(r=-25.))
+        self.compare_to_scalar(Spherical(c=0.))
+
+    def test_conic(self):
+        self.compare_to_scalar(Conic(r=10., cc=-1.))
+        self.compare_to_scalar(Conic(r=-20., cc=0.5))
+        miss = self.compare_to_scalar(Conic(r=10., cc=0.5))
+        self.assertTrue(np.any(miss))
+
+    def test_aspheres(self):
+        profiles = [
+            EvenPolynomial(r=20., cc=-0.5, coefs=[0., 1e-4, -2e-6, 1e-8]),
+            RadialPolynomial(r=-30., ec=0.5, coefs=[1e-3, 1e-4, -2e-5]),
+            YToroid(r=20., rR=-40., coefs=[0., 1e-4, 1e-6]),
+            XToroid(r=20., rR=-40., cc=-1., coefs=[0., 1e-4, 1e-6]),
+            ]
+        for prf in profiles:
+            prf.update()
+            self.compare_to_scalar(prf)
+
+            s, p, miss, iters = prf.intersect_spencer_array(
+                self.p0, self.d0, self.eps, self.z_dir)
+            self.assertTrue(np.all(iters[~miss] > 0))
+            self.assertTrue(np.all(iters < 1000))
+
+    def test_surface_delegation(self):
+        prf = EvenPolynomial(r=20., cc=-0.5, coefs=[0., 1e-4, -2e-6, 1e-8])
+        prf.update()
+        srf = Surface(profile=prf)
+        s, p, miss = srf.intersect_array(self.p0, self.d0, self.eps,
+                                         self.z_dir)
+        npt.assert_array_equal(s, prf.intersect_array(self.p0, self.d0,
+                                                      self.eps,
+                                                      self.z_dir)[0])
+        npt.assert_array_equal(srf.normal_array(p), prf.normal_array(p))
+        npt.assert_array_equal(srf.sag_array(p[:, 0], p[:, 1]),
+                               prf.sag_array(p[:, 0], p[:, 1]))
+
+    def test_toroid_normal(self):
+        """ the normal should agree with the gradient of f """
+        h = 1e-6
+        for prf in (YToroid(r=20., rR=-40., coefs=[1e-3, 1e-4, 1e-6]),
+                    XToroid(r=20., rR=-40., coefs=[1e-3, 1e-4, 1e-6])):
+            prf.update()
+            p = np.array([1., 3., 0.])
+            p[2] = prf.sag(p[0], p[1])
+            grad = np.array([(prf.f(p + h*e) - prf.f(p - h*e))/(2*h)
+                             for e in np.eye(3)])
+            npt.assert_allclose(prf.normal(p), normalize(grad), atol=1e-8)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=3)
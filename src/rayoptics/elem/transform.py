@@ -137,3 +137,27 @@ def transform_after_surface(interface, ray_seg):
         b4_pt, b4_dir = ray_seg[0], ray_seg[1]
 
     return b4_pt, b4_dir
+
+
+def transform_after_surface_array(interface, pts, dirs):
+    """Transform arrays of ray points and directions to the following seg.
+
+    This is the array counterpart of :func:`transform_after_surface`.
+
+    Args:
+        interface: the :class:'~seq.interface.Interface' for the path sequence
+        pts: (N, 3) array of ray points on **interface**
+        dirs: (N, 3) array of ray direction cosines exiting **interface**
+
+    Returns:
+        (**b4_pts**, **b4_dirs**), (N, 3) arrays wrt the following seg
+    """
+    if interface.decenter:
+        r, t = interface.decenter.tform_after_surf()
+        if r is None:
+            return pts - t, dirs
+        else:
+            # row vector form of rt.dot(v)
+            return (pts - t).dot(r), dirs.dot(r)
+    else:
+        return pts, dirs
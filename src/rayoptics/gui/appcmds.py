@@ -345,27 +345,33 @@ def set_vignetting(opt_model, gui_parent=None):
     """ From existing fields and clear apertures, calculate vignetting. """
     vigcalc.set_vig(opt_model)
     if gui_parent is None:
-        opt_model.update_model(src_model=opt_model['seq_model'])
+        opt_model.update_model(src_model=opt_model['seq_model'],
+                               changed='fields')
     else:
-        gui_parent.refresh_gui(src_model=opt_model['seq_model'])
+        gui_parent.refresh_gui(src_model=opt_model['seq_model'],
+                               changed='fields')
 
 
 def set_apertures(opt_model, gui_parent=None):
     """ From existing fields and vignetting, calculate clear apertures. """
     vigcalc.set_ape(opt_model)
     if gui_parent is None:
-        opt_model.update_model(src_model=opt_model['seq_model'])
+        opt_model.update_model(src_model=opt_model['seq_model'],
+                               changed='apertures')
     else:
-        gui_parent.refresh_gui(src_model=opt_model['seq_model'])
+        gui_parent.refresh_gui(src_model=opt_model['seq_model'],
+                               changed='apertures')
 
 
 def set_pupil(opt_model, gui_parent=None):
     """ From existing stop size, calculate pupil spec and vignetting. """
     vigcalc.set_pupil(opt_model)
     if gui_parent is None:
-        opt_model.update_model(src_model=opt_model['seq_model'])
+        opt_model.update_model(src_model=opt_model['seq_model'],
+                               changed=['pupil', 'fields'])
     else:
-        gui_parent.refresh_gui(src_model=opt_model['seq_model'])
+        gui_parent.refresh_gui(src_model=opt_model['seq_model'],
+                               changed=['pupil', 'fields'])
 
 
 def refocus(opt_model, gui_parent=None):
@@ -374,9 +380,11 @@ def refocus(opt_model, gui_parent=None):
     opt_model['optical_spec']['focus'].focus_shift = focus_shift
 
     if gui_parent is None:
-        opt_model.update_model(src_model=opt_model['optical_spec'])
+        opt_model.update_model(src_model=opt_model['optical_spec'],
+                               changed='focus')
     else:
-        gui_parent.refresh_gui(src_model=opt_model['optical_spec'])
+        gui_parent.refresh_gui(src_model=opt_model['optical_spec'],
+                               changed='focus')
 
 
 def create_ray_fan_view(opt_model, data_type, gui_parent=None):
@@ -365,9 +365,24 @@ class Wavefront():
 class DiffractionPSF():
     """Point Spread Function (PSF) calculation and display.
 
+    The PSF is calculated by a :class:`~.analyses.PSFEngine`, that is kept
+    between updates. The size of the sampling array is rounded up to a size
+    with a fast FFT.
+
+    With method 'mft', the PSF is calculated by a
+    :class:`~.analyses.MFTEngine` on a window of the image plane instead.
+    The image sampling is then set by **image_window** and **maxdim**, not
+    by the FFT padding.
+
     Attributes:
         pupil_grid: a RayGrid instance
-        maxdim: the size of the sampling array
+        maxdim: the size of the sampling array; for 'mft', the number of
+                samples across the image window
+        apodization: optional pupil amplitude array, see
+                     :meth:`~.analyses.PSFEngine.psf`
+        method: 'fft' or 'mft'
+        image_window: for 'mft', the half width of the image window, in
+                      system units. If None, the window is 5 Airy radii
         title: title, if desired, of this plot panel
         yaxis_ticks_position: 'left' or 'right', default is 'left'
         cmap: color map for plot, defaults to 'RdBu_r'
@@ -375,9 +390,17 @@ class DiffractionPSF():
     """
 
     def __init__(self, pupil_grid, maxdim,
-                 yaxis_ticks_position='left', **kwargs):
+                 yaxis_ticks_position='left', apodization=None,
+                 method='fft', image_window=None, **kwargs):
         self.pupil_grid = pupil_grid
         self.maxdim = maxdim
+        self.apodization = apodization
+        if method not in ('fft', 'mft'):
+            raise ValueError(f"unknown PSF method '{method}', "
+                             "expected 'fft' or 'mft'")
+        self.method = method
+        self.image_window = image_window
+        self.psf_engine = None
 
         if 'title' in kwargs:
             self.title = kwargs.pop('title', None)
@@ -396,11 +419,7 @@ class DiffractionPSF():
         self.update_data()
 
     def init_axis(self, ax):
-        pupil_grid = self.pupil_grid
-        delta_x, delta_xp = analyses.calc_psf_scaling(pupil_grid,
-                                                      pupil_grid.num_rays,
-                                                      self.maxdim)
-        image_scale = self.image_scale = delta_xp * self.maxdim
+        image_scale = self.image_scale
         ax.set_xlim(-image_scale, image_scale)
         ax.set_ylim(-image_scale, image_scale)
         ax.tick_params(labelbottom=False, labelleft=False)
@@ -414,10 +433,33 @@ class DiffractionPSF():
         self.plot()
 
     def update_data(self, build='rebuild'):
-        self.pupil_grid.update_data(build=build)
-        ndim = self.pupil_grid.num_rays
+        pupil_grid = self.pupil_grid
+        pupil_grid.update_data(build=build)
+        ndim = pupil_grid.num_rays
         maxdim = self.maxdim
-        self.AP = analyses.calc_psf(self.pupil_grid.grid[2], ndim, maxdim)
+        psf_engine = self.psf_engine
+        if self.method == 'mft':
+            samples, mft_samples = analyses.psf_image_window(
+                pupil_grid, maxdim, image_window=self.image_window)
+            if (not isinstance(psf_engine, analyses.MFTEngine) or
+                    psf_engine.ndim != ndim or
+                    not np.array_equal(psf_engine.x_samples, mft_samples)):
+                self.psf_engine = psf_engine = analyses.MFTEngine(
+                    ndim, mft_samples)
+            # extend the image to the edges of the outer samples
+            self.image_scale = samples[-1] + (samples[-1] - samples[-2])/2
+        else:
+            if (not isinstance(psf_engine, analyses.PSFEngine) or
+                    psf_engine.ndim != ndim or psf_engine.maxdim != maxdim):
+                self.psf_engine = psf_engine = analyses.PSFEngine(ndim,
+                                                                  maxdim)
+            size = psf_engine.size
+            delta_x, delta_xp = analyses.calc_psf_scaling(pupil_grid, ndim,
+                                                          size)
+            self.image_scale = delta_xp * size
+        self.AP = psf_engine.psf(pupil_grid.grid[2],
+                                 mask=pupil_grid.pupil_mask(),
+                                 apodization=self.apodization)
         return self
 
     def plot(self, ax):
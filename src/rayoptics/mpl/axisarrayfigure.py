@@ -16,6 +16,7 @@ import numpy as np
 
 from rayoptics.mpl.styledfigure import StyledFigure
 
+from rayoptics.raytr.executor import SerialExecutor, get_executor
 from rayoptics.raytr.waveabr import wave_abr_full_calc
 import rayoptics.optical.model_constants as mc
 
@@ -40,18 +41,106 @@ def clip_to_range(rgb_list, lower, upper):
     return rgbc
 
 
+def ray_abr(p, xy, ray_pkg, fld, wvl, foc):
+    if ray_pkg[mc.ray] is not None:
+        image_pt = fld.ref_sphere[0]
+        ray = ray_pkg[mc.ray]
+        dist = foc / ray[-1][mc.d][2]
+        defocused_pt = ray[-1][mc.p] + dist*ray[-1][mc.d]
+        t_abr = defocused_pt - image_pt
+        return t_abr[xy]
+    else:
+        return None
+
+
+def eval_abr_fan(opt_model, i, j, num_rays):
+    """ transverse ray aberration fans for field i and x/y fan j """
+    return opt_model.seq_model.trace_fan(ray_abr, i, j, num_rays=num_rays)
+
+
+def eval_opd_fan(opt_model, i, j, num_rays):
+    """ OPD fans for field i and x/y fan j """
+    central_wvl = opt_model.optical_spec.spectral_region.central_wvl
+    convert_to_waves = 1/opt_model.nm_to_sys_units(central_wvl)
+
+    def opd(p, xy, ray_pkg, fld, wvl, foc):
+        if ray_pkg[mc.ray] is not None:
+            fod = opt_model['analysis_results']['parax_data'].fod
+            opd = wave_abr_full_calc(fod, fld, wvl, foc, ray_pkg,
+                                     fld.chief_ray, fld.ref_sphere)
+            return convert_to_waves*opd
+        else:
+            return None
+
+    return opt_model.seq_model.trace_fan(opd, i, j, num_rays=num_rays)
+
+
+def spot(p, wi, ray_pkg, fld, wvl, foc):
+    if ray_pkg is not None:
+        image_pt = fld.ref_sphere[0]
+        ray = ray_pkg[mc.ray]
+        dist = foc / ray[-1][mc.d][2]
+        defocused_pt = ray[-1][mc.p] + dist*ray[-1][mc.d]
+        t_abr = defocused_pt - image_pt
+        return np.array([t_abr[0], t_abr[1]])
+    else:
+        return None
+
+
+def eval_spot_grid(opt_model, i, j, num_rays):
+    """ spot diagrams in all wavelengths for field i """
+    return opt_model.seq_model.trace_grid(spot, i, num_rays=num_rays,
+                                          form='list', append_if_none=False)
+
+
+def eval_wavefront_grid(opt_model, i, j, num_rays):
+    """ wavefront map for field i and wavelength j """
+    central_wvl = opt_model.optical_spec.spectral_region.central_wvl
+    convert_to_waves = 1/opt_model.nm_to_sys_units(central_wvl)
+
+    def wave(p, wi, ray_pkg, fld, wvl, foc):
+        x = p[0]
+        y = p[1]
+        if ray_pkg is not None:
+            fod = opt_model['analysis_results']['parax_data'].fod
+            opd = wave_abr_full_calc(fod, fld, wvl, foc, ray_pkg,
+                                     fld.chief_ray, fld.ref_sphere)
+            opd = convert_to_waves*opd
+        else:
+            opd = 0.0
+        return np.array([x, y, opd])
+
+    return opt_model.seq_model.trace_grid(wave, i, wl=j, num_rays=num_rays,
+                                          form='grid', append_if_none=True)
+
+
 class AxisArrayFigure(StyledFigure):
+    """ Base class for figures with an array of (field, wavelength) plots
+
+    Each plot in the array is computed by **eval_fct**, with the signature
+    `eval_fct(opt_model, i, j, num_rays)`. The plots are independent of each
+    other and are evaluated by an executor from :mod:`~.executor`;
+    a process pool executor requires eval_fct to be a module level function.
+
+    The pool executors work on a snapshot of the model, so a new executor is
+    created for each update of the figure. **executor** is either the kind
+    of executor, 'serial', 'thread' or 'process', passed to
+    :func:`~.executor.get_executor`, or a function that takes the
+    opt_model and returns an executor. If executor is None, the plots are
+    evaluated serially.
+    """
 
     def __init__(self, opt_model,
                  num_rays=21,
                  scale_type=Fit.All,
                  user_scale_value=0.1,
                  num_rows=1, num_cols=1,
-                 eval_fct=None, **kwargs):
+                 eval_fct=None, executor=None, **kwargs):
         self.opt_model = opt_model
         self.num_rays = num_rays
         self.user_scale_value = user_scale_value
         self.scale_type = scale_type
+        self.executor = executor
 
         super().__init__(**kwargs)
 
@@ -85,6 +174,28 @@ class AxisArrayFigure(StyledFigure):
     def wvl_to_sys_units(self, wvl):
         return self.opt_model.nm_to_sys_units(wvl)
 
+    def eval_cells(self):
+        """ returns an iterator over eval_fct results for all of the plots
+
+        The results are in the order used by update_data(), i.e. both rows
+        and columns are reversed.
+        """
+        cells = [(i, j, self.num_rays)
+                 for i in reversed(range(self.num_rows))
+                 for j in reversed(range(self.num_cols))]
+        with self.make_executor() as executor:
+            results = executor.map(self.eval_fct, cells)
+        return iter(results)
+
+    def make_executor(self):
+        """ returns a new executor for the current state of the model """
+        if self.executor is None:
+            return SerialExecutor(self.opt_model)
+        elif isinstance(self.executor, str):
+            return get_executor(self.opt_model, self.executor)
+        else:
+            return self.executor(self.opt_model)
+
     def refresh(self, **kwargs):
         self.update_data(**kwargs)
         self.plot()
@@ -104,38 +215,7 @@ class RayFanFigure(AxisArrayFigure):
         self.max_value_all = 0.0
         self.override_style = override_style
         self.do_smoothing = do_smoothing
-        seq_model = opt_model.seq_model
         osp = opt_model.optical_spec
-        central_wvl = osp.spectral_region.central_wvl
-        convert_to_waves = 1/opt_model.nm_to_sys_units(central_wvl)
-
-        def ray_abr(p, xy, ray_pkg, fld, wvl, foc):
-            if ray_pkg[mc.ray] is not None:
-                image_pt = fld.ref_sphere[0]
-                ray = ray_pkg[mc.ray]
-                dist = foc / ray[-1][mc.d][2]
-                defocused_pt = ray[-1][mc.p] + dist*ray[-1][mc.d]
-                t_abr = defocused_pt - image_pt
-                return t_abr[xy]
-            else:
-                return None
-
-        def opd(p, xy, ray_pkg, fld, wvl, foc):
-            if ray_pkg[mc.ray] is not None:
-                fod = opt_model['analysis_results']['parax_data'].fod
-                opd = wave_abr_full_calc(fod, fld, wvl, foc, ray_pkg,
-                                         fld.chief_ray, fld.ref_sphere)
-                return convert_to_waves*opd
-            else:
-                return None
-
-        def eval_abr_fan(i, j):
-            fld, wvl, foc = osp.lookup_fld_wvl_focus(i)
-            return seq_model.trace_fan(ray_abr, i, j, num_rays=self.num_rays)
-
-        def eval_opd_fan(i, j):
-            fld, wvl, foc = osp.lookup_fld_wvl_focus(i)
-            return seq_model.trace_fan(opd, i, j, num_rays=self.num_rays)
 
         if data_type == 'Ray':
             eval_fan = eval_abr_fan
@@ -148,12 +228,13 @@ class RayFanFigure(AxisArrayFigure):
     def update_data(self, build='rebuild', **kwargs):
         do_smoothing = kwargs.get('do_smoothing', self.do_smoothing)
         self.axis_data_array = []
+        results = self.eval_cells()
         for i in reversed(range(self.num_rows)):
             row = []
             for j in reversed(range(self.num_cols)):
                 x_smooth = []
                 y_smooth = []
-                x_data, y_data, max_value, rc = self.eval_fct(i, j)
+                x_data, y_data, max_value, rc = next(results)
 #                x_data, y_data, max_value, rc = self.eval_axis_data(i, j)
 #                rc = clip_to_range(rc, 0.0, 1.0)
                 for k in range(len(x_data)):
@@ -224,27 +305,10 @@ class SpotDiagramFigure(AxisArrayFigure):
 
     def __init__(self, opt_model, **kwargs):
         self.max_value_all = 0.0
-        seq_model = opt_model.seq_model
         osp = opt_model.optical_spec
 
-        def spot(p, wi, ray_pkg, fld, wvl, foc):
-            if ray_pkg is not None:
-                image_pt = fld.ref_sphere[0]
-                ray = ray_pkg[mc.ray]
-                dist = foc / ray[-1][mc.d][2]
-                defocused_pt = ray[-1][mc.p] + dist*ray[-1][mc.d]
-                t_abr = defocused_pt - image_pt
-                return np.array([t_abr[0], t_abr[1]])
-            else:
-                return None
-
-        def eval_grid(i, j):
-            fld, wvl, foc = osp.lookup_fld_wvl_focus(i, wl=j)
-            return seq_model.trace_grid(spot, i, num_rays=self.num_rays,
-                                        form='list', append_if_none=False)
-
         num_flds = len(osp.field_of_view.fields)
-        super().__init__(opt_model, eval_fct=eval_grid,
+        super().__init__(opt_model, eval_fct=eval_spot_grid,
                          num_rows=num_flds, num_cols=1, **kwargs)
 
     def init_axis(self, ax):
@@ -254,10 +318,11 @@ class SpotDiagramFigure(AxisArrayFigure):
 
     def update_data(self, build='rebuild', **kwargs):
         self.axis_data_array = []
+        results = self.eval_cells()
         for i in reversed(range(self.num_rows)):
             row = []
             for j in reversed(range(self.num_cols)):
-                grids, rc = self.eval_fct(i, j)
+                grids, rc = next(results)
                 max_val = max([max(np.max(g), -np.min(g)) for g in grids])
                 row.append((grids, max_val, rc))
             self.axis_data_array.append(row)
@@ -312,31 +377,11 @@ class WavefrontFigure(AxisArrayFigure):
 
     def __init__(self, opt_model, **kwargs):
         self.max_value_all = 0.0
-        seq_model = opt_model.seq_model
         osp = opt_model.optical_spec
-        central_wvl = osp.spectral_region.central_wvl
-        convert_to_waves = 1/opt_model.nm_to_sys_units(central_wvl)
-
-        def wave(p, wi, ray_pkg, fld, wvl, foc):
-            x = p[0]
-            y = p[1]
-            if ray_pkg is not None:
-                fod = opt_model['analysis_results']['parax_data'].fod
-                opd = wave_abr_full_calc(fod, fld, wvl, foc, ray_pkg,
-                                         fld.chief_ray, fld.ref_sphere)
-                opd = convert_to_waves*opd
-            else:
-                opd = 0.0
-            return np.array([x, y, opd])
-
-        def eval_grid(i, j):
-            fld, wvl, foc = osp.lookup_fld_wvl_focus(i, wl=j)
-            return seq_model.trace_grid(wave, i, wl=j, num_rays=self.num_rays,
-                                        form='grid', append_if_none=True)
 
         num_flds = len(osp.field_of_view.fields)
         num_wvls = len(osp.spectral_region.wavelengths)
-        super().__init__(opt_model, eval_fct=eval_grid,
+        super().__init__(opt_model, eval_fct=eval_wavefront_grid,
                          num_rows=num_flds, num_cols=num_wvls, **kwargs)
 
     def init_axis(self, ax):
@@ -349,10 +394,11 @@ class WavefrontFigure(AxisArrayFigure):
     def update_data(self, build='rebuild', **kwargs):
         self.axis_data_array = []
         self.max_value_all = 0.0
+        results = self.eval_cells()
         for i in reversed(range(self.num_rows)):
             row = []
             for j in reversed(range(self.num_cols)):
-                grids, rc = self.eval_fct(i, j)
+                grids, rc = next(results)
                 g = grids[0]
                 g = np.rollaxis(g, 2)
                 max_value = max(np.max(g[2]), -np.min(g[2]))
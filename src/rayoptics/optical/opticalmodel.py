@@ -9,6 +9,7 @@
 """
 import os.path
 import json_tricks
+import numpy as np
 from collections.abc import Sequence
 from pathlib import Path
 
@@ -23,10 +24,103 @@ from rayoptics.elem.parttree import (PartTree, elements_from_sequence)
 from rayoptics.parax.paraxialdesign import ParaxialModel
 from rayoptics.seq.sequential import SequentialModel
 from rayoptics.raytr.opticalspec import OpticalSpecs
+from rayoptics.raytr import tracestats
+from rayoptics.raytr.trace import ChiefRayCache
 from rayoptics.parax.specsheet import create_specsheet_from_model
 from rayoptics.optical.model_enums import get_dimension_for_type
 
 
+# The stages of OpticalModel.update_model, in the order they are run
+update_stages = ('indices', 'transforms', 'spec', 'first_order', 'aiming',
+                 'paraxial', 'apertures', 'elements')
+
+# The update stages directly affected by each kind of model change
+change_dependencies = {
+    'surfaces': ('indices', 'transforms'),
+    'gaps': ('transforms',),
+    'media': ('indices',),
+    'wavelengths': ('indices', 'spec'),
+    'fields': ('spec',),
+    'pupil': ('spec',),
+    'focus': (),
+    'apertures': ('elements',),
+    'elements': ('elements',),
+    }
+
+# The update stages that use the results of each stage
+stage_dependencies = {
+    'indices': ('first_order',),
+    'transforms': ('first_order', 'elements'),
+    'spec': ('first_order',),
+    'first_order': ('aiming', 'paraxial'),
+    'aiming': ('apertures',),
+    'paraxial': (),
+    'apertures': ('elements',),
+    'elements': (),
+    }
+
+
+def stages_for_changes(changes):
+    """ returns the set of update stages affected by **changes**
+
+    Args:
+        changes: a change key, or iterable of change keys, from
+                 `change_dependencies`
+
+    Raises:
+        ValueError: if a change key isn't recognized
+    """
+    if isinstance(changes, str):
+        changes = (changes,)
+    stages = set()
+    pending = []
+    for change in changes:
+        if change not in change_dependencies:
+            raise ValueError(f"unknown model change: '{change}'")
+        pending.extend(change_dependencies[change])
+    while pending:
+        stage = pending.pop()
+        if stage not in stages:
+            stages.add(stage)
+            pending.extend(stage_dependencies[stage])
+    return stages
+
+
+# the attributes of a Field that are computed by the model update
+field_results = ('aim_pt', 'chief_ray', 'ref_sphere', 'stop_pt', 'aim_key',
+                 'pupil_rays')
+
+
+def state_key(obj, exclude=()):
+    """ returns a comparable key of the data attributes of **obj**
+
+    Numbers, strings, arrays and lists of these are included; attributes
+    holding other objects, e.g. references to parent models, are skipped.
+
+    Args:
+        obj: the object whose `vars` are keyed
+        exclude: names of attributes to leave out of the key
+    """
+    def value_key(v):
+        if isinstance(v, (str, bool, int, float, np.number)) or v is None:
+            return v
+        elif isinstance(v, np.ndarray):
+            return v.dtype.str, v.shape, v.tobytes()
+        elif isinstance(v, (list, tuple)):
+            keys = tuple(value_key(item) for item in v)
+            return None if Ellipsis in keys else keys
+        return Ellipsis
+
+    key = []
+    for name, val in sorted(vars(obj).items()):
+        if name not in exclude:
+            val_key = value_key(val)
+            if val_key is not Ellipsis:
+                key.append((name, val_key))
+    return type(obj).__name__, tuple(key)
+
+
+
 class SystemSpec:
     """ Container for units and other system level constants
 
@@ -118,11 +212,17 @@ class OpticalModel:
         optical_spec: :class:`~rayoptics.raytr.opticalspec.OpticalSpecs`
         parax_model: :class:`~rayoptics.parax.paraxialdesign.ParaxialModel`
         ele_model: :class:`~rayoptics.elem.elements.ElementModel`
+        trace_stats: :class:`~rayoptics.raytr.tracestats.TraceStats` report
+                     of the last instrumented ray traces, or None
+        chief_ray_cache: :class:`~rayoptics.raytr.trace.ChiefRayCache` of
+                         chief rays and reference spheres
     """
 
     def __init__(self, radius_mode=False, specsheet=None, **kwargs):
         self.ro_version = rayoptics.__version__
         self.radius_mode = radius_mode
+        self.trace_stats = None
+        self.chief_ray_cache = ChiefRayCache()
 
         self.map_submodels(specsheet=specsheet, **kwargs)
 
@@ -217,6 +317,10 @@ class OpticalModel:
         if hasattr(self, 'analysis_results'):
             del attrs['analysis_results']
         del attrs['_submodels']
+        attrs.pop('trace_stats', None)
+        attrs.pop('chief_ray_cache', None)
+        attrs.pop('_update_signature', None)
+        attrs.pop('_change_state', None)
         return attrs
 
     def listobj_str(self):
@@ -226,6 +330,25 @@ class OpticalModel:
              o_str += f"{k}: {v}\n"
         return o_str
 
+    def enable_trace_stats(self, reset=True):
+        """Start collecting per-surface ray trace statistics.
+
+        Args:
+            reset: if True, start a new :class:`~.tracestats.TraceStats`
+                   report, else continue accumulating into the current one
+
+        Returns:
+            the enabled :class:`~.tracestats.TraceStats`, also available as
+            the **trace_stats** attribute
+        """
+        if reset or self.trace_stats is None:
+            self.trace_stats = tracestats.TraceStats()
+        return tracestats.enable(self.trace_stats)
+
+    def disable_trace_stats(self):
+        """Stop collecting ray trace statistics; trace_stats is retained. """
+        tracestats.disable()
+
     def set_from_specsheet(self, specsheet=None):
         if specsheet:
             self.specsheet = specsheet
@@ -281,6 +404,8 @@ class OpticalModel:
     def sync_to_restore(self):
         if not hasattr(self, 'ro_version'):
             self.ro_version = rayoptics.__version__
+        self.trace_stats = None
+        self.chief_ray_cache = ChiefRayCache()
 
         self.profile_dict = (self.profile_dict if hasattr(self, 'profile_dict')
                              else {})
@@ -326,27 +451,134 @@ class OpticalModel:
                     - 'update': number of nodes unchanged, just the parameters
     
                 - src_model: model that originated the modification
+                - changed: the kinds of change made since the last update,
+                  a key or list of keys of :data:`change_dependencies`:
+                  'surfaces', 'gaps', 'media', 'wavelengths', 'fields',
+                  'pupil', 'focus', 'apertures' or 'elements'. Only the
+                  update stages that depend on the changes are run. If
+                  changed is None, the changes are detected by comparing
+                  the model with its state at the last update, see
+                  :meth:`detect_changes`. If build is 'rebuild', or the
+                  number of surfaces, fields or wavelengths changed, or a
+                  change can't be detected, the whole model is updated.
 
         """
-        self['seq_model'].update_model(**kwargs)
-        self['optical_spec'].update_model(**kwargs)
-        self.update_optical_properties(**kwargs)
-
+        stages = self.stages_to_update(**kwargs)
         sm = self['seq_model']
-        em = self['ele_model']
-        pt = self['part_tree']
-        # generate elements if there are standalone interfaces (or no elements)
-        if (len(pt.nodes_with_tag(tag='#element')) == 0 or
-            len([ifc for ifc in sm.ifcs 
-                 if pt.parent_node(ifc) is None]) > 0):
-            elements_from_sequence(em, sm, pt)
-
-        self['ele_model'].update_model(**kwargs)
-        self['part_tree'].update_model(**kwargs)
+        osp = self['optical_spec']
+
+        if 'indices' in stages:
+            sm.update_indices()
+        if 'transforms' in stages:
+            sm.update_transforms()
+        if 'indices' in stages or 'transforms' in stages:
+            sm.new_revision()
+        if 'spec' in stages:
+            osp.update_model(**kwargs)
+        if 'first_order' in stages:
+            osp.update_first_order()
+        if 'aiming' in stages:
+            osp.update_aiming()
+        if 'paraxial' in stages:
+            self['parax_model'].update_model(**kwargs)
+        if 'apertures' in stages:
+            sm.update_optical_properties(**kwargs)
+
+        if 'elements' in stages:
+            em = self['ele_model']
+            pt = self['part_tree']
+            # generate elements if there are standalone interfaces
+            #  (or no elements)
+            if (len(pt.nodes_with_tag(tag='#element')) == 0 or
+                len([ifc for ifc in sm.ifcs 
+                     if pt.parent_node(ifc) is None]) > 0):
+                elements_from_sequence(em, sm, pt)
+
+            em.update_model(**kwargs)
+            pt.update_model(**kwargs)
+
+        self._update_signature = self.update_signature()
+        self._change_state = self.change_state()
         if self.specsheet is None:
             self.specsheet = create_specsheet_from_model(self)
             self.map_submodels()
 
+    def update_signature(self):
+        """ returns the number of surfaces, fields and wavelengths """
+        return (len(self['seq_model'].ifcs),
+                len(self['optical_spec']['fov'].fields),
+                len(self['optical_spec']['wvls'].wavelengths))
+
+    def change_state(self):
+        """ returns a dict of the model inputs for each kind of change
+
+        The keys are those of :data:`change_dependencies`. The state of the
+        element model isn't included.
+        """
+        sm = self['seq_model']
+        osp = self['optical_spec']
+        fov = osp['fov']
+        ifcs_state = []
+        aps_state = []
+        for ifc in sm.ifcs:
+            ifcs_state.append((state_key(ifc, exclude=('max_aperture',)),
+                               state_key(ifc.profile),
+                               None if ifc.decenter is None
+                               else state_key(ifc.decenter)))
+            aps_state.append((ifc.max_aperture,
+                              tuple(state_key(ap) for ap in
+                                    getattr(ifc, 'clear_apertures', []) +
+                                    getattr(ifc, 'edge_apertures', []))))
+        return {
+            'surfaces': (sm.stop_surface, tuple(sm.z_dir),
+                         state_key(self['system_spec']), tuple(ifcs_state)),
+            'gaps': tuple(g.thi for g in sm.gaps),
+            'media': (sm.spectral_sampling,
+                      tuple(state_key(g.medium) for g in sm.gaps)),
+            'wavelengths': state_key(osp['wvls']),
+            'fields': (state_key(osp), state_key(fov),
+                       tuple(state_key(f, exclude=field_results)
+                             for f in fov.fields)),
+            'pupil': state_key(osp['pupil']),
+            'focus': state_key(osp['focus']),
+            'apertures': (sm.do_apertures, getattr(sm, 'aperture_rays', None),
+                          tuple(aps_state)),
+            }
+
+    def detect_changes(self):
+        """ returns the kinds of change made since the last update
+
+        Returns:
+            a list of keys of :data:`change_dependencies`, or None if the
+            model hasn't been updated before
+        """
+        last_state = getattr(self, '_change_state', None)
+        if last_state is None:
+            return None
+        state = self.change_state()
+        return [change for change in change_dependencies
+                if change in state and state[change] != last_state[change]]
+
+    def stages_to_update(self, changed=None, build=None, **kwargs):
+        """ returns the set of update_model stages required by **changed**
+
+        If **changed** is None, the changes are found by
+        :meth:`detect_changes`; edits of the element model aren't detected,
+        so the 'elements' stage is always run. All stages are required for a
+        rebuild, if the changes can't be detected, or if the number of
+        surfaces, fields or wavelengths is different than at the last update.
+        """
+        if (build == 'rebuild' or
+                self.update_signature() != getattr(self, '_update_signature',
+                                                   None)):
+            return set(update_stages)
+        if changed is None:
+            changed = self.detect_changes()
+            if changed is None:
+                return set(update_stages)
+            return stages_for_changes(changed) | {'elements'}
+        return stages_for_changes(changed)
+
     def update_optical_properties(self, **kwargs):
         """Compute first order and other optical properties. """
 
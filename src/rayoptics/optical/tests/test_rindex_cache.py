@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the refractive index cache and the spectral index tables"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+
+from opticalglass import glassfactory as gfact
+from opticalglass import modelglass as mg
+from opticalglass import opticalmedium as om
+
+import rayoptics as ro
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import batchtrace as bt
+from rayoptics.seq.medium import RIndexCache, tabulate_rindex
+
+
+class RIndexCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = RIndexCache(maxsize=4)
+
+    def test_catalog_glass(self):
+        cache = self.cache
+        glass = gfact.create_glass('N-BK7', 'Schott')
+        n_d = cache.rindex(glass, 'd')
+        self.assertEqual(n_d, glass.rindex('d'))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        # a spectral line and its wavelength share the same entry
+        cache.rindex(glass, 587.5618)
+        # a separate instance of the same catalog glass is a hit
+        cache.rindex(gfact.create_glass('N-BK7', 'Schott'), 'd')
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_model_glass_invalidation(self):
+        cache = self.cache
+        glass = mg.ModelGlass(1.517, 64.2, '517642')
+        n_517 = cache.rindex(glass, 486.1327)
+        glass.update(1.620, 36.4)
+        n_620 = cache.rindex(glass, 486.1327)
+        self.assertNotEqual(n_517, n_620)
+        self.assertEqual(n_620, glass.rindex(486.1327))
+        self.assertEqual(cache.misses, 2)
+
+    def test_uncached_media(self):
+        cache = self.cache
+        self.assertEqual(cache.rindex(om.Air(), 'd'), 1.0)
+        self.assertEqual(cache.rindex(om.ConstantIndex(1.5, 'n:1.5'), 'd'),
+                         1.5)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_bound(self):
+        cache = self.cache
+        glass = mg.ModelGlass(1.517, 64.2, '517642')
+        wvls = [450., 500., 550., 600., 650.]
+        for w in wvls:
+            cache.rindex(glass, w)
+        self.assertEqual(len(cache), cache.maxsize)
+        # the least recently used wavelength was evicted
+        cache.rindex(glass, wvls[0])
+        self.assertEqual(cache.misses, len(wvls) + 1)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+
+class SpectralIndexTableTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'codev/tests/ag_dblgauss.seq')
+        self.sm = self.opm['seq_model']
+        self.wvls = np.linspace(450., 680., 24)
+
+    def direct_rndx(self, wvl):
+        return [g.medium.rindex(wvl) for g in self.sm.gaps]
+
+    def test_interpolated_indices(self):
+        sm = self.sm
+        table = sm.set_spectral_sampling((400., 750.), num_wvls=200)
+        self.assertEqual(table.rndx.shape, (len(sm.gaps), 200))
+        for wvl in self.wvls:
+            npt.assert_allclose(sm.rndx_for_wavelength(wvl),
+                                self.direct_rndx(wvl), atol=1e-9)
+        # the path at an arbitrary wavelength uses the table
+        path_rndx = [sg[3] for sg in sm.path(wl=self.wvls[3])]
+        npt.assert_allclose(path_rndx[:-1], self.direct_rndx(self.wvls[3]),
+                            atol=1e-9)
+        # spec wavelengths are still read from the rndx table
+        spec_wvls = self.opm['osp']['wvls'].wavelengths
+        rndx = sm.spectral_rndx(spec_wvls)
+        npt.assert_array_equal(rndx[:-1], np.array(sm.rndx))
+
+    def test_spectral_trace(self):
+        sm = self.sm
+        fld = self.opm['osp']['fov'].fields[-1]
+        pt0 = np.array([self.opm['osp'].obj_coords(fld)])
+        dir0 = np.array([[0., 0.05, 1.]])/np.linalg.norm([0., 0.05, 1.])
+        direct = bt.trace_spectral_batch(sm, pt0, dir0, self.wvls)
+        sm.set_spectral_sampling((400., 750.), num_wvls=200)
+        tabulated = bt.trace_spectral_batch(sm, pt0, dir0, self.wvls)
+        npt.assert_array_equal(tabulated.status, direct.status)
+        npt.assert_allclose(tabulated.data, direct.data, atol=1e-9)
+
+    def test_table_update(self):
+        sm = self.sm
+        sm.set_spectral_sampling(num_wvls=50)
+        spec_wvls = self.opm['osp']['wvls'].wavelengths
+        self.assertEqual(sm.spectral_table.wvl_range,
+                         (min(spec_wvls), max(spec_wvls)))
+        sm.gaps[1].medium = mg.ModelGlass(1.620, 36.4, '620364')
+        self.opm.update_model()
+        npt.assert_allclose(sm.rndx_for_wavelength(520.),
+                            self.direct_rndx(520.), atol=1e-9)
+        sm.clear_spectral_sampling()
+        self.assertIsNone(sm.spectral_table)
+
+    def test_tabulate_errors(self):
+        class ScalarGlass(mg.ModelGlass):
+            def calc_rindex(self, wv_nm):
+                return float(super().calc_rindex(wv_nm))
+
+        class BadGlass(mg.ModelGlass):
+            def calc_rindex(self, wv_nm):
+                raise ValueError('wavelength outside of the formula range')
+
+        glass = mg.ModelGlass(1.517, 64.2, '517642')
+        # media that can't evaluate an array are tabulated per wavelength
+        npt.assert_allclose(
+            tabulate_rindex(ScalarGlass(1.517, 64.2, '517642'), self.wvls),
+            [glass.rindex(w) for w in self.wvls], atol=1e-12)
+        # genuine dispersion errors reach the caller
+        with self.assertRaises(ValueError):
+            tabulate_rindex(BadGlass(1.517, 64.2, 'bad'), self.wvls)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
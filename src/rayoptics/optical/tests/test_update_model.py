@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test incremental updates of the OpticalModel"""
+
+import copy
+import unittest
+from pathlib import Path
+
+import numpy.testing as npt
+
+import rayoptics as ro
+from rayoptics.elem.surface import DecenterData
+from rayoptics.gui.appcmds import open_model
+from rayoptics.optical import opticalmodel
+from rayoptics.raytr import trace
+
+
+def model_state(opm):
+    fod = opm['analysis_results']['parax_data'].fod
+    osp = opm['optical_spec']
+    wvl = osp['wvls'].central_wvl
+    img_pts = [trace.trace_base(opm, [0., 0.7], fld, wvl)[0][-1][0]
+               for fld in osp['fov'].fields]
+    aim_pts = [fld.aim_pt for fld in osp['fov'].fields]
+    return [fod.efl, fod.bfl, fod.enp_dist, fod.exp_dist], aim_pts, img_pts
+
+
+class UpdateModelTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'codev/tests/ag_dblgauss.seq')
+        self.opm.update_model()
+
+    def compare_updates(self, edit, changed):
+        full_opm = self.opm
+        incr_opm = copy.deepcopy(full_opm)
+        edit(full_opm)
+        edit(incr_opm)
+        full_opm.update_model(build='rebuild')
+        incr_opm.update_model(changed=changed)
+        for full, incr in zip(model_state(full_opm), model_state(incr_opm)):
+            npt.assert_allclose(incr, full, rtol=1e-12, atol=1e-12)
+        return incr_opm
+
+    def test_gap_change(self):
+        def edit(opm):
+            opm['seq_model'].gaps[3].thi *= 1.1
+        self.compare_updates(edit, 'gaps')
+
+    def test_field_change(self):
+        def edit(opm):
+            opm['optical_spec']['fov'].fields[-1].y *= 0.9
+        revision = self.opm['seq_model'].revision
+        incr_opm = self.compare_updates(edit, 'fields')
+        # the sequential model data isn't recomputed
+        self.assertEqual(incr_opm['seq_model'].revision, revision)
+
+    def test_incremental_transforms(self):
+        sm = self.opm['seq_model']
+        sm.gaps[6].thi += 0.5
+        sm.ifcs[8].decenter = DecenterData('bend', alpha=5.)
+        sm.ifcs[8].decenter.update()
+        gbl, lcl = sm.compute_transforms()
+        full_gbl = sm.compute_global_coords(use_cache=False)
+        full_lcl = sm.compute_local_transforms()
+        for tfrm, full_tfrm in zip(gbl + lcl, full_gbl + full_lcl):
+            npt.assert_array_equal(tfrm[0], full_tfrm[0])
+            npt.assert_array_equal(tfrm[1], full_tfrm[1])
+        # the segments before the first change are reused
+        self.assertIs(gbl[5], sm.gbl_tfrms[5])
+        self.assertIsNot(gbl[7], sm.gbl_tfrms[7])
+
+    def test_lazy_aiming(self):
+        osp = self.opm['optical_spec']
+        fld = osp['fov'].fields[-1]
+        wvl = osp['wvls'].central_wvl
+        aim_pt = osp.aim_point(fld)
+        # a change after the stop leaves the aim point valid
+        self.opm['seq_model'].gaps[-2].thi += 1.0
+        self.opm.update_model()
+        self.assertIs(osp.aim_point(fld), aim_pt)
+        # a change before the stop requires the chief ray be re-aimed
+        self.opm['seq_model'].gaps[1].thi *= 1.1
+        self.opm.update_model()
+        new_aim_pt = osp.aim_point(fld)
+        self.assertIsNot(new_aim_pt, aim_pt)
+        # the object is at infinity, so the chief ray is only resolved to
+        # ~1e-5 at the stop
+        cold_aim_pt = trace.aim_chief_ray(self.opm, fld, wvl)
+        npt.assert_allclose(trace.stop_intercept(self.opm, fld, wvl,
+                                                 new_aim_pt),
+                            trace.stop_intercept(self.opm, fld, wvl,
+                                                 cold_aim_pt),
+                            atol=1e-4)
+
+    def test_detect_changes(self):
+        opm = self.opm
+        self.assertEqual(opm.detect_changes(), [])
+        opm['seq_model'].gaps[3].thi *= 1.1
+        opm['seq_model'].ifcs[3].profile.cv *= 1.01
+        opm['optical_spec']['focus'].focus_shift = 0.1
+        self.assertEqual(opm.detect_changes(), ['surfaces', 'gaps', 'focus'])
+        opm.update_model()
+        self.assertEqual(opm.detect_changes(), [])
+        # restored models have no state to compare with
+        del opm._change_state
+        self.assertIsNone(opm.detect_changes())
+        self.assertEqual(opm.stages_to_update(),
+                         set(opticalmodel.update_stages))
+
+    def test_undeclared_field_change(self):
+        def edit(opm):
+            opm['optical_spec']['fov'].fields[-1].y *= 0.9
+        revision = self.opm['seq_model'].revision
+        incr_opm = self.compare_updates(edit, None)
+        # the change is detected, so the sequential model isn't updated
+        self.assertEqual(incr_opm['seq_model'].revision, revision)
+
+    def test_undeclared_surface_change(self):
+        def edit(opm):
+            opm['seq_model'].ifcs[3].profile.cv *= 1.01
+        self.compare_updates(edit, None)
+
+    def test_stages_for_changes(self):
+        stages = opticalmodel.stages_for_changes('elements')
+        self.assertEqual(stages, {'elements'})
+        stages = opticalmodel.stages_for_changes(['media', 'fields'])
+        self.assertNotIn('transforms', stages)
+        self.assertIn('aiming', stages)
+        with self.assertRaises(ValueError):
+            opticalmodel.stages_for_changes('thickness')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
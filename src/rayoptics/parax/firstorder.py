@@ -11,6 +11,7 @@ import math
 from collections import namedtuple
 from rayoptics.optical.model_constants import ht, slp, aoi
 from rayoptics.parax.idealimager import ideal_imager_setup
+from rayoptics.seq.medium import cached_rindex
 
 ParaxData = namedtuple('ParaxData', ['ax_ray', 'pr_ray', 'fod'])
 ParaxData.ax_ray.__doc__ = "axial marginal ray data, y, u, i"
@@ -226,7 +227,7 @@ def compute_first_order(opt_model, stop, wvl):
         # find entrance pupil location w.r.t. first surface
         ybar1 = -bs1
         ubar1 = as1
-        n_0 = seq_model.gaps[0].medium.rindex(wvl)
+        n_0 = cached_rindex(seq_model.gaps[0].medium, wvl)
         enp_dist = -ybar1/(n_0*ubar1)
 
         thi0 = seq_model.gaps[0].thi
@@ -330,6 +331,31 @@ def compute_first_order(opt_model, stop, wvl):
     return ParaxData(ax_ray, pr_ray, fod)
 
 
+def chromatic_focal_shift(opt_model, wvls, ref_wvl=None):
+    """ Returns the paraxial focal shift at each of **wvls**.
+
+    The focal shift is the change in the paraxial image distance relative to
+    the image distance at **ref_wvl**. Wavelengths that aren't part of the
+    spectral region can be sampled finely by setting up a spectral index
+    table with :meth:`~.SequentialModel.set_spectral_sampling`.
+
+    Args:
+        opt_model: the :class:`~.OpticalModel`
+        wvls: list of wavelengths in nm
+        ref_wvl: reference wavelength in nm, defaults to central wavelength
+
+    Returns:
+        list of focal shifts, in system units
+    """
+    seq_model = opt_model.seq_model
+    stop = seq_model.stop_surface
+    if ref_wvl is None:
+        ref_wvl = seq_model.central_wavelength()
+    ref_img_dist = compute_first_order(opt_model, stop, ref_wvl).fod.img_dist
+    return [compute_first_order(opt_model, stop, wvl).fod.img_dist -
+            ref_img_dist for wvl in wvls]
+
+
 def compute_principle_points(path, n_0=1.0, n_k=1.0):
     """ Returns paraxial p and q rays, plus partial first order data.
 
@@ -13,6 +13,7 @@ import numpy as np
 import rayoptics.optical.model_constants as mc
 import rayoptics.parax.firstorder as fo
 from rayoptics.seq.gap import Gap
+from rayoptics.seq.medium import cached_rindex
 from rayoptics.elem.surface import Surface
 
 from rayoptics.util.line_intersection import get_intersect
@@ -415,7 +416,7 @@ class ParaxialModel():
         """Update the refractive index using the `gap` at *surf*."""
         gap = self.seq_model.gaps[surf]
         wvl = self.seq_model.central_wavelength()
-        self.sys[surf][mc.indx] = gap.medium.rindex(wvl)
+        self.sys[surf][mc.indx] = cached_rindex(gap.medium, wvl)
 
     # ParaxTrace() - This routine performs a paraxial raytrace from object
     #                (surface 0) to image.  The last operation is a
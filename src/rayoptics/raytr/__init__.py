@@ -4,16 +4,25 @@
     for optical ray tracing and analyses. These include:
 
         - Base level ray tracing, :mod:`~.raytrace`
+        - Ray tracing of bundles of rays using arrays, :mod:`~.batchtrace`
         - Calculation of wavefront aberration, :mod:`~.waveabr`
         - Specification of aperture, field, wavelength and defocus,
           :mod:`~.opticalspec`
         - Higher level ray tracing, in terms of aperture, field and wavelength,
           :mod:`~.trace`
+        - Pupil maps for real ray aiming, :mod:`~.pupilmap`
         - Functions setting vignetting and clear apertures and support for 
           pupil exploration, :mod:`~.vigcalc`
         - Tracing of fans, lists and grids of rays, including refocusing of OPD
           values, :mod:`~.analyses`
+        - Through-focus stacks of OPD and spot data, including best focus
+          search, :mod:`~.throughfocus`
+        - Tangential and sagittal diffraction MTF over fields, wavelengths
+          and focus, :mod:`~.mtf`
+        - Serial, thread and process pool evaluation of analyses,
+          :mod:`~.executor`
         - Exception classes for reporting ray trace errors, :mod:`~.traceerror`
+        - Opt-in, per-surface ray trace instrumentation, :mod:`~.tracestats`
         - Sample generation for ray grids, :mod:`~.sampler`
 
     The overall optical model is managed by the :class:`~.OpticalModel` class
@@ -25,13 +25,17 @@
     information as well as functions for calculating the monochromatic PSF of
     the model.
 
+    Analyses over all of the fields and wavelengths of the model can be
+    evaluated in parallel using :func:`eval_field_wvl_array` with an executor
+    from :mod:`~.executor`.
+
 .. Created on Sat Feb 22 22:01:56 2020
 
 .. codeauthor: Michael J. Hayford
 """
 import numpy as np
-from numpy.fft import fftshift, fft2
 
+from scipy import fft as sfft
 from scipy.interpolate import interp1d
 
 import rayoptics.optical.model_constants as mc
@@ -40,6 +44,7 @@ from rayoptics.raytr import sampler
 from rayoptics.raytr import trace
 from rayoptics.raytr import traceerror as terr
 from rayoptics.raytr import waveabr
+from rayoptics.raytr.executor import SerialExecutor
 
 
 # --- Single ray
@@ -227,8 +232,6 @@ def eval_fan(opt_model, fld, wvl, foc, xy,
     ref_sphere, cr_pkg = trace.setup_pupil_coords(opt_model, fld, wvl, foc, 
                                                   image_pt=image_pt_2d,
                                                   image_delta=image_delta)
-    fld.chief_ray = cr_pkg
-    fld.ref_sphere = ref_sphere
 
     fan_start = np.array([0., 0.])
     fan_stop = np.array([0., 0.])
@@ -271,8 +274,6 @@ def trace_fan(opt_model, fld, wvl, foc, xy,
     ref_sphere, cr_pkg = trace.setup_pupil_coords(opt_model, fld, wvl, foc, 
                                                   image_pt=image_pt_2d,
                                                   image_delta=image_delta)
-    fld.chief_ray = cr_pkg
-    fld.ref_sphere = ref_sphere
 
     """ xy determines whether x (=0) or y (=1) fan """
     fan_start = np.array([0., 0.])
@@ -467,8 +468,13 @@ def trace_list_of_rays(opt_model, rays,
     for ray in rays:
         pt0, dir0, wvl = ray
         try:
-            ray_pkg = trace.trace(opt_model.seq_model, pt0, dir0, wvl, **kwargs)
+            ray_pkg = trace.trace(opt_model.seq_model, pt0, dir0, wvl,
+                                  raise_errors=False, **kwargs)
         except terr.TraceError as rayerr:
+            ray_pkg = rayerr
+
+        if isinstance(ray_pkg, terr.TraceError):
+            rayerr = ray_pkg
             if rayerr_filter is None:
                 pass
             elif rayerr_filter == 'full':
@@ -496,8 +502,6 @@ def eval_pupil_coords(opt_model, fld, wvl, foc, image_pt_2d=None,
     ref_sphere, cr_pkg = trace.setup_pupil_coords(opt_model, fld, wvl, foc, 
                                                   image_pt=image_pt_2d,
                                                   image_delta=image_delta)
-    fld.chief_ray = cr_pkg
-    fld.ref_sphere = ref_sphere
 
     grid_start = np.array([-1., -1.])
     grid_stop = np.array([1., 1.])
@@ -527,8 +531,6 @@ def trace_pupil_coords(opt_model, pupil_coords, fld, wvl, foc,
     ref_sphere, cr_pkg = trace.setup_pupil_coords(opt_model, fld, wvl, foc, 
                                                   image_pt=image_pt_2d,
                                                   image_delta=image_delta)
-    fld.chief_ray = cr_pkg
-    fld.ref_sphere = ref_sphere
 
     ray_list = trace_ray_list(opt_model, pupil_coords,
                               fld, wvl, foc, 
@@ -613,6 +615,12 @@ class RayGrid():
 
         return self
 
+    def pupil_mask(self):
+        """ returns a boolean array, True for the rays of the grid that passed
+        """
+        pupils, bundle, pre_opd_pkg = self.grid_pkg
+        return (bundle.status == terr.ok).reshape(pupils.shape[:2])
+
 
 def trace_ray_grid(opt_model, grid_rng, fld, wvl, foc, append_if_none=True,
                    output_filter=None, rayerr_filter=None, **kwargs):
@@ -647,90 +655,137 @@ def trace_ray_grid(opt_model, grid_rng, fld, wvl, foc, append_if_none=True,
 
 def eval_wavefront(opt_model, fld, wvl, foc, image_pt_2d=None, 
                    image_delta=None, num_rays=21, value_if_none=np.NaN):
-    """Trace a grid of rays and evaluate the OPD across the wavefront."""
+    """Trace a grid of rays and evaluate the OPD across the wavefront.
+
+    The grid is traced as a batch and the OPDs are evaluated with
+    :func:`~.waveabr.wave_abr_full_calc_array`.
+
+    The OPD is the difference of optical path sums that include the object
+    space segment of the rays, so its rounding error grows with the object
+    distance. For an object at 1e10 system units, the OPD is only
+    resolved to about 1e-2 waves, and the batch and single ray traces may
+    differ by that much.
+
+    Returns:
+        (num_rays, num_rays, 3) array of the pupil x, pupil y and OPD of each
+        ray in the grid
+    """
     fod = opt_model['analysis_results']['parax_data'].fod
     ref_sphere, cr_pkg = trace.setup_pupil_coords(opt_model, fld, wvl, foc, 
                                                   image_pt=image_pt_2d,
                                                   image_delta=image_delta)
-    fld.chief_ray = cr_pkg
-    fld.ref_sphere = ref_sphere
-
-    vig_bbox = fld.vignetting_bbox(opt_model['osp']['pupil'])
-    vig_grid_def = [vig_bbox[0], vig_bbox[1], num_rays]
 
-    grid = trace_ray_grid(opt_model, vig_grid_def, 
-                          fld, wvl, foc, check_apertures=True)
+    pupils, bundle = trace_wavefront_grid(opt_model, fld, wvl, num_rays)
 
     central_wvl = opt_model.optical_spec.spectral_region.central_wvl
     convert_to_opd = 1/opt_model.nm_to_sys_units(central_wvl)
 
-    def rfc(gij):
-        pupil_x, pupil_y, ray_pkg = gij
-        if ray_pkg is not None:
-            opdelta = waveabr.wave_abr_full_calc(fod, fld, wvl, foc, ray_pkg,
-                                                 cr_pkg, ref_sphere)
-            opd = convert_to_opd*opdelta
-            return pupil_x, pupil_y, opd
-        else:
-            return pupil_x, pupil_y, value_if_none
-    opd_grid = [[rfc(j) for j in i] for i in grid]
+    opdelta = waveabr.wave_abr_full_calc_array(fod, fld, wvl, foc, bundle,
+                                               cr_pkg, ref_sphere)
+    return opd_grid(pupils, convert_to_opd*opdelta, bundle, value_if_none)
 
-    return np.array(opd_grid)
+
+def trace_wavefront_grid(opt_model, fld, wvl, num_rays):
+    """Trace a grid of rays over the vignetted pupil of **fld**.
+
+    Returns:
+        (**pupils**, **bundle**)
+
+        - **pupils** - (num_rays, num_rays, 2) array of the relative pupil
+          coordinates of the rays
+        - **bundle** - :class:`~.batchtrace.RayBundle` of the rays, in the
+          order of the flattened **pupils**
+    """
+    vig_bbox = fld.vignetting_bbox(opt_model['osp']['pupil'])
+    vig_grid_def = [vig_bbox[0], vig_bbox[1], num_rays]
+    pupils = trace.grid_pupils(vig_grid_def)
+    bundle = trace.trace_bundle(opt_model, pupils, fld, wvl,
+                                apply_vignetting=False, check_apertures=True)
+    return pupils.reshape(num_rays, num_rays, 2), bundle
+
+
+def opd_grid(pupils, opd, bundle, value_if_none):
+    """ returns the array of pupil x, pupil y and OPD for a grid of rays """
+    opd = np.where(bundle.status == terr.ok, opd, value_if_none)
+    return np.concatenate((pupils, opd.reshape(pupils.shape[:2] + (1,))),
+                          axis=2)
 
 
 def trace_wavefront(opt_model, fld, wvl, foc,
                     image_pt_2d=None, image_delta=None, num_rays=21):
-    """Trace a grid of rays and pre-calculate data needed for rapid refocus."""
+    """Trace a grid of rays and pre-calculate data needed for rapid refocus.
+
+    Returns:
+        (**pupils**, **bundle**, **pre_opd_pkg**), where **pupils** and
+        **bundle** are returned by :func:`trace_wavefront_grid` and
+        **pre_opd_pkg** by :func:`~.waveabr.wave_abr_pre_calc_array`
+    """
     fod = opt_model['analysis_results']['parax_data'].fod
     ref_sphere, cr_pkg = trace.setup_pupil_coords(opt_model, fld, wvl, foc, 
                                                   image_pt=image_pt_2d,
                                                   image_delta=image_delta)
-    fld.chief_ray = cr_pkg
-    fld.ref_sphere = ref_sphere
 
-    vig_bbox = fld.vignetting_bbox(opt_model['osp']['pupil'])
-    vig_grid_def = [vig_bbox[0], vig_bbox[1], num_rays]
-
-    grid = trace_ray_grid(opt_model, vig_grid_def, 
-                          fld, wvl, foc, check_apertures=True)
-
-    def wpc(gij):
-        pupil_x, pupil_y, ray_pkg = gij
-        if ray_pkg is not None:
-            pre_opd_pkg = waveabr.wave_abr_pre_calc(fod, fld, wvl, foc,
-                                                    ray_pkg, cr_pkg)
-            return pre_opd_pkg
-        else:
-            return None
-    upd_grid = [[wpc(j) for j in i] for i in grid]
-
-    return grid, upd_grid
+    pupils, bundle = trace_wavefront_grid(opt_model, fld, wvl, num_rays)
+    pre_opd_pkg = waveabr.wave_abr_pre_calc_array(fod, fld, wvl, foc, bundle,
+                                                  cr_pkg)
+    return pupils, bundle, pre_opd_pkg
 
 
 def focus_wavefront(opt_model, grid_pkg, fld, wvl, foc, image_pt_2d=None,
                     image_delta=None, value_if_none=np.NaN):
     """Given pre-traced rays and a ref. sphere, return the ray's OPD."""
     fod = opt_model['analysis_results']['parax_data'].fod
-    grid, upd_grid = grid_pkg
+    pupils, bundle, pre_opd_pkg = grid_pkg
     ref_sphere, cr_pkg = trace.setup_pupil_coords(opt_model, fld, wvl, foc, 
                                                   image_pt=image_pt_2d,
                                                   image_delta=image_delta)
     central_wvl = opt_model.optical_spec.spectral_region.central_wvl
     convert_to_opd = 1/opt_model.nm_to_sys_units(central_wvl)
 
-    def rfc(gij, uij):
-        pupil_x, pupil_y, ray_pkg = gij
-        if ray_pkg is not None:
-            opdelta = waveabr.wave_abr_calc(fod, fld, wvl, foc,
-                                            ray_pkg, cr_pkg, uij, ref_sphere)
-            opd = convert_to_opd*opdelta
-            return pupil_x, pupil_y, opd
-        else:
-            return pupil_x, pupil_y, value_if_none
-    refocused_grid = [[rfc(jg, ju) for jg, ju in zip(ig, iu)]
-                      for ig, iu in zip(grid, upd_grid)]
+    opdelta = waveabr.wave_abr_calc_array(fod, fld, wvl, foc, cr_pkg,
+                                          pre_opd_pkg, ref_sphere)
+    return opd_grid(pupils, convert_to_opd*opdelta, bundle, value_if_none)
+
+
+# --- Field and wavelength arrays
+def eval_field_wvl_array(opt_model, cell_fct, executor=None, **kwargs):
+    """Evaluate cell_fct for every field and wavelength of the model.
+
+    The cells are independent of each other, and so may be evaluated in
+    parallel by passing a pool **executor** from :mod:`~.executor`.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        cell_fct: function with the signature
+                  `cell_fct(opt_model, fi, wi, **kwargs)`. Module level
+                  functions, e.g. :func:`wavefront_cell`, can be used with
+                  all executors.
+        executor: an :class:`~.executor.Executor`; if None, the cells are
+                  evaluated serially
+        **kwargs: keyword arguments passed to cell_fct
+
+    Returns:
+        a list, one entry per field, of lists of the results for each
+        wavelength
+    """
+    osp = opt_model['optical_spec']
+    num_flds = len(osp['fov'].fields)
+    num_wvls = len(osp['wvls'].wavelengths)
+    if executor is None:
+        executor = SerialExecutor(opt_model)
+    cells = [(fi, wi) for fi in range(num_flds) for wi in range(num_wvls)]
+    results = executor.map(cell_fct, cells, **kwargs)
+    return [results[fi*num_wvls:(fi+1)*num_wvls] for fi in range(num_flds)]
+
 
-    return np.array(refocused_grid)
+def wavefront_cell(opt_model, fi, wi, fr=0.0, **kwargs):
+    """Evaluate the wavefront for field fi and wavelength wi.
+
+    See :func:`eval_wavefront` for the keyword arguments.
+    """
+    fld, wvl, foc = opt_model['optical_spec'].lookup_fld_wvl_focus(fi, wl=wi,
+                                                                   fr=fr)
+    return eval_wavefront(opt_model, fld, wvl, foc, **kwargs)
 
 
 # --- PSF calculation
@@ -755,6 +810,29 @@ def psf_sampling(n=None, n_pupil=None, n_airy=None):
     return n, n_pupil, n_airy
 
 
+def calc_psf_diffraction_unit(pupil_grid):
+    """Calculate the image plane length of one diffraction unit.
+
+    The diffraction unit is :math:`\\lambda R/D`, where D is the exit pupil
+    diameter and R is the radius of the reference sphere. The radius of the
+    first dark ring of the Airy pattern is 1.22 diffraction units.
+
+    Args:
+        pupil_grid: A RayGrid instance
+
+    Returns: the length of a diffraction unit, in system units
+    """
+    opt_model = pupil_grid.opt_model
+    fod = opt_model['analysis_results']['parax_data'].fod
+    wl = opt_model.nm_to_sys_units(pupil_grid.wvl)
+
+    ref_sphere, _ = trace.setup_pupil_coords(
+        opt_model, pupil_grid.fld, pupil_grid.wvl, pupil_grid.foc,
+        image_pt=pupil_grid.image_pt_2d, image_delta=pupil_grid.image_delta)
+    ref_sphere_radius = ref_sphere[2]
+    return wl*ref_sphere_radius/(2*fod.exp_radius)
+
+
 def calc_psf_scaling(pupil_grid, ndim, maxdim):
     """Calculate the input and output grid spacings.
 
@@ -769,21 +847,16 @@ def calc_psf_scaling(pupil_grid, ndim, maxdim):
     """
     opt_model = pupil_grid.opt_model
     fod = opt_model['analysis_results']['parax_data'].fod
-    wl = opt_model.nm_to_sys_units(pupil_grid.wvl)
 
     fill_factor = ndim/maxdim
     max_D = 2 * fod.enp_radius / fill_factor
     delta_x = max_D / maxdim
-    C = wl/fod.exp_radius
-
-    delta_theta = (fill_factor * C) / 2
-    ref_sphere_radius = pupil_grid.fld.ref_sphere[2]
-    delta_xp = delta_theta * ref_sphere_radius
+    delta_xp = fill_factor * calc_psf_diffraction_unit(pupil_grid)
 
     return delta_x, delta_xp
 
 
-def calc_psf(wavefront, ndim, maxdim):
+def calc_psf(wavefront, ndim, maxdim, mask=None):
     """Calculate the point spread function of wavefront W.
 
     Args:
@@ -791,31 +864,206 @@ def calc_psf(wavefront, ndim, maxdim):
                    condition is indicated by nan
         ndim: The sampling across the wavefront
         maxdim: The total width of the sampling grid
+        mask: boolean array, True for the samples inside the pupil. If None,
+              the samples that aren't nan are used
 
     Returns: AP, the PSF of the input wavefront
     """
-    maxdim_by_2 = maxdim//2
-    W = np.zeros([maxdim, maxdim])
-    nd2 = ndim//2
-    W[maxdim_by_2-(nd2-1):maxdim_by_2+(nd2+1),
-      maxdim_by_2-(nd2-1):maxdim_by_2+(nd2+1)] = np.nan_to_num(wavefront)
-
-    phase = np.exp(1j*2*np.pi*W)
-
-    for i in range(len(phase)):
-        for j in range(len(phase)):
-            if phase[i][j] == 1:
-                phase[i][j] = 0
-
-    AP = abs(fftshift(fft2(fftshift(phase))))**2
-    AP_max = np.nanmax(AP)
-    AP = AP/AP_max
-    return AP
+    psf_engine = PSFEngine(ndim, maxdim, fast_len=False)
+    return psf_engine.psf(wavefront, mask=mask)
+
 
+class PSFEngine():
+    """FFT based PSF calculation for a fixed pupil and array size.
 
-def update_psf_data(pupil_grid, build='rebuild'):
+    The wavefront is placed at the center of a square, zero padded array.
+    The padded array is allocated once and reused by each call of
+    :meth:`psf`, so a sequence of PSFs, e.g. over fields and wavelengths,
+    is calculated without reallocating it. The FFTs are done by
+    :mod:`scipy.fft`, using **workers** threads.
+
+    A PSFEngine isn't thread safe; use one instance per thread.
+
+    Attributes:
+        ndim: The sampling across the wavefront
+        maxdim: The requested width of the sampling grid
+        size: The width of the sampling grid used; if fast_len is True, this
+              is the next size >= maxdim with a fast FFT
+        workers: The number of threads used by the FFT, -1 for all CPUs
+    """
+
+    def __init__(self, ndim, maxdim, fast_len=True, workers=-1):
+        self.ndim = ndim
+        self.maxdim = maxdim
+        self.size = sfft.next_fast_len(maxdim) if fast_len else maxdim
+        self.workers = workers
+        self.pupil = np.zeros((self.size, self.size), dtype=complex)
+        # The wavefront is centered on the array, as in calc_psf. The
+        # indices are pre-shifted by fftshift, so the shift is folded into
+        # the assignment of the wavefront.
+        start = self.size//2 - (ndim//2 - 1)
+        indices = (np.arange(start, start+ndim) + self.size//2) % self.size
+        self.pupil_indices = np.ix_(indices, indices)
+
+    def psf(self, wavefront, mask=None, apodization=None, normalize=True):
+        """Calculate the point spread function of wavefront W.
+
+        Args:
+            wavefront: ndim x ndim Numpy array of wavefront errors, in waves
+            mask: boolean array, True for the samples inside the pupil,
+                  typically from the ray trace status, see
+                  :meth:`RayGrid.pupil_mask`. If None, the samples that
+                  aren't nan are used
+            apodization: optional array of the pupil amplitude, broadcast
+                         against the wavefront
+            normalize: if True, the PSF is scaled to a peak value of 1
+
+        Returns: AP, the size x size PSF of the input wavefront
+        """
+        pupil = self.pupil
+        pupil.fill(0.)
+        pupil[self.pupil_indices] = pupil_function(wavefront, mask=mask,
+                                                   apodization=apodization)
+
+        AP = sfft.fft2(pupil, workers=self.workers)
+        AP = sfft.fftshift(AP.real**2 + AP.imag**2)
+        if normalize:
+            AP /= np.max(AP)
+        return AP
+
+
+class MFTEngine():
+    """Matrix Fourier transform PSF calculation on a chosen image window.
+
+    The PSF is evaluated directly at the requested image plane samples as
+    the matrix product :math:`A_x P A_y^T` of the pupil function P with two
+    DFT matrices. The image sampling is independent of the pupil sampling
+    and no zero padding is needed, so a small window around the PSF core can
+    be finely sampled. The DFT matrices are computed once and reused by each
+    call of :meth:`psf`.
+
+    The image samples are in diffraction units, see
+    :func:`calc_psf_diffraction_unit`, measured from the reference image
+    point. A :class:`PSFEngine` of width maxdim samples the image at
+    multiples of ndim/maxdim diffraction units.
+
+    Attributes:
+        ndim: The sampling across the wavefront
+        x_samples: image sample coordinates along the first wavefront axis
+        y_samples: image sample coordinates along the second wavefront axis
+    """
+
+    def __init__(self, ndim, x_samples, y_samples=None):
+        self.ndim = ndim
+        self.x_samples = np.asarray(x_samples, dtype=float)
+        self.y_samples = (self.x_samples if y_samples is None
+                          else np.asarray(y_samples, dtype=float))
+        pupil_coords = (np.arange(ndim) - (ndim - 1)/2)/ndim
+        self.x_dft = np.exp(-2j*np.pi*np.outer(self.x_samples, pupil_coords))
+        self.y_dft = np.exp(-2j*np.pi*np.outer(self.y_samples, pupil_coords))
+
+    def psf(self, wavefront, mask=None, apodization=None, normalize=True):
+        """Calculate the point spread function of wavefront W.
+
+        Args:
+            wavefront: ndim x ndim Numpy array of wavefront errors, in waves
+            mask: boolean array, True for the samples inside the pupil. If
+                  None, the samples that aren't nan are used
+            apodization: optional array of the pupil amplitude, broadcast
+                         against the wavefront
+            normalize: if True, the PSF is scaled to a peak value of 1
+
+        Returns: AP, the len(x_samples) x len(y_samples) PSF of the input
+        wavefront
+        """
+        pupil = pupil_function(wavefront, mask=mask, apodization=apodization)
+        AP = self.x_dft @ pupil @ self.y_dft.T
+        AP = AP.real**2 + AP.imag**2
+        if normalize:
+            AP /= np.max(AP)
+        return AP
+
+
+def pupil_function(wavefront, mask=None, apodization=None):
+    """ returns the complex pupil function of **wavefront**, in waves
+
+    The amplitude is 1 inside the pupil, times **apodization** if given, and
+    0 outside of the pupil; see :meth:`PSFEngine.psf`.
+    """
+    wavefront = np.asarray(wavefront)
+    if mask is None:
+        mask = ~np.isnan(wavefront)
+    amplitude = mask.astype(float)
+    if apodization is not None:
+        amplitude = amplitude*apodization
+    return amplitude*np.exp(2j*np.pi*np.nan_to_num(wavefront))
+
+
+def calc_psf_mft(wavefront, ndim, x_samples, y_samples=None, mask=None):
+    """Calculate the PSF of wavefront W at the given image samples.
+
+    Args:
+        wavefront: ndim x ndim Numpy array of wavefront errors. No data
+                   condition is indicated by nan
+        ndim: The sampling across the wavefront
+        x_samples: image sample coordinates, in diffraction units
+        y_samples: image sample coordinates, if None, **x_samples** is used
+        mask: boolean array, True for the samples inside the pupil. If None,
+              the samples that aren't nan are used
+
+    Returns: AP, the PSF of the input wavefront
+    """
+    mft_engine = MFTEngine(ndim, x_samples, y_samples=y_samples)
+    return mft_engine.psf(wavefront, mask=mask)
+
+
+def psf_image_window(pupil_grid, num_samples, image_window=None):
+    """Calculate the image samples for a PSF calculated by an MFTEngine.
+
+    Args:
+        pupil_grid: A RayGrid instance
+        num_samples: The number of samples across the image window
+        image_window: the half width of the image window, in system units.
+                      If None, the window is 5 Airy radii
+
+    Returns:
+        samples: the image sample coordinates, in system units
+        mft_samples: the image sample coordinates, in diffraction units
+    """
+    diffraction_unit = calc_psf_diffraction_unit(pupil_grid)
+    if image_window is None:
+        image_window = 5*1.22*diffraction_unit
+    samples = np.linspace(-image_window, image_window, num_samples)
+    return samples, samples/diffraction_unit
+
+
+def update_psf_data(pupil_grid, build='rebuild', method='fft',
+                    image_window=None):
+    """Update the pupil_grid data and calculate its PSF.
+
+    Args:
+        pupil_grid: A RayGrid instance, with a maxdim attribute
+        build: 'rebuild' to retrace the rays, else refocus the existing rays
+        method: 'fft' to calculate the PSF by an FFT of the padded pupil,
+                'mft' to calculate it by a matrix Fourier transform on the
+                image window
+        image_window: for 'mft', the half width of the image window, in
+                      system units. See :func:`psf_image_window`
+
+    Returns: AP, the PSF of the input wavefront. For 'mft', it is maxdim
+    samples across the image window
+    """
     pupil_grid.update_data(build=build)
     ndim = pupil_grid.num_rays
     maxdim = pupil_grid.maxdim
-    AP = calc_psf(pupil_grid.grid[2], ndim, maxdim)
+    if method == 'fft':
+        AP = calc_psf(pupil_grid.grid[2], ndim, maxdim)
+    elif method == 'mft':
+        _, mft_samples = psf_image_window(pupil_grid, maxdim,
+                                          image_window=image_window)
+        AP = calc_psf_mft(pupil_grid.grid[2], ndim, mft_samples,
+                          mask=pupil_grid.pupil_mask())
+    else:
+        raise ValueError(f"unknown PSF method '{method}', "
+                         "expected 'fft' or 'mft'")
     return AP
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Functions to ray trace bundles of rays through a sequential model
+
+    The functions in this module parallel those in :mod:`~.raytrace`, but
+    operate on (N, 3) arrays of starting points and directions. The whole
+    bundle is pushed through the :meth:`~.SequentialModel.path` sequence one
+    interface at a time.
+
+    Rays that fail (e.g. miss a surface or TIR) don't raise an exception.
+    Instead, a status code from :mod:`~.traceerror` and the index of the
+    failing surface are recorded for each ray and the ray is dropped from
+    the remainder of the trace.
+
+    The results are returned in a :class:`RayBundle`, which stores all of the
+    ray segments in a single array.
+
+    :func:`trace_spectral_batch` traces the same bundle in several
+    wavelengths in a single pass, using a per-ray refractive index.
+"""
+
+import numpy as np
+from numpy.linalg import norm
+
+import rayoptics.optical.model_constants as mc
+from rayoptics.raytr import traceerror as terr
+from rayoptics.raytr import tracestats
+from rayoptics.raytr import RayPkg, RaySeg
+from rayoptics.raytr.raytrace import TracePlan
+
+
+class RayBundle:
+    """ Array-backed storage for a bundle of traced rays
+
+    The ray segment data for all of the rays is stored in a single float
+    array, **data**, of shape (nrays, nsurf, 10). The last axis holds the
+    point (0:3), direction (3:6), distance (6) and normal (7:10) of each
+    segment.
+
+    Indexing the bundle returns a :class:`BundleRay`, a lightweight view
+    that behaves like the list of ray segments returned by
+    :func:`~.raytrace.trace_raw`, i.e. `bundle[i][j][mc.p]` is the point of
+    incidence of ray i on interface j.
+
+    Attributes:
+        data: (nrays, nsurf, 10) array of ray segment data
+        op_delta: (nrays,) optical path of each ray
+        wvl: (nrays,) wavelength (in nm) of each ray
+        status: (nrays,) status code of each ray, see :mod:`~.traceerror`
+        fail_surf: (nrays,) index of the surface where the ray failed, or -1
+    """
+
+    def __init__(self, num_rays, num_surfs, wvl=np.nan):
+        self.data = np.full((num_rays, num_surfs, 10), np.nan)
+        self.op_delta = np.zeros(num_rays)
+        self.wvl = np.array(np.broadcast_to(wvl, (num_rays,)), dtype=float)
+        self.status = np.full(num_rays, terr.ok, dtype=np.int8)
+        self.fail_surf = np.full(num_rays, -1, dtype=int)
+
+    @classmethod
+    def from_ray_pkgs(cls, ray_pkgs, num_surfs=None):
+        """ create a RayBundle from a list of ray packages
+
+        Failed rays may be included in the list as :class:`~.TraceError`
+        exceptions; the partial ray is taken from the exception's ray_pkg.
+        """
+        ray_pkgs = list(ray_pkgs)
+        if num_surfs is None:
+            num_surfs = max((len(cls._pkg(rp)[mc.ray]) for rp in ray_pkgs),
+                            default=0)
+        bundle = cls(len(ray_pkgs), num_surfs)
+        for i, rp in enumerate(ray_pkgs):
+            ray, op, wvl = cls._pkg(rp)
+            bundle.op_delta[i] = op
+            bundle.wvl[i] = wvl
+            for j, seg in enumerate(ray):
+                bundle.data[i, j, 0:3] = seg[mc.p]
+                bundle.data[i, j, 3:6] = seg[mc.d]
+                bundle.data[i, j, 6] = seg[mc.dst]
+                bundle.data[i, j, 7:10] = seg[mc.nrml]
+            if isinstance(rp, terr.TraceError):
+                bundle.status[i] = terr.status_for_error(rp)
+                bundle.fail_surf[i] = rp.surf
+        return bundle
+
+    @staticmethod
+    def _pkg(rp):
+        return rp.ray_pkg if isinstance(rp, terr.TraceError) else rp
+
+    @property
+    def p(self):
+        """ (nrays, nsurf, 3) view of the points of incidence """
+        return self.data[..., 0:3]
+
+    @property
+    def d(self):
+        """ (nrays, nsurf, 3) view of the direction cosines """
+        return self.data[..., 3:6]
+
+    @property
+    def dst(self):
+        """ (nrays, nsurf) view of the distances to the next interface """
+        return self.data[..., 6]
+
+    @property
+    def nrml(self):
+        """ (nrays, nsurf, 3) view of the surface normals """
+        return self.data[..., 7:10]
+
+    @property
+    def num_surfs(self):
+        return self.data.shape[1]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        return BundleRay(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield BundleRay(self, i)
+
+    def ray_pkg(self, i):
+        """ returns a :class:`~.RayPkg` for ray i """
+        return RayPkg(BundleRay(self, i), self.op_delta[i], self.wvl[i])
+
+    def num_segments(self, i):
+        """ returns the number of valid segments for ray i """
+        if self.status[i] == terr.ok:
+            return self.num_surfs
+        elif self.status[i] == terr.missed_surface:
+            return self.fail_surf[i]
+        else:
+            return self.fail_surf[i] + 1
+
+
+class BundleRay:
+    """ A view of a single ray in a :class:`RayBundle`
+
+    The view acts like the list of ray segments returned by
+    :func:`~.raytrace.trace_raw`. Each segment is returned as a
+    :class:`~.RaySeg` whose array members are views into the bundle.
+    Failed rays only include the segments traced before the failure.
+    """
+
+    def __init__(self, bundle, i):
+        self.bundle = bundle
+        self.i = i
+        self.num_segs = bundle.num_segments(i)
+
+    def __len__(self):
+        return self.num_segs
+
+    def __getitem__(self, j):
+        if isinstance(j, slice):
+            return [self[k] for k in range(*j.indices(self.num_segs))]
+        if j < 0:
+            j += self.num_segs
+        if not 0 <= j < self.num_segs:
+            raise IndexError('ray segment index out of range')
+        seg = self.bundle.data[self.i, j]
+        return RaySeg(seg[0:3], seg[3:6], seg[6], seg[7:10])
+
+    def __iter__(self):
+        for j in range(self.num_segs):
+            yield self[j]
+
+
+def bend(d_in, normal, n_in, n_out):
+    """ refract an array of incoming directions, d_in, about normal
+
+    Returns:
+        (**d_out**, **tir**)
+
+        - **d_out** - (N, 3) array of refracted directions
+        - **tir** - (N,) boolean mask, True where the ray is totally
+          internally reflected
+    """
+    normal_len = norm(normal, axis=1)
+    cosI = np.sum(d_in*normal, axis=1)/normal_len
+    sinI_sqr = 1.0 - cosI*cosI
+    n_cosIp_sqr = n_out*n_out - n_in*n_in*sinI_sqr
+    tir = n_cosIp_sqr < 0.0
+    n_cosIp = np.copysign(np.sqrt(np.where(tir, 0.0, n_cosIp_sqr)), cosI)
+    alpha = n_cosIp - n_in*cosI
+    # the indices may be scalars or per-ray arrays
+    n_in = np.asarray(n_in)[..., np.newaxis]
+    n_out = np.asarray(n_out)[..., np.newaxis]
+    d_out = (n_in*d_in + alpha[:, np.newaxis]*normal)/n_out
+    return d_out, tir
+
+
+def reflect(d_in, normal):
+    """ reflect an array of incoming directions, d_in, about normal """
+    normal_len = norm(normal, axis=1)
+    cosI = np.sum(d_in*normal, axis=1)/normal_len
+    d_out = d_in - 2.0*cosI[:, np.newaxis]*normal
+    return d_out
+
+
+def phase(ifc, inc_pt, d_in, normal, ifc_cntxt):
+    """ apply phase shift to an array of incoming directions, d_in
+
+    The phase calculation is done one ray at a time. The wavelength and
+    indices in **ifc_cntxt** may be per-ray arrays.
+
+    Returns:
+        (**d_out**, **dW**, **evanescent**)
+
+        - **d_out** - (N, 3) array of diffracted directions
+        - **dW** - (N,) array of phase added by diffractive interaction
+        - **evanescent** - (N,) boolean mask, True for evanescent rays
+    """
+    num_rays = len(inc_pt)
+    d_out = np.full((num_rays, 3), np.nan)
+    dW = np.zeros(num_rays)
+    evanescent = np.zeros(num_rays, dtype=bool)
+    z_dir, wvl, n_in, n_out, interact_mode = ifc_cntxt
+    per_ray = any(np.ndim(v) > 0 for v in (wvl, n_in, n_out))
+
+    def ray_value(v, i):
+        return v[i] if np.ndim(v) > 0 else v
+
+    for i in range(num_rays):
+        if per_ray:
+            ifc_cntxt = (z_dir, ray_value(wvl, i), ray_value(n_in, i),
+                         ray_value(n_out, i), interact_mode)
+        try:
+            d_out[i], dW[i] = ifc.phase(inc_pt[i], d_in[i], normal[i],
+                                        ifc_cntxt)
+        except ValueError:
+            evanescent[i] = True
+    return d_out, dW, evanescent
+
+
+def trace_batch(seq_model, pt0, dir0, wvl, **kwargs):
+    """ fundamental raytrace function for a bundle of rays
+
+    Args:
+        seq_model: the sequential model to be traced
+        pt0: (N, 3) array of starting points in coords of first interface
+        dir0: (N, 3) array of starting direction cosines in coords of first
+              interface
+        wvl: wavelength in nm
+        eps: accuracy tolerance for surface intersection calculation
+
+    Returns:
+        see :func:`trace_raw_batch`
+    """
+    path = seq_model.trace_plan(wvl)
+    kwargs['first_surf'] = kwargs.get('first_surf', 1)
+    kwargs['last_surf'] = kwargs.get('last_surf',
+                                     seq_model.get_num_surfaces()-2)
+    return trace_raw_batch(path, pt0, dir0, wvl, **kwargs)
+
+
+def trace_spectral_batch(seq_model, pt0, dir0, wvls, **kwargs):
+    """ trace a bundle of rays in all of the wavelengths **wvls** in one pass
+
+    The (wavelength x ray) product is traced as a single bundle. The
+    refractive indices for each wavelength are taken from the columns of
+    the sequential model's rndx table, see
+    :meth:`~.SequentialModel.spectral_rndx`.
+
+    Args:
+        seq_model: the sequential model to be traced
+        pt0: (N, 3) array of starting points in coords of first interface
+        dir0: (N, 3) array of starting direction cosines in coords of first
+              interface
+        wvls: sequence of M wavelengths in nm, each must be in the model's
+              spectral region
+        eps: accuracy tolerance for surface intersection calculation
+
+    Returns:
+        a :class:`RayBundle` of M*N rays. Ray j in wavelength i is at index
+        i*N + j; the **wvl** array of the bundle gives the wavelength of
+        each ray.
+    """
+    wvls = np.atleast_1d(np.asarray(wvls, dtype=float))
+    pt0 = np.asarray(pt0, dtype=float)
+    dir0 = np.asarray(dir0, dtype=float)
+    num_wvls, num_rays = len(wvls), len(pt0)
+
+    # the geometry of the path doesn't depend on wavelength
+    path = seq_model.trace_plan()
+    wvl_indx = np.repeat(np.arange(num_wvls), num_rays)
+    rndx = seq_model.spectral_rndx(wvls)[:, wvl_indx]
+
+    kwargs['first_surf'] = kwargs.get('first_surf', 1)
+    kwargs['last_surf'] = kwargs.get('last_surf',
+                                     seq_model.get_num_surfaces()-2)
+    return trace_raw_batch(path, np.tile(pt0, (num_wvls, 1)),
+                           np.tile(dir0, (num_wvls, 1)), wvls[wvl_indx],
+                           rndx=rndx, **kwargs)
+
+
+def trace_raw_batch(path, pt0, dir0, wvl, eps=1.0e-12, check_apertures=False,
+                    rndx=None, **kwargs):
+    """ fundamental raytrace function for a bundle of rays
+
+    Args:
+        path: a :class:`~.raytrace.TracePlan` or an iterator containing
+              interfaces and gaps to be traced. for each iteration, the
+              sequence or generator should return a list containing:
+              **Intfc, Gap, Trfm, Index, Z_Dir**
+        pt0: (N, 3) array of starting points in coords of first interface
+        dir0: (N, 3) array of starting direction cosines in coords of first
+              interface
+        wvl: wavelength in nm, or an (N,) array of per-ray wavelengths
+        eps: accuracy tolerance for surface intersection calculation
+        check_apertures: if True, do point_inside() test on inc_pt
+        rndx: optional (nsurf, N) array of per-ray refractive indices; if
+              None, the indices of **path** are used for all rays
+
+    Returns:
+        a :class:`RayBundle` with one segment per ray and interface in
+        **path**. Segments beyond the failing surface of a failed ray are
+        NaN. The op_delta of a successful ray is the optical path wrt
+        equally inclined chords to the optical axis.
+    """
+    if isinstance(path, TracePlan):
+        plan = path
+    else:
+        plan = TracePlan(path, wvl)
+    num_surfs = len(plan)
+
+    pt0 = np.asarray(pt0, dtype=float)
+    dir0 = np.asarray(dir0, dtype=float)
+    num_rays = len(pt0)
+
+    bundle = RayBundle(num_rays, num_surfs, wvl)
+    pts, dirs, dsts, nrmls = bundle.p, bundle.d, bundle.dst, bundle.nrml
+    status, fail_surf = bundle.status, bundle.fail_surf
+    op_delta = bundle.op_delta
+    opl = np.zeros(num_rays)
+
+    first_surf = kwargs.get('first_surf', 0)
+    last_surf = kwargs.get('last_surf', None)
+    # the trace instrumentation, if enabled
+    rec = tracestats.recorder
+
+    def in_gap_range(gap_indx, include_last_surf=False):
+        if first_surf == last_surf:
+            return False
+        if gap_indx < first_surf:
+            return False
+        if last_surf is None:
+            return True
+        else:
+            return (gap_indx <= last_surf if include_last_surf
+                    else gap_indx < last_surf)
+
+    def in_surface_range(s):
+        if s < first_surf:
+            return False
+        if last_surf is None:
+            return True
+        elif s > last_surf:
+            return False
+        else:
+            return True
+
+    def fail_rays(indx, code, s, pt=None, dir=None, nrml=None):
+        """ record the failure and, optionally, the last ray segment """
+        status[indx] = code
+        fail_surf[indx] = s
+        if rec is not None:
+            rec.record_status(s, code, len(indx))
+        if pt is not None:
+            pts[indx, s] = pt
+            dirs[indx, s] = dir
+            dsts[indx, s] = 0.0
+            nrmls[indx, s] = nrml
+
+    # trace object surface
+    srf_obj = plan.ifcs[0]
+    dst_b4, pt_obj, miss = srf_obj.intersect_array(pt0, dir0, eps=eps,
+                                                   z_dir=plan.z_dir[0])
+    fail_rays(np.flatnonzero(miss), terr.missed_surface, 0)
+
+    before_pt = pt_obj
+    before_dir = dir0.copy()
+    before_normal = np.full((num_rays, 3), np.nan)
+    live = np.flatnonzero(~miss)
+    before_normal[live] = srf_obj.normal_array(before_pt[live])
+
+    # loop of remaining surfaces in path
+    for surf in range(1, num_surfs):
+        if len(live) == 0:
+            break
+        rt, t = plan.rot[surf-1], plan.trns[surf-1]
+        z_dir_before = plan.z_dir[surf-1]
+
+        b4_pt = (before_pt[live] - t).dot(rt.T)
+        b4_dir = before_dir[live].dot(rt.T)
+
+        # einsum rounds like the dot product of the scalar trace
+        pp_dst = -np.einsum('ij,ij->i', b4_pt, b4_dir)
+        pp_pt_before = b4_pt + pp_dst[:, np.newaxis]*b4_dir
+
+        ifc = plan.ifcs[surf]
+        interact_mode = plan.interact_modes[surf]
+
+        # intersect rays with profile
+        if rec is None:
+            pp_dst_intrsct, inc_pt, miss = ifc.intersect_array(
+                pp_pt_before, b4_dir, eps=eps, z_dir=z_dir_before)
+        else:
+            pp_dst_intrsct, inc_pt, miss = rec.intersect_array(
+                surf, ifc, pp_pt_before, b4_dir, eps, z_dir_before)
+        dst_b4 = pp_dst + pp_dst_intrsct
+
+        pts[live, surf-1] = before_pt[live]
+        dirs[live, surf-1] = before_dir[live]
+        dsts[live, surf-1] = np.where(miss, pp_dst, dst_b4)
+        nrmls[live, surf-1] = before_normal[live]
+
+        if np.any(miss):
+            fail_rays(live[miss], terr.missed_surface, surf)
+            hit = ~miss
+            live = live[hit]
+            b4_dir = b4_dir[hit]
+            inc_pt = inc_pt[hit]
+            dst_b4 = dst_b4[hit]
+
+        if rndx is None:
+            n_before, n_after = plan.rndx[surf-1], plan.rndx[surf]
+        else:
+            n_before, n_after = rndx[surf-1, live], rndx[surf, live]
+
+        if in_gap_range(surf-1):
+            opl[live] += n_before * dst_b4
+
+        normal = ifc.normal_array(inc_pt)
+
+        good = np.ones(len(live), dtype=bool)
+        if check_apertures and in_surface_range(surf):
+            blocked = ~ifc.point_inside_array(inc_pt[:, 0], inc_pt[:, 1])
+            fail_rays(live[blocked], terr.blocked, surf, inc_pt[blocked],
+                      before_dir[live[blocked]], normal[blocked])
+            good &= ~blocked
+
+        # if present, use the phase element to calculate after_dir
+        if hasattr(ifc, 'phase_element'):
+            if rndx is None:
+                ifc_cntxt = (plan[surf-1][mc.Zdir], wvl,
+                             plan[surf-1][mc.Indx], plan[surf][mc.Indx],
+                             interact_mode)
+            else:
+                ifc_cntxt = (plan[surf-1][mc.Zdir], bundle.wvl[live],
+                             n_before, n_after, interact_mode)
+            after_dir, phs, evn = phase(ifc, inc_pt, b4_dir, normal,
+                                        ifc_cntxt)
+            op_delta[live] += phs
+            evn &= good
+            fail_rays(live[evn], terr.evanescent, surf, inc_pt[evn],
+                      before_dir[live[evn]], normal[evn])
+            good &= ~evn
+        else:  # refract or reflect ray at interface
+            if interact_mode == 'reflect':
+                after_dir = reflect(b4_dir, normal)
+            elif interact_mode == 'transmit':
+                after_dir, tir = bend(b4_dir, normal, n_before, n_after)
+                tir &= good
+                fail_rays(live[tir], terr.tir, surf, inc_pt[tir],
+                          before_dir[live[tir]], normal[tir])
+                good &= ~tir
+            else:  # no action, input becomes output
+                after_dir = b4_dir
+
+        live = live[good]
+        before_pt[live] = inc_pt[good]
+        before_normal[live] = normal[good]
+        before_dir[live] = after_dir[good]
+
+    # finish the last segment of the rays that made it through
+    pts[live, -1] = before_pt[live]
+    dirs[live, -1] = before_dir[live]
+    dsts[live, -1] = 0.0
+    nrmls[live, -1] = before_normal[live]
+
+    op_delta[live] += opl[live]
+    failed = status != terr.ok
+    op_delta[failed] = opl[failed]
+
+    return bundle
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Executors for evaluating independent analysis tasks in parallel
+
+    Analyses over a set of fields and wavelengths, e.g. the cells of an
+    :class:`~.AxisArrayFigure`, are independent of each other once the model
+    is fixed. The executors in this module evaluate a list of such tasks and
+    return the results in the order the tasks were given.
+
+    A task is a function with the signature `fct(opt_model, *args, **kwargs)`.
+    The following executors are implemented:
+
+        - :class:`~.SerialExecutor`: evaluate the tasks one at a time using
+          the model itself
+        - :class:`~.ThreadExecutor`: evaluate the tasks in a thread pool
+        - :class:`~.ProcessExecutor`: evaluate the tasks in a process pool
+
+    The pool executors take a snapshot of the model when they are created.
+    The snapshot is sent once to each worker, which restores its own copy of
+    the model; tasks never modify the caller's model. Create a new executor
+    after the model is changed. For the :class:`~.ProcessExecutor`, the task
+    function, its arguments and its results must be picklable; in practice
+    the task should be a module level function.
+
+    Executors can be used as context managers, which shut down the worker
+    pool on exit.
+"""
+
+import itertools
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def model_snapshot(opt_model):
+    """ returns a pickled, read-only snapshot of **opt_model** """
+    return pickle.dumps(opt_model, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class Executor:
+    """ Abstract base class for the executors.
+
+    Subclasses implement :meth:`map`. The base class supplies a no-op
+    :meth:`shutdown` and the context manager protocol.
+    """
+
+    def map(self, fct, arg_list, **kwargs):
+        """ evaluate `fct(opt_model, *args, **kwargs)` for each args in
+        arg_list
+
+        Returns:
+            a list of the results, in the same order as **arg_list**
+        """
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+
+class SerialExecutor(Executor):
+    """ Evaluate the tasks one at a time in the calling thread. """
+
+    def __init__(self, opt_model):
+        self.opt_model = opt_model
+
+    def map(self, fct, arg_list, **kwargs):
+        return [fct(self.opt_model, *args, **kwargs) for args in arg_list]
+
+
+class ThreadExecutor(Executor):
+    """ Evaluate the tasks in a pool of threads.
+
+    Each thread restores its own copy of the model snapshot, so that the
+    side effects of a task, e.g. setting the chief ray of a field, don't
+    collide with those of a task in another thread.
+    """
+
+    def __init__(self, opt_model, max_workers=None):
+        self.snapshot = model_snapshot(opt_model)
+        self._local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,
+                                       initializer=self._init_worker)
+
+    def _init_worker(self):
+        self._local.opt_model = pickle.loads(self.snapshot)
+
+    def _run(self, fct, args, kwargs):
+        return fct(self._local.opt_model, *args, **kwargs)
+
+    def map(self, fct, arg_list, **kwargs):
+        return list(self.pool.map(self._run, itertools.repeat(fct),
+                                  arg_list, itertools.repeat(kwargs)))
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+# the model copy restored by each ProcessExecutor worker process
+_worker_model = None
+
+
+def _init_process_worker(snapshot):
+    global _worker_model
+    _worker_model = pickle.loads(snapshot)
+
+
+def _run_in_process(fct, args, kwargs):
+    return fct(_worker_model, *args, **kwargs)
+
+
+class ProcessExecutor(Executor):
+    """ Evaluate the tasks in a pool of worker processes.
+
+    Args:
+        opt_model: the :class:`~.OpticalModel` the tasks are evaluated with
+        max_workers: the number of worker processes, defaults to the number
+                     of processors
+        mp_context: optional multiprocessing context, e.g.
+                    `multiprocessing.get_context('spawn')`
+        chunksize: the number of tasks sent to a worker at a time
+    """
+
+    def __init__(self, opt_model, max_workers=None, mp_context=None,
+                 chunksize=1):
+        self.chunksize = chunksize
+        self.pool = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=mp_context,
+                                        initializer=_init_process_worker,
+                                        initargs=(model_snapshot(opt_model),))
+
+    def map(self, fct, arg_list, **kwargs):
+        return list(self.pool.map(_run_in_process, itertools.repeat(fct),
+                                  arg_list, itertools.repeat(kwargs),
+                                  chunksize=self.chunksize))
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def get_executor(opt_model, kind='serial', **kwargs):
+    """ returns an executor for **opt_model**
+
+    Args:
+        opt_model: the :class:`~.OpticalModel` the tasks are evaluated with
+        kind: 'serial', 'thread' or 'process'
+        **kwargs: keyword arguments passed to the executor constructor
+    """
+    if kind == 'serial':
+        return SerialExecutor(opt_model)
+    elif kind == 'thread':
+        return ThreadExecutor(opt_model, **kwargs)
+    elif kind == 'process':
+        return ProcessExecutor(opt_model, **kwargs)
+    else:
+        raise ValueError(f"unknown executor kind: {kind}")
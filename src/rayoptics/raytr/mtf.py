@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Diffraction MTF from the OPD over the pupil
+
+    The optical transfer function (OTF) is the autocorrelation of the pupil
+    function. A cut through the OTF along one direction only needs the
+    autocorrelation of the pupil sheared along that direction;
+    :func:`line_otf` computes it from the 1D power spectra of the pupil rows
+    and evaluates it at a whole vector of frequencies with one matrix
+    product. The MTF is the modulus of the OTF.
+
+    The OPD maps are taken from the through-focus stacks of
+    :class:`~.throughfocus.ThroughFocus`, so the rays of each field and
+    wavelength are traced once for all of the focus shifts. The
+    :class:`DiffractionMTF` class evaluates the tangential and sagittal MTF
+    for every field, wavelength and focus shift of the model, and combines
+    the wavelengths using the spectral weights of the
+    :class:`~.opticalspec.WvlSpec`. The fields are independent, and may be
+    evaluated in parallel by an executor from :mod:`~.executor`::
+
+        freqs = np.linspace(0., 100., 21)
+        with get_executor(opm, 'process') as executor:
+            mtf = DiffractionMTF(opm, freqs, np.linspace(-0.1, 0.1, 21),
+                                 executor=executor)
+        tan_mtf = mtf.mtf()[:, 0]
+
+    The tangential direction is the y direction of the pupil and image, so
+    the fields are assumed to lie in the y-z plane.
+"""
+
+import numpy as np
+from scipy import fft as sfft
+
+import rayoptics.optical.model_constants as mc
+
+from rayoptics.raytr import trace
+from rayoptics.raytr.executor import SerialExecutor
+from rayoptics.raytr.throughfocus import ThroughFocus
+
+
+def line_otf(opd, lags, axis, wvl_ratio=1.0):
+    """Calculate the OTF of a stack of OPD maps along one pupil direction.
+
+    The pupil is sheared along **axis**. The autocorrelation of each pupil
+    row is the inverse transform of its power spectrum, zero padded to
+    twice the row length; summing the power spectra of the rows gives the
+    autocorrelation of the whole pupil. It is evaluated at the, not
+    necessarily integer, **lags** by a DFT matrix.
+
+    Args:
+        opd: (..., n, n) stack of OPD maps, in waves at the central
+             wavelength; samples outside the pupil are NaN
+        lags: (nfreq,) array of shears of the pupil, in pupil samples
+        axis: the pupil axis of the shear, 0 for x or 1 for y
+        wvl_ratio: ratio of the wavelength the OPD is measured in to the
+                   wavelength of the rays, e.g. central_wvl/wvl
+
+    Returns: (..., nfreq) complex array of the OTF, normalized to 1 at zero
+    frequency
+    """
+    opd = np.asarray(opd)
+    lags = np.atleast_1d(lags)
+    mask = ~np.isnan(opd)
+    pupil = np.where(mask, np.exp(2j*np.pi*wvl_ratio*np.nan_to_num(opd)),
+                     0.)
+    shear_axis = axis - 2
+    n = opd.shape[shear_axis]
+    spectrum = sfft.fft(pupil, n=2*n, axis=shear_axis, workers=-1)
+    power = np.sum(spectrum.real**2 + spectrum.imag**2, axis=-1-axis)
+
+    k = sfft.fftfreq(2*n, d=1/(2*n))
+    dft = np.exp(2j*np.pi*np.outer(k, lags)/(2*n))
+    otf = (power @ dft)/np.sum(power, axis=-1, keepdims=True)
+    # the autocorrelation is 0 for shears larger than the pupil
+    otf[..., np.abs(lags) >= n] = 0.
+    return otf
+
+
+def mtf_cell(opt_model, fi, freqs, focus_shifts, num_rays=32):
+    """Calculate the tangential and sagittal OTF of field fi.
+
+    The OTF is evaluated for every wavelength of the model. The OPD at all
+    wavelengths is referenced to the image point of the central wavelength
+    chief ray, so that lateral color is retained in the phase of the OTF.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        fi: index into the :class:`~.FieldSpec`
+        freqs: (nfreq,) array of spatial frequencies, in cycles per system
+               unit, e.g. cycles/mm
+        focus_shifts: (nfoc,) array of focus shifts
+        num_rays: number of samples along the side of the ray grid
+
+    Returns: (nwvl, 2, nfoc, nfreq) complex array of the tangential and
+    sagittal OTF
+    """
+    osp = opt_model['optical_spec']
+    fod = opt_model['analysis_results']['parax_data'].fod
+    fld = osp['fov'].fields[fi]
+    wvls = osp['wvls'].wavelengths
+    central_wvl = osp['wvls'].central_wvl
+    freqs = np.atleast_1d(freqs)
+
+    cr_pkg = trace.get_chief_ray_pkg(opt_model, fld, central_wvl, 0.)
+    image_pt_2d = cr_pkg[0].ray[-1][mc.p][:2]
+
+    otf = np.empty((len(wvls), 2, len(np.atleast_1d(focus_shifts)),
+                    len(freqs)), dtype=complex)
+    for wi, wvl in enumerate(wvls):
+        tf = ThroughFocus(opt_model, focus_shifts, f=fld, wl=wvl,
+                          image_pt_2d=image_pt_2d, num_rays=num_rays)
+        ref_sphere, _ = trace.setup_pupil_coords(opt_model, fld, wvl, 0.,
+                                                 image_pt=image_pt_2d)
+        # spatial frequency of a shear of one relative pupil unit
+        freq_per_pupil = fod.exp_radius/(opt_model.nm_to_sys_units(wvl) *
+                                         ref_sphere[2])
+        pupils = tf.grid_pkg[0]
+        pupil_spacing = (pupils[1, 0, 0] - pupils[0, 0, 0],
+                         pupils[0, 1, 1] - pupils[0, 0, 1])
+        # tangential shears the pupil in y, sagittal in x
+        for i, axis in enumerate((1, 0)):
+            lags = freqs/(freq_per_pupil*pupil_spacing[axis])
+            otf[wi, i] = line_otf(tf.opd, lags, axis,
+                                  wvl_ratio=tf.wvl_ratio())
+    return otf
+
+
+class DiffractionMTF():
+    """Tangential and sagittal diffraction MTF over fields and focus.
+
+    The OTF of every field, wavelength and focus shift is computed by
+    :func:`mtf_cell`, one field per task of the **executor**.
+
+    Attributes:
+        opt_model: :class:`~.OpticalModel` instance
+        freqs: (nfreq,) array of spatial frequencies, in cycles per system
+               unit, e.g. cycles/mm
+        focus_shifts: (nfoc,) array of focus shifts
+        num_rays: number of samples along the side of the ray grid
+        otf: (nfld, nwvl, 2, nfoc, nfreq) complex array of the tangential
+             and sagittal OTF
+    """
+
+    directions = ('tangential', 'sagittal')
+
+    def __init__(self, opt_model, freqs, focus_shifts=0., num_rays=32,
+                 executor=None):
+        self.opt_model = opt_model
+        self.freqs = np.atleast_1d(freqs)
+        self.focus_shifts = np.atleast_1d(focus_shifts)
+        self.num_rays = num_rays
+
+        self.update_data(executor=executor)
+
+    def __json_encode__(self):
+        attrs = dict(vars(self))
+        del attrs['opt_model']
+        return attrs
+
+    def update_data(self, executor=None, **kwargs):
+        opt_model = self.opt_model
+        num_flds = len(opt_model['optical_spec']['fov'].fields)
+        if executor is None:
+            executor = SerialExecutor(opt_model)
+        otfs = executor.map(mtf_cell, [(fi,) for fi in range(num_flds)],
+                            freqs=self.freqs, focus_shifts=self.focus_shifts,
+                            num_rays=self.num_rays)
+        self.otf = np.array(otfs)
+        return self
+
+    def mtf(self, wi=None):
+        """ returns the MTF, polychromatic if **wi** is None
+
+        Args:
+            wi: index of the wavelength, or None to combine the wavelengths
+                using the spectral weights
+
+        Returns: (nfld, 2, nfoc, nfreq) array of the tangential and sagittal
+        MTF
+        """
+        if wi is not None:
+            return np.abs(self.otf[:, wi])
+        wts = np.asarray(self.opt_model['optical_spec']['wvls'].spectral_wts,
+                         dtype=float)
+        otf = np.tensordot(wts, self.otf, axes=(0, 1))/np.sum(wts)
+        return np.abs(otf)
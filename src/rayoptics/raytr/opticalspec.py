@@ -9,10 +9,12 @@
 """
 
 import math
+from collections import OrderedDict
 import numpy as np
 
 from rayoptics.parax.firstorder import compute_first_order, list_parax_trace
-from rayoptics.raytr.trace import aim_chief_ray
+from rayoptics.raytr.trace import reaim_chief_rays
+from rayoptics.raytr.pupilmap import PupilMap
 from rayoptics.optical import model_enums
 import rayoptics.optical.model_constants as mc
 from opticalglass.spectral_lines import get_wavelength
@@ -39,10 +41,18 @@ class OpticalSpecs:
 
     Attributes:
         do_aiming: if True, iterate chief rays to stop center, else entrance pupil
+        real_aiming: if True, and do_aiming is True, map relative pupil
+                     coordinates onto the real stop, else onto the paraxial
+                     entrance pupil
 
+    When aiming is on, the aim points of the fields are computed on demand,
+    see :meth:`aim_point`. Real aiming uses a :class:`~.PupilMap` for each
+    field, see :meth:`pupil_map`.
     """
 
     do_aiming_default = True
+    real_aiming_default = False
+    pupil_maps_maxsize = 64
 
     def __init__(self, opt_model, specsheet=None, **kwargs):
         self.opt_model = opt_model
@@ -52,6 +62,9 @@ class OpticalSpecs:
         self['fov'] = FieldSpec(self)
         self['focus'] = FocusRange(0.0)
         self.do_aiming = OpticalSpecs.do_aiming_default
+        self.real_aiming = OpticalSpecs.real_aiming_default
+        self.aiming_revision = 0
+        self._pupil_maps = OrderedDict()
         if specsheet:
             self.set_from_specsheet(specsheet)
         
@@ -68,6 +81,9 @@ class OpticalSpecs:
         del attrs['opt_model']
         del attrs['_submodels']
         del attrs['do_aiming']
+        attrs.pop('real_aiming', None)
+        attrs.pop('aiming_revision', None)
+        attrs.pop('_pupil_maps', None)
 
         attrs['spectral_region'] = self['wvls']
         attrs['pupil'] = self['pupil']
@@ -140,6 +156,10 @@ class OpticalSpecs:
         self.opt_model = opt_model
         if not hasattr(self, 'do_aiming'):
             self.do_aiming = OpticalSpecs.do_aiming_default
+        if not hasattr(self, 'real_aiming'):
+            self.real_aiming = OpticalSpecs.real_aiming_default
+        self.aiming_revision = 0
+        self._pupil_maps = OrderedDict()
 
         self['wvls'].sync_to_restore(self)
         self['pupil'].sync_to_restore(self)
@@ -151,16 +171,94 @@ class OpticalSpecs:
         self.field_of_view.update_model(**kwargs)
 
     def update_optical_properties(self, **kwargs):
+        self.update_first_order()
+        self.update_aiming()
+
+    def update_first_order(self):
+        """ compute the first order data of the model """
         if self.opt_model.seq_model.get_num_surfaces() > 2:
             stop = self.opt_model.seq_model.stop_surface
             wvl = self.spectral_region.central_wvl
             self.opt_model['analysis_results']['parax_data'] = \
                 compute_first_order(self.opt_model, stop, wvl)
 
-            if self.do_aiming:
-                for i, fld in enumerate(self.field_of_view.fields):
-                    aim_pt = aim_chief_ray(self.opt_model, fld, wvl)
-                    fld.aim_pt = aim_pt
+    def update_aiming(self):
+        """ mark the aim points of the fields as out of date
+
+        The chief rays aren't aimed here; each field is aimed the next time
+        its aim point is used, see :meth:`aim_point`.
+        """
+        self.aiming_revision += 1
+        self._pupil_maps.clear()
+
+    def aim_point(self, fld):
+        """ returns the aim point of **fld**, aiming the chief ray if needed
+
+        For the fields of the field of view, the aim point is recomputed on
+        first use following a call to :meth:`update_aiming` or a change of
+        the object point. All of the field of view's out of date fields are
+        aimed together, see :meth:`update_aim_points`. Other fields, or all
+        fields if do_aiming is False, return their aim_pt attribute
+        unchanged.
+        """
+        if (not self.do_aiming or
+                self.opt_model.seq_model.get_num_surfaces() <= 2 or
+                not any(f is fld for f in self.field_of_view.fields)):
+            return getattr(fld, 'aim_pt', None)
+
+        if getattr(fld, 'aim_key', None) != self._aim_key(fld):
+            self.update_aim_points()
+        return fld.aim_pt
+
+    def _aim_key(self, fld):
+        return self.aiming_revision, tuple(self.obj_coords(fld))
+
+    def update_aim_points(self):
+        """ aim the chief rays of the fields with out of date aim points
+
+        The previous aim point of a field is kept if nothing upstream of the
+        stop has changed; the remaining fields are aimed together, starting
+        from their previous aim points.
+        """
+        stale = []
+        for fld in self.field_of_view.fields:
+            aim_key = self._aim_key(fld)
+            if getattr(fld, 'aim_key', None) != aim_key:
+                stale.append((fld, aim_key))
+        if len(stale) == 0:
+            return
+
+        flds = [fld for fld, aim_key in stale]
+        aim_pts, stop_pts = reaim_chief_rays(
+            self.opt_model, flds, self.spectral_region.central_wvl,
+            [getattr(fld, 'aim_pt', None) for fld in flds],
+            [getattr(fld, 'stop_pt', None) for fld in flds])
+        for (fld, aim_key), aim_pt, stop_pt in zip(stale, aim_pts, stop_pts):
+            fld.aim_pt, fld.stop_pt, fld.aim_key = aim_pt, stop_pt, aim_key
+
+    def pupil_map(self, fld):
+        """ returns the :class:`~.PupilMap` of **fld** for real aiming
+
+        The pupil maps are cached until the next call to
+        :meth:`update_aiming`. Returns None if real aiming isn't in effect
+        or there's no stop surface.
+        """
+        seq_model = self.opt_model.seq_model
+        if (not (self.do_aiming and self.real_aiming) or
+                seq_model.get_num_surfaces() <= 2 or
+                seq_model.stop_surface is None):
+            return None
+
+        key = tuple(self.obj_coords(fld))
+        pupil_map = self._pupil_maps.get(key)
+        if pupil_map is None:
+            pupil_map = PupilMap(self.opt_model, fld)
+            self._pupil_maps[key] = pupil_map
+            if len(self._pupil_maps) > OpticalSpecs.pupil_maps_maxsize:
+                self._pupil_maps.popitem(last=False)
+        else:
+            self._pupil_maps.move_to_end(key)
+        return pupil_map
 
     def lookup_fld_wvl_focus(self, fi, wl=None, fr=0.0):
         """ returns field, wavelength and defocus data
@@ -522,10 +620,14 @@ class Field:
         vly: -y vignetting factor
         wt: field weight
         aim_pt: x, y chief ray coords on the paraxial entrance pupil plane
+        stop_pt: x, y coords on the stop of the chief ray through aim_pt
+        aim_key: identifies the model state aim_pt was validated for
         chief_ray: ray package for the ray from the field point throught the
-                   center of the aperture stop, traced in the central
-                   wavelength
-        ref_sphere: a tuple containing (image_pt, ref_dir, ref_sphere_radius)
+                   center of the aperture stop; only set on the field copies
+                   passed to analysis callbacks, see
+                   :func:`~.trace.get_chief_ray_pkg`
+        ref_sphere: a tuple containing (image_pt, ref_dir, ref_sphere_radius);
+                    only set on the field copies passed to analysis callbacks
 
     """
 
@@ -538,12 +640,15 @@ class Field:
         self.vly = 0.0
         self.wt = wt
         self.aim_pt = None
+        self.stop_pt = None
+        self.aim_key = None
         self.chief_ray = None
         self.ref_sphere = None
 
     def __json_encode__(self):
         attrs = dict(vars(self))
-        items = ['chief_ray', 'ref_sphere', 'pupil_rays']
+        items = ['chief_ray', 'ref_sphere', 'pupil_rays', 'stop_pt',
+                 'aim_key']
         for item in items:
             if item in attrs:
                 del attrs[item]
@@ -603,6 +708,15 @@ class Field:
                 vig_pupil[1] *= (1.0 - self.vuy)
         return vig_pupil
 
+    def apply_vignetting_array(self, pupils):
+        """ apply vignetting to an (N, 2) array of pupil coordinates """
+        vig_pupils = np.array(pupils, dtype=float)
+        vig_pupils[:, 0] *= np.where(vig_pupils[:, 0] < 0.0,
+                                     1.0 - self.vlx, 1.0 - self.vux)
+        vig_pupils[:, 1] *= np.where(vig_pupils[:, 1] < 0.0,
+                                     1.0 - self.vly, 1.0 - self.vuy)
+        return vig_pupils
+
 
 class FocusRange:
     """ Focus range specification
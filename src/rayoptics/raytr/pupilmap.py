@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Maps from relative pupil coordinates to aim points for real ray aiming
+
+    With paraxial aiming, the relative pupil coordinates of a ray are scaled
+    by the paraxial entrance pupil radius and offset by the aim point of the
+    field's chief ray. In systems with strong pupil aberration the real stop
+    is then sampled non-uniformly.
+
+    With real aiming, the relative pupil coordinates are mapped onto the stop
+    surface instead: pupil coordinates (px, py) are aimed at the point
+    (px, py) times the paraxial stop radius on the stop. Aiming every ray
+    would be expensive, so a :class:`PupilMap` is fit for each field from a
+    small grid of rays aimed together by :func:`~.trace.solve_aim_points`.
+    The map is a 2D polynomial, so mapping a ray costs little more than
+    paraxial aiming.
+
+    Real aiming is turned on by setting
+    :attr:`~.OpticalSpecs.real_aiming` to True; the pupil maps are cached by
+    the :class:`~.OpticalSpecs`, see :meth:`~.OpticalSpecs.pupil_map`.
+"""
+
+import numpy as np
+
+from rayoptics.optical import model_constants as mc
+from rayoptics.raytr import trace
+
+
+class PupilMap:
+    """ Polynomial map from relative pupil coordinates to aim points
+
+    The map is fit over the square [-1, 1] x [-1, 1] of relative pupil
+    coordinates, so that square pupil grids are covered. The constant term
+    is the aim point of the chief ray, so the chief ray is aimed exactly.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        fld: :class:`~.Field` the map is computed for
+        wvl: aiming wavelength (nm), defaults to the central wavelength
+        num_samples: the number of samples across the pupil in x and y
+        degree: the maximum degree in each of px and py of the polynomial
+
+    Attributes:
+        chief_aim_pt: the aim point of the chief ray
+        coefs: (ncoefs, 2) array of the polynomial coefficients of the
+               offsets of the aim point from **chief_aim_pt**, scaled by
+               the entrance pupil radius
+        degree: the degree of the polynomial in px and py; may be less than
+                requested if samples failed
+        num_failed: the number of samples that failed
+    """
+
+    def __init__(self, opt_model, fld, wvl=None, num_samples=9, degree=6):
+        seq_model = opt_model.seq_model
+        if wvl is None:
+            wvl = seq_model.central_wavelength()
+        parax_data = opt_model['analysis_results']['parax_data']
+        stop = seq_model.stop_surface
+        stop_radius = abs(parax_data.ax_ray[stop][mc.ht])
+        self.eprad = parax_data.fod.enp_radius
+
+        # the odd sample count puts the chief ray at the center of the grid
+        num_samples += 1 - num_samples % 2
+        grid = np.linspace(-1., 1., num_samples)
+        px, py = [c.ravel() for c in np.meshgrid(grid, grid)]
+        pupils = np.column_stack((px, py))
+        center = len(pupils)//2
+
+        osp = opt_model.optical_spec
+        pt0 = np.broadcast_to(osp.obj_coords(fld), (len(pupils), 3))
+        aim_pt = osp.aim_point(fld)
+        if aim_pt is None:
+            aim_pt = np.zeros(2)
+        aim_pts = self.eprad*pupils + aim_pt
+        # the error of the polynomial fit is much larger than the miss of a
+        # sample that stalls near its target, so accept those samples
+        failed = trace.solve_aim_points(opt_model, pt0,
+                                        np.full(len(pupils), wvl),
+                                        stop_radius*pupils, aim_pts,
+                                        stall_tol=1e-5*stop_radius)
+        if failed[center]:
+            aim_pts[center] = trace.aim_chief_ray(opt_model, fld, wvl,
+                                                  start=aim_pt)
+        self.num_failed = np.count_nonzero(failed)
+
+        self.chief_aim_pt = aim_pts[center].copy()
+        good = ~failed
+        good[center] = False
+        offsets = (aim_pts[good] - self.chief_aim_pt)/self.eprad
+        # reduce the degree if there are too few samples for the fit
+        self.degree = degree
+        while self.degree > 1 and (self.degree+1)**2 - 1 > len(offsets):
+            self.degree -= 1
+        vander = self._vander(pupils[good])
+        self.coefs = np.linalg.lstsq(vander, offsets, rcond=None)[0]
+
+    def _vander(self, pupils):
+        """ returns the terms px**i * py**j, i, j <= degree, of **pupils** """
+        powers = np.arange(self.degree+1)
+        x_pwrs = pupils[:, 0:1]**powers
+        y_pwrs = pupils[:, 1:2]**powers
+        vander = (x_pwrs[:, :, np.newaxis]*y_pwrs[:, np.newaxis, :])
+        # omit the constant term; the chief ray is fixed at the origin
+        return vander.reshape(len(pupils), -1)[:, 1:]
+
+    def aim_points(self, pupils):
+        """ returns the (N, 2) aim points of the relative **pupils**
+
+        The aim points are on the paraxial entrance pupil plane, like the
+        chief ray aim points.
+        """
+        pupils = np.asarray(pupils, dtype=float).reshape(-1, 2)
+        offsets = self._vander(pupils) @ self.coefs
+        return self.chief_aim_pt + self.eprad*offsets
@@ -15,6 +15,60 @@ from math import sqrt, copysign
 import rayoptics.optical.model_constants as mc
 from .traceerror import (TraceMissedSurfaceError, TraceTIRError,
                          TraceRayBlockedError, TraceEvanescentRayError)
+from . import tracestats
+
+
+class TracePlan:
+    """ An immutable, precompiled path through a sequential model
+
+    A TracePlan is built once from a :meth:`~.SequentialModel.path` for a
+    given wavelength and range. Iterating over the plan yields the same
+    items as the path, **Intfc, Gap, Trfm, Index, Z_Dir**, so it can be
+    passed to :func:`trace_raw` repeatedly. The transform, index, z_dir and
+    interaction mode data are also available as contiguous arrays.
+
+    Attributes:
+        wvl: wavelength in nm of the plan
+        revision: revision of the sequential model the plan was built from
+        ifcs: tuple of the interfaces in the path
+        rot: (nsurf, 3, 3) array of rotation matrices of the local transforms
+        trns: (nsurf, 3) array of translations of the local transforms
+        rndx: (nsurf,) array of refractive indices following each interface
+        z_dir: (nsurf,) array of z_dir following each interface
+        signed_rndx: (nsurf,) array of rndx*z_dir
+        interact_modes: tuple of the interact_mode of each interface
+    """
+
+    def __init__(self, path, wvl, revision=None):
+        self.wvl = wvl
+        self.revision = revision
+        self.steps = tuple(tuple(item) for item in path)
+
+        def as_float(v):
+            return np.nan if v is None else v
+
+        self.ifcs = tuple(item[mc.Intfc] for item in self.steps)
+        self.rot = np.array([item[mc.Tfrm][0] for item in self.steps])
+        self.trns = np.array([item[mc.Tfrm][1] for item in self.steps])
+        self.rndx = np.array([as_float(item[mc.Indx])
+                              for item in self.steps])
+        self.z_dir = np.array([as_float(item[mc.Zdir])
+                               for item in self.steps])
+        self.signed_rndx = self.rndx*self.z_dir
+        self.interact_modes = tuple(ifc.interact_mode for ifc in self.ifcs)
+        for a in (self.rot, self.trns, self.rndx, self.z_dir,
+                  self.signed_rndx):
+            a.flags.writeable = False
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getitem__(self, i):
+        return self.steps[i]
+
 
 def bend(d_in, normal, n_in, n_out):
     """ refract incoming direction, d_in, about normal """
@@ -74,26 +128,32 @@ def trace(seq_model, pt0, dir0, wvl, **kwargs):
           optical axis
         - **wvl** - wavelength (in nm) that the ray was traced in
     """
-    path = seq_model.path(wvl)
+    path = seq_model.trace_plan(wvl)
     kwargs['first_surf'] = kwargs.get('first_surf', 1)
     kwargs['last_surf'] = kwargs.get('last_surf',
                                      seq_model.get_num_surfaces()-2)
     return trace_raw(path, pt0, dir0, wvl, **kwargs)
 
 
-def trace_raw(path, pt0, dir0, wvl, eps=1.0e-12, check_apertures=False, **kwargs):
+def trace_raw(path, pt0, dir0, wvl, eps=1.0e-12, check_apertures=False,
+              raise_errors=True, **kwargs):
     """ fundamental raytrace function
 
     Args:
-        path: an iterator containing interfaces and gaps to be traced.
-              for each iteration, the sequence or generator should return a
-              list containing: **Intfc, Gap, Trfm, Index, Z_Dir**
+        path: an iterable containing interfaces and gaps to be traced,
+              e.g. a :class:`TracePlan`. For each iteration, the sequence
+              or generator should return a list containing:
+              **Intfc, Gap, Trfm, Index, Z_Dir**
         pt0: starting point in coords of first interface
         dir0: starting direction cosines in coords of first interface
         wvl: wavelength in nm
         eps: accuracy tolerance for surface intersection calculation
         check_apertures: if True, do point_inside() test on inc_pt
-
+        raise_errors: if False, a ray failure returns the
+                      :class:`~.traceerror.TraceError` instead of raising it.
+                      The exception's `status` identifies the failure; the
+                      `surf` and `ray_pkg` attributes have the failing
+                      interface and the partial ray.
 
     Returns:
         (**ray**, **op_delta**, **wvl**)
@@ -110,7 +170,10 @@ def trace_raw(path, pt0, dir0, wvl, eps=1.0e-12, check_apertures=False, **kwargs
           optical axis
         - **wvl** - wavelength (in nm) that the ray was traced in
     """
+    path = iter(path)
     ray = []
+    # the trace instrumentation, if enabled
+    rec = tracestats.recorder
 
     first_surf = kwargs.get('first_surf', 0)
     last_surf = kwargs.get('last_surf', None)
@@ -167,8 +230,14 @@ def trace_raw(path, pt0, dir0, wvl, eps=1.0e-12, check_apertures=False, **kwargs
             z_dir_after = after[mc.Zdir]
 
             # intersect ray with profile
-            pp_dst_intrsct, inc_pt = ifc.intersect(pp_pt_before, b4_dir,
-                                                   eps=eps, z_dir=z_dir_before)
+            if rec is None:
+                pp_dst_intrsct, inc_pt = ifc.intersect(pp_pt_before, b4_dir,
+                                                       eps=eps,
+                                                       z_dir=z_dir_before)
+            else:
+                pp_dst_intrsct, inc_pt = rec.intersect(surf, ifc,
+                                                       pp_pt_before, b4_dir,
+                                                       eps, z_dir_before)
             dst_b4 = pp_dst + pp_dst_intrsct
             ray.append([before_pt, before_dir, dst_b4, before_normal])
 
@@ -211,25 +280,41 @@ def trace_raw(path, pt0, dir0, wvl, eps=1.0e-12, check_apertures=False, **kwargs
             ray_miss.ifc = ifc
             ray_miss.prev_tfrm = before[mc.Tfrm]
             ray_miss.ray_pkg = ray, opl, wvl
-            raise ray_miss
+            if rec is not None:
+                rec.record_error(surf, ray_miss)
+            if raise_errors:
+                raise ray_miss
+            return ray_miss
 
         except TraceTIRError as ray_tir:
             ray.append([inc_pt, before_dir, 0.0, normal])
             ray_tir.surf = surf
             ray_tir.ray_pkg = ray, opl, wvl
-            raise ray_tir
+            if rec is not None:
+                rec.record_error(surf, ray_tir)
+            if raise_errors:
+                raise ray_tir
+            return ray_tir
 
         except TraceRayBlockedError as ray_blocked:
             ray.append([inc_pt, before_dir, 0.0, normal])
             ray_blocked.surf = surf
             ray_blocked.ray_pkg = ray, opl, wvl
-            raise ray_blocked
-            
+            if rec is not None:
+                rec.record_error(surf, ray_blocked)
+            if raise_errors:
+                raise ray_blocked
+            return ray_blocked
+
         except TraceEvanescentRayError as ray_evn:
             ray.append([inc_pt, before_dir, 0.0, normal])
             ray_evn.surf = surf
             ray_evn.ray_pkg = ray, opl, wvl
-            raise ray_evn
+            if rec is not None:
+                rec.record_error(surf, ray_evn)
+            if raise_errors:
+                raise ray_evn
+            return ray_evn
 
         except StopIteration:
             ray.append([inc_pt, after_dir, 0.0, normal])
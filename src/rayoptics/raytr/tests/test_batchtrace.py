@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the batch ray trace against the single ray trace"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+from numpy.linalg import norm
+
+import rayoptics as ro
+import rayoptics.optical.model_constants as mc
+from rayoptics.elem.surface import Rectangular
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import batchtrace as bt
+from rayoptics.raytr import raytrace as rt
+from rayoptics.raytr import trace
+from rayoptics.raytr import traceerror as terr
+from rayoptics.raytr import vigcalc
+from rayoptics.raytr import waveabr
+from rayoptics.raytr.opticalspec import Field
+from rayoptics.raytr.traceerror import TraceError
+
+
+def starting_rays(opm, fld, pupil_pts):
+    """ start rays from the object toward the paraxial entrance pupil """
+    fod = opm['analysis_results']['parax_data'].fod
+    pt0 = opm['osp'].obj_coords(fld)
+    pts, dirs = [], []
+    for x, y in pupil_pts:
+        pt1 = np.array([fod.enp_radius*x, fod.enp_radius*y,
+                        fod.obj_dist+fod.enp_dist])
+        dir0 = pt1 - pt0
+        pts.append(pt0)
+        dirs.append(dir0/np.linalg.norm(dir0))
+    return np.array(pts), np.array(dirs)
+
+
+class BatchTraceTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        self.sm = self.opm['seq_model']
+        self.wvl = self.sm.central_wavelength()
+        self.fld = self.opm['osp'].field_of_view.fields[-1]
+
+    def compare_to_trace(self, pupil_pts):
+        sm, wvl = self.sm, self.wvl
+        pts, dirs = starting_rays(self.opm, self.fld, pupil_pts)
+        bundle = bt.trace_batch(sm, pts, dirs, wvl)
+        ray_pkgs = []
+        for i in range(len(pts)):
+            try:
+                ray_pkg = rt.trace(sm, pts[i], dirs[i], wvl)
+                ray, op, _ = ray_pkg
+                self.assertEqual(bundle.status[i], terr.ok)
+                self.assertEqual(bundle.fail_surf[i], -1)
+                self.assertAlmostEqual(bundle.op_delta[i], op, places=9)
+            except TraceError as rayerr:
+                ray_pkg = rayerr
+                ray, op, _ = rayerr.ray_pkg
+                self.assertEqual(bundle.status[i], rayerr.status)
+                self.assertEqual(bundle.fail_surf[i], rayerr.surf)
+            ray_pkgs.append(ray_pkg)
+
+            bundle_ray = bundle[i]
+            self.assertEqual(len(bundle_ray), len(ray))
+            for seg, bseg in zip(ray, bundle_ray):
+                npt.assert_allclose(bseg[mc.p], seg[mc.p], atol=1e-9)
+                npt.assert_allclose(bseg[mc.d], seg[mc.d], atol=1e-12)
+                npt.assert_allclose(bseg[mc.dst], seg[mc.dst], atol=1e-9)
+
+        # round trip the scalar results through a RayBundle
+        list_bundle = bt.RayBundle.from_ray_pkgs(ray_pkgs,
+                                                 num_surfs=len(sm.ifcs))
+        npt.assert_array_equal(list_bundle.status, bundle.status)
+        npt.assert_allclose(list_bundle.data, bundle.data, atol=1e-9)
+        return bundle.status
+
+    def test_pupil_grid(self):
+        grid = np.linspace(-1., 1., 11)
+        pupil_pts = [(x, y) for x in grid for y in grid]
+        status = self.compare_to_trace(pupil_pts)
+        self.assertTrue(np.all(status == terr.ok))
+
+    def test_trace_plan_cache(self):
+        sm, wvl = self.sm, self.wvl
+        plan = sm.trace_plan(wvl)
+        self.assertIs(plan, sm.trace_plan(wvl))
+        self.assertEqual(len(plan), len(sm.ifcs))
+        self.assertEqual(plan.rot.shape, (len(sm.ifcs), 3, 3))
+        self.assertFalse(plan.rndx.flags.writeable)
+
+        # an update without changes keeps the plan
+        self.opm.update_model()
+        self.assertIs(plan, sm.trace_plan(wvl))
+        sm.gaps[2].thi += 0.1
+        self.opm.update_model()
+        new_plan = sm.trace_plan(wvl)
+        self.assertIsNot(plan, new_plan)
+        self.assertGreater(new_plan.revision, plan.revision)
+
+        # the cache is bounded, dropping the least recently used plans
+        sm.trace_plan(wvl)
+        for wl in np.linspace(450., 650., 2*sm.trace_plans_maxsize):
+            sm.trace_plan(wl)
+        self.assertEqual(len(sm._trace_plans), sm.trace_plans_maxsize)
+        self.assertIsNot(sm.trace_plan(wvl), new_plan)
+
+    def test_failed_rays(self):
+        pupil_pts = [(0., y) for y in np.linspace(-5., 5., 41)]
+        status = self.compare_to_trace(pupil_pts)
+        self.assertTrue(np.any(status == terr.missed_surface))
+        self.assertTrue(np.any(status == terr.ok))
+
+    def test_error_status_without_raising(self):
+        sm, wvl = self.sm, self.wvl
+        pts, dirs = starting_rays(self.opm, self.fld, [(0., 5.)])
+        with self.assertRaises(TraceError) as cm:
+            rt.trace(sm, pts[0], dirs[0], wvl)
+        rayerr = rt.trace(sm, pts[0], dirs[0], wvl, raise_errors=False)
+        self.assertIsInstance(rayerr, type(cm.exception))
+        self.assertEqual(rayerr.surf, cm.exception.surf)
+        self.assertEqual(rayerr.status, terr.missed_surface)
+
+    def test_ray_results_from_bundle(self):
+        pupils = [(0., y) for y in np.linspace(-5., 5., 21)]
+        bundle = trace.trace_bundle(self.opm, pupils, self.fld, self.wvl)
+        results = trace.ray_results_from_bundle(bundle, None, 'summary')
+        for pupil, ray_result in zip(pupils, results):
+            expected = trace.trace_safe(self.opm, pupil, self.fld, self.wvl,
+                                        None, 'summary')
+            if isinstance(expected, TraceError):
+                self.assertIs(type(ray_result), type(expected))
+                self.assertEqual(ray_result.surf, expected.surf)
+                self.assertIsNone(ray_result.ray_pkg)
+            else:
+                self.assertAlmostEqual(ray_result[mc.op], expected[mc.op],
+                                       places=9)
+                npt.assert_allclose(ray_result[mc.ray][-1][mc.p],
+                                    expected[mc.ray][-1][mc.p], atol=1e-9)
+
+    def test_spectral_batch(self):
+        sm = self.sm
+        wvls = self.opm['osp']['wvls'].wavelengths
+        grid = np.linspace(-1., 1., 5)
+        pupil_pts = [(x, y) for x in grid for y in grid]
+        pts, dirs = starting_rays(self.opm, self.fld, pupil_pts)
+        spectral_bundle = bt.trace_spectral_batch(sm, pts, dirs, wvls)
+        self.assertEqual(len(spectral_bundle), len(wvls)*len(pts))
+        num_rays = len(pts)
+        for wi, wvl in enumerate(wvls):
+            bundle = bt.trace_batch(sm, pts, dirs, wvl)
+            rays = slice(wi*num_rays, (wi+1)*num_rays)
+            npt.assert_array_equal(spectral_bundle.wvl[rays], wvl)
+            npt.assert_array_equal(spectral_bundle.status[rays],
+                                   bundle.status)
+            npt.assert_allclose(spectral_bundle.data[rays], bundle.data,
+                                atol=1e-12)
+            npt.assert_allclose(spectral_bundle.op_delta[rays],
+                                bundle.op_delta, atol=1e-12)
+
+    def test_aim_chief_rays(self):
+        osp = self.opm['osp']
+        flds = [Field(y=y) for y in np.linspace(0., 20., 11)]
+        wvls = osp['wvls'].wavelengths
+        aim_pts = trace.aim_chief_rays(self.opm, flds, wvls=wvls)
+        self.assertEqual(aim_pts.shape, (len(flds), len(wvls), 2))
+        for fld, fld_aim_pts in zip(flds, aim_pts):
+            for wvl, aim_pt in zip(wvls, fld_aim_pts):
+                npt.assert_allclose(aim_pt,
+                                    trace.aim_chief_ray(self.opm, fld, wvl),
+                                    atol=1e-6)
+        # the default is the central wavelength
+        aim_pts = trace.aim_chief_rays(self.opm, flds)
+        self.assertEqual(aim_pts.shape, (len(flds), 2))
+        stop_pts = trace.stop_intercepts(self.opm, flds, self.wvl, aim_pts)
+        npt.assert_allclose(np.array(stop_pts), 0., atol=1e-6)
+
+    def test_aim_chief_rays_warm_start(self):
+        # an object at infinity limits the resolution of the aim points
+        root_pth = Path(ro.__file__).resolve().parent
+        opm = open_model(root_pth/'codev/tests/ag_dblgauss.seq')
+        osp = opm['osp']
+        wvl = osp['wvls'].central_wvl
+        flds = osp['fov'].fields
+        enp_radius = opm['analysis_results']['parax_data'].fod.enp_radius
+        start = np.array([[0., 0.9*enp_radius]]*len(flds))
+        aim_pts = trace.aim_chief_rays(opm, flds, start=start)
+        for fld, aim_pt, start_pt in zip(flds, aim_pts, start):
+            scalar_aim_pt = trace.aim_chief_ray(opm, fld, wvl,
+                                                start=start_pt)
+            miss = norm(trace.stop_intercept(opm, fld, wvl, aim_pt))
+            scalar_miss = norm(trace.stop_intercept(opm, fld, wvl,
+                                                    scalar_aim_pt))
+            self.assertLessEqual(miss, scalar_miss + 1e-12)
+
+    def test_calc_vignetting(self):
+        flds = [Field(y=y) for y in np.linspace(0., 20., 5)]
+        vigcalc.calc_vignetting(self.opm, flds, self.wvl)
+        start_dirs = [[1., 0.], [-1., 0.], [0., 1.], [0., -1.]]
+        for fld in flds:
+            vig_factors = [vigcalc.calc_vignetted_ray(self.opm, d//2, sd,
+                                                      fld, self.wvl)[0]
+                           for d, sd in enumerate(start_dirs)]
+            npt.assert_allclose([fld.vux, fld.vlx, fld.vuy, fld.vly],
+                                vig_factors, atol=1e-6)
+
+    def test_calc_vignetting_limiting_apertures(self):
+        """ the fields of these models are limited by many apertures """
+        root_pth = Path(ro.__file__).resolve().parent
+        start_dirs = [[1., 0.], [-1., 0.], [0., 1.], [0., -1.]]
+        for model in ('US05831776-1.zmx', 'US08011793-1.zmx'):
+            opm = open_model(root_pth/'zemax/tests'/model)
+            osp = opm['osp']
+            flds = osp['fov'].fields
+            wvl = osp['wvls'].central_wvl
+            vigcalc.calc_vignetting(opm, flds, wvl)
+            limits = set()
+            for fld in flds:
+                results = [vigcalc.calc_vignetted_ray(opm, d//2, sd, fld, wvl)
+                           for d, sd in enumerate(start_dirs)]
+                limits.update(r[1] for r in results)
+                npt.assert_allclose([fld.vux, fld.vlx, fld.vuy, fld.vly],
+                                    [r[0] for r in results], atol=1e-6)
+            self.assertGreater(len(limits), 1)
+
+    def test_wave_abr_array(self):
+        opm, fld, wvl = self.opm, self.fld, self.wvl
+        fod = opm['analysis_results']['parax_data'].fod
+        foc = 0.1
+        ref_sphere, cr_pkg = trace.setup_pupil_coords(opm, fld, wvl, foc)
+        grid = np.linspace(-1.2, 1.2, 9)
+        pupils = [(x, y) for x in grid for y in grid]
+        bundle = trace.trace_bundle(opm, pupils, fld, wvl,
+                                    check_apertures=True)
+        opd = waveabr.wave_abr_full_calc_array(fod, fld, wvl, foc, bundle,
+                                               cr_pkg, ref_sphere)
+        ok = bundle.status == terr.ok
+        self.assertTrue(np.any(ok) and not np.all(ok))
+        self.assertTrue(np.all(np.isnan(opd[~ok])))
+        for i in np.flatnonzero(ok):
+            self.assertAlmostEqual(
+                opd[i], waveabr.wave_abr_full_calc(fod, fld, wvl, foc,
+                                                   bundle.ray_pkg(i), cr_pkg,
+                                                   ref_sphere), places=12)
+
+    def test_clear_apertures(self):
+        sm = self.sm
+        sm.set_clear_apertures()
+        rayset = trace.trace_boundary_rays(self.opm)
+        for i, ifc in enumerate(sm.ifcs):
+            max_ap = max(np.hypot(*ray[mc.ray][i][mc.p][:2])
+                         for rim_rays in rayset for ray in rim_rays)
+            self.assertAlmostEqual(ifc.max_aperture, max_ap, places=9)
+        # sampling the pupil rim never shrinks the apertures
+        max_aps = np.array([ifc.max_aperture for ifc in sm.ifcs])
+        sm.set_clear_apertures(num_rays=32)
+        dense_max_aps = np.array([ifc.max_aperture for ifc in sm.ifcs])
+        self.assertTrue(np.all(dense_max_aps >= max_aps - 1e-12))
+
+        # the automatic apertures use aperture_rays, and size rectangles too
+        ca = Rectangular(x_half_width=100., y_half_width=100.)
+        sm.ifcs[2].clear_apertures = [ca]
+        sm.aperture_rays = 32
+        self.opm.update_model()
+        npt.assert_allclose([ifc.max_aperture for ifc in sm.ifcs],
+                            dense_max_aps, atol=1e-12)
+        self.assertLess(ca.x_half_width, ca.y_half_width)
+        self.assertAlmostEqual(ca.y_half_width, sm.ifcs[2].max_aperture,
+                               places=9)
+
+    def test_point_inside_array(self):
+        ifc = self.sm.ifcs[2]
+        ifc.clear_apertures = [Rectangular(x_half_width=2., y_half_width=1.,
+                                           x_offset=0.5)]
+        x, y = np.meshgrid(np.linspace(-3., 3., 13), np.linspace(-2., 2., 9))
+        x, y = x.ravel(), y.ravel()
+        inside = ifc.point_inside_array(x, y)
+        npt.assert_array_equal(inside, [ifc.point_inside(xi, yi)
+                                        for xi, yi in zip(x, y)])
+        self.assertTrue(np.any(inside) and not np.all(inside))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
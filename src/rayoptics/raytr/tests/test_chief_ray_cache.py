@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the model's chief ray and reference sphere cache"""
+
+import unittest
+from pathlib import Path
+
+import numpy.testing as npt
+
+import rayoptics as ro
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import analyses
+from rayoptics.raytr import trace
+
+
+class ChiefRayCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        self.osp = self.opm['optical_spec']
+        self.fld = self.osp['fov'].fields[-1]
+        self.cache = self.opm.chief_ray_cache
+
+    def test_wavelength_cycling(self):
+        wvls = self.osp['wvls'].wavelengths
+        for i in range(3):
+            for wvl in wvls:
+                analyses.eval_fan(self.opm, self.fld, wvl, 0., 1)
+        self.assertEqual(self.cache.misses, len(wvls))
+        self.assertIsNone(self.fld.chief_ray)
+        self.assertIsNone(self.fld.ref_sphere)
+
+    def test_cached_results(self):
+        wvl = self.osp['wvls'].central_wvl
+        ref_sphere, cr_pkg = trace.setup_pupil_coords(self.opm, self.fld,
+                                                      wvl, 0.1)
+        cr, cr_exp_seg = trace.trace_chief_ray(self.opm, self.fld, wvl, 0.1)
+        npt.assert_array_equal(cr_pkg[0].ray[-1][0], cr.ray[-1][0])
+        self.assertIs(trace.get_chief_ray_pkg(self.opm, self.fld, wvl, 0.),
+                      cr_pkg)
+        # a change in focus reuses the chief ray, not the reference sphere
+        ref_sphere_foc, _ = trace.setup_pupil_coords(self.opm, self.fld,
+                                                     wvl, 0.2)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertNotEqual(ref_sphere[0][2], ref_sphere_foc[0][2])
+
+    def test_model_update(self):
+        wvl = self.osp['wvls'].central_wvl
+        cr_pkg = trace.get_chief_ray_pkg(self.opm, self.fld, wvl, 0.)
+        self.opm['seq_model'].gaps[2].thi += 0.5
+        self.opm.update_model()
+        new_cr_pkg = trace.get_chief_ray_pkg(self.opm, self.fld, wvl, 0.)
+        self.assertIsNot(new_cr_pkg, cr_pkg)
+        self.assertEqual(len(self.cache.chief_rays), 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the pool executors against serial evaluation"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+
+import rayoptics as ro
+from rayoptics.gui.appcmds import open_model
+from rayoptics.mpl.axisarrayfigure import SpotDiagramFigure
+from rayoptics.raytr import analyses
+from rayoptics.raytr import executor
+
+
+class ExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        self.expected = analyses.eval_field_wvl_array(
+            self.opm, analyses.wavefront_cell, num_rays=8)
+
+    def compare_to_serial(self, kind):
+        with executor.get_executor(self.opm, kind, max_workers=2) as exe:
+            results = analyses.eval_field_wvl_array(
+                self.opm, analyses.wavefront_cell, executor=exe, num_rays=8)
+        self.assertEqual(len(results), len(self.expected))
+        for fld_results, fld_expected in zip(results, self.expected):
+            self.assertEqual(len(fld_results), len(fld_expected))
+            for opd, expected_opd in zip(fld_results, fld_expected):
+                npt.assert_allclose(opd, expected_opd, atol=1e-12)
+
+    def test_thread_executor(self):
+        self.compare_to_serial('thread')
+
+    def test_process_executor(self):
+        self.compare_to_serial('process')
+
+    def test_figure_after_model_change(self):
+        fig = SpotDiagramFigure(self.opm, executor='thread')
+        self.opm['seq_model'].gaps[-1].thi += 0.5
+        self.opm.update_model()
+        fig.update_data()
+        serial_fig = SpotDiagramFigure(self.opm)
+        for row, serial_row in zip(fig.axis_data_array,
+                                   serial_fig.axis_data_array):
+            for cell, serial_cell in zip(row, serial_row):
+                for grid, serial_grid in zip(cell[0], serial_cell[0]):
+                    npt.assert_allclose(np.asarray(grid, dtype=float),
+                                        np.asarray(serial_grid, dtype=float),
+                                        atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the diffraction MTF calculation"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+
+import rayoptics as ro
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import mtf
+
+
+def circular_pupil_opd(n, opd_fct):
+    c = (np.arange(n) - (n - 1)/2)/(n/2)
+    x, y = np.meshgrid(c, c, indexing='ij')
+    return np.where(np.hypot(x, y) <= 1., opd_fct(x, y), np.nan)
+
+
+class MTFTestCase(unittest.TestCase):
+    def test_line_otf(self):
+        n = 128
+        # a perfect circular pupil has the diffraction limited MTF
+        opd = circular_pupil_opd(n, lambda x, y: 0.*x)
+        lags = np.array([0., 16., 32.5, 64., 100., 127.5, 128.])
+        nu = lags/n
+        mtf_dl = 2/np.pi*(np.arccos(nu) - nu*np.sqrt(1 - nu**2))
+        npt.assert_allclose(np.abs(mtf.line_otf(opd, lags, 1)), mtf_dl,
+                            atol=2e-3)
+
+        # integer shears match the 2D autocorrelation of the pupil
+        opd = circular_pupil_opd(n, lambda x, y: 0.3*(x**2 + y**2)*(1 + y))
+        pupil = np.where(np.isnan(opd), 0., np.exp(2j*np.pi*opd))
+        spectrum = np.fft.fft2(pupil, s=(2*n, 2*n))
+        otf = np.fft.ifft2(np.abs(spectrum)**2)
+        otf /= otf[0, 0]
+        lags = np.arange(0, n, 7)
+        npt.assert_allclose(mtf.line_otf(opd, lags, 0), otf[lags, 0],
+                            atol=1e-12)
+        npt.assert_allclose(mtf.line_otf(opd[np.newaxis], lags, 1)[0],
+                            otf[0, lags], atol=1e-12)
+
+    def test_diffraction_mtf(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        osp = opm['optical_spec']
+        freqs = np.linspace(0., 100., 11)
+        focs = np.linspace(-0.1, 0.1, 5)
+        diff_mtf = mtf.DiffractionMTF(opm, freqs, focs, num_rays=21)
+        num_flds = len(osp['fov'].fields)
+        num_wvls = len(osp['wvls'].wavelengths)
+        self.assertEqual(diff_mtf.otf.shape,
+                         (num_flds, num_wvls, 2, len(focs), len(freqs)))
+        poly_mtf = diff_mtf.mtf()
+        self.assertEqual(poly_mtf.shape, (num_flds, 2, len(focs), len(freqs)))
+        npt.assert_allclose(poly_mtf[..., 0], 1.)
+        self.assertTrue(np.all(poly_mtf <= 1. + 1e-12))
+        # the polychromatic MTF is no better than the best wavelength
+        mono_mtf = np.array([diff_mtf.mtf(wi) for wi in range(num_wvls)])
+        self.assertTrue(np.all(poly_mtf <= np.max(mono_mtf, axis=0) + 1e-12))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
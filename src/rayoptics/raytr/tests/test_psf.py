@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the PSF calculations"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+
+import rayoptics as ro
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import analyses
+
+
+def direct_psf(wavefront, mask, maxdim):
+    """ reference PSF, the wavefront centered on a maxdim array """
+    ndim = len(wavefront)
+    start = maxdim//2 - (ndim//2 - 1)
+    pupil = np.zeros((maxdim, maxdim), dtype=complex)
+    pupil[start:start+ndim, start:start+ndim] = (
+        mask*np.exp(2j*np.pi*np.nan_to_num(wavefront)))
+    AP = np.abs(np.fft.fftshift(np.fft.fft2(np.fft.fftshift(pupil))))**2
+    return AP/AP.max()
+
+
+class PSFTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        self.pupil_grid = analyses.RayGrid(self.opm, f=-1, num_rays=32)
+
+    def test_psf_engine(self):
+        wavefront = self.pupil_grid.grid[2]
+        mask = self.pupil_grid.pupil_mask()
+        npt.assert_array_equal(mask, ~np.isnan(wavefront))
+        self.assertTrue(np.any(mask) and not np.all(mask))
+
+        psf_engine = analyses.PSFEngine(32, 250)
+        self.assertEqual(psf_engine.size, 250)
+        psf_engine = analyses.PSFEngine(32, 251)
+        self.assertGreaterEqual(psf_engine.size, 251)
+        size = psf_engine.size
+        AP = psf_engine.psf(wavefront, mask=mask)
+        npt.assert_allclose(AP, direct_psf(wavefront, mask, size),
+                            atol=1e-12)
+        # the padded buffer is reused
+        npt.assert_allclose(psf_engine.psf(wavefront, mask=mask), AP,
+                            atol=1e-14)
+        AP = psf_engine.psf(wavefront, apodization=np.ones((32, 32)))
+        npt.assert_allclose(AP, direct_psf(wavefront, mask, size),
+                            atol=1e-12)
+
+        # samples with zero OPD are inside the pupil
+        flat = np.where(mask, 0., np.nan)
+        AP = analyses.calc_psf(flat, 32, 128)
+        npt.assert_allclose(AP, direct_psf(flat, mask, 128), atol=1e-12)
+
+    def test_mft_psf(self):
+        wavefront = self.pupil_grid.grid[2]
+        mask = self.pupil_grid.pupil_mask()
+        # sampled like the FFT, the MFT reproduces the FFT PSF
+        maxdim = 250
+        fft_samples = (np.arange(maxdim) - maxdim//2)*32/maxdim
+        AP = analyses.calc_psf_mft(wavefront, 32, fft_samples, mask=mask)
+        npt.assert_allclose(AP, analyses.calc_psf(wavefront, 32, maxdim,
+                                                  mask=mask), atol=1e-12)
+
+        samples, mft_samples = analyses.psf_image_window(self.pupil_grid, 65)
+        diffraction_unit = analyses.calc_psf_diffraction_unit(self.pupil_grid)
+        self.assertAlmostEqual(samples[-1], 5*1.22*diffraction_unit)
+        delta_x, delta_xp = analyses.calc_psf_scaling(self.pupil_grid, 32,
+                                                      maxdim)
+        self.assertAlmostEqual(delta_xp, 32/maxdim*diffraction_unit)
+
+        mft_engine = analyses.MFTEngine(32, mft_samples, mft_samples[:33])
+        AP = mft_engine.psf(wavefront, mask=mask)
+        self.assertEqual(AP.shape, (65, 33))
+        self.assertAlmostEqual(np.max(AP), 1.)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
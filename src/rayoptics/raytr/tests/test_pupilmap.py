@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test real ray aiming using pupil maps"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+
+import rayoptics as ro
+import rayoptics.optical.model_constants as mc
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import trace
+from rayoptics.raytr import traceerror as terr
+
+
+class PupilMapTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        self.osp = self.opm['optical_spec']
+        self.fld = self.osp['fov'].fields[-1]
+        self.wvl = self.osp['wvls'].central_wvl
+        sm = self.opm['seq_model']
+        self.stop = sm.stop_surface
+        ax_ray = self.opm['analysis_results']['parax_data'].ax_ray
+        self.stop_radius = abs(ax_ray[self.stop][mc.ht])
+        grid = np.linspace(-1., 1., 9)
+        self.pupils = np.array([(x, y) for x in grid for y in grid
+                                if x**2 + y**2 <= 1.])
+
+    def stop_error(self):
+        bundle = trace.trace_bundle(self.opm, self.pupils, self.fld,
+                                    self.wvl, apply_vignetting=False)
+        self.assertTrue(np.all(bundle.status == terr.ok))
+        stop_pts = bundle.p[:, self.stop, :2]
+        return np.max(np.abs(stop_pts - self.stop_radius*self.pupils))
+
+    def test_real_aiming(self):
+        self.assertIsNone(self.osp.pupil_map(self.fld))
+        paraxial_error = self.stop_error()
+
+        self.osp.real_aiming = True
+        self.opm.update_model()
+        pupil_map = self.osp.pupil_map(self.fld)
+        self.assertIs(pupil_map, self.osp.pupil_map(self.fld))
+        self.assertLess(self.stop_error(), 1e-5*self.stop_radius)
+        self.assertLess(self.stop_error(), 1e-3*paraxial_error)
+
+        # the chief ray is aimed at the center of the stop
+        npt.assert_allclose(pupil_map.aim_points([0., 0.])[0],
+                            self.osp.aim_point(self.fld), atol=1e-8)
+
+        # the maps are recomputed after the model is rebuilt
+        self.opm.update_model(build='rebuild')
+        self.assertIsNot(self.osp.pupil_map(self.fld), pupil_map)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
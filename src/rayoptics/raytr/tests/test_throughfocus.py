@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test through-focus stacks of wavefront and spot data"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+
+import rayoptics as ro
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import analyses
+from rayoptics.raytr.throughfocus import ThroughFocus
+
+
+class ThroughFocusTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        self.focs = np.linspace(-0.5, 0.5, 21)
+        self.tf = ThroughFocus(self.opm, self.focs, f=0, num_rays=21)
+
+    def test_focus_stack(self):
+        tf = self.tf
+        self.assertEqual(tf.opd.shape, (len(self.focs), 21, 21))
+        self.assertEqual(tf.ta.shape, (len(self.focs), 21, 21, 2))
+        # each slice of the stack matches a single focus evaluation
+        for k in (0, 7, 20):
+            wavefront = analyses.eval_wavefront(self.opm, tf.fld, tf.wvl,
+                                                self.focs[k], num_rays=21)
+            npt.assert_allclose(tf.opd[k], wavefront[..., 2], atol=1e-10)
+
+    def test_best_focus(self):
+        tf = self.tf
+        for metric in tf.metrics:
+            best_foc = tf.best_focus(metric)
+            self.assertGreater(best_foc, self.focs[0])
+            self.assertLess(best_foc, self.focs[-1])
+            opd, ta = tf.focus_stack([best_foc - 1e-3, best_foc,
+                                      best_foc + 1e-3])
+            values = tf._metric_values(metric, opd, ta)
+            self.assertLessEqual(values[1], values[0])
+            self.assertLessEqual(values[1], values[2])
+        self.assertTrue(np.all(tf.strehl() <= 1.))
+
+        # the stack keeps the order of the focus shifts passed in
+        shuffled = np.random.default_rng(1).permutation(self.focs)
+        shuffled_tf = ThroughFocus(self.opm, shuffled, f=0, num_rays=21)
+        npt.assert_array_equal(shuffled_tf.focus_shifts, shuffled)
+        order = np.argsort(shuffled)
+        npt.assert_allclose(shuffled_tf.opd[order], tf.opd, atol=1e-12)
+        self.assertAlmostEqual(shuffled_tf.best_focus(), tf.best_focus(),
+                               places=5)
+        with self.assertRaises(ValueError):
+            tf.best_focus('encircled_energy')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the per-surface trace instrumentation"""
+
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import rayoptics as ro
+from rayoptics.elem.profiles import EvenPolynomial
+from rayoptics.gui.appcmds import open_model
+from rayoptics.raytr import trace
+from rayoptics.raytr import tracestats
+from rayoptics.raytr.traceerror import TraceError
+
+
+class TraceStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        self.opm = open_model(root_pth/'models/Sasian Triplet.roa')
+        self.fld, self.wvl, foc = self.opm['osp'].lookup_fld_wvl_focus(-1)
+
+    def tearDown(self):
+        tracestats.disable()
+
+    def test_scalar_and_batch_stats(self):
+        opm, fld, wvl = self.opm, self.fld, self.wvl
+        pupils = [(0., y) for y in np.linspace(-5., 5., 21)]
+
+        stats = opm.enable_trace_stats()
+        num_failed = 0
+        for pupil in pupils:
+            ray_result = trace.trace_safe(opm, pupil, fld, wvl,
+                                          None, 'summary')
+            if isinstance(ray_result, TraceError):
+                num_failed += 1
+        bundle = trace.trace_bundle(opm, pupils, fld, wvl)
+        opm.disable_trace_stats()
+        self.assertIsNone(tracestats.recorder)
+        self.assertIs(opm.trace_stats, stats)
+
+        df = stats.summary()
+        self.assertEqual(df.loc[1, 'rays'], 2*len(pupils))
+        self.assertEqual(df.loc[1, 'calls'], len(pupils) + 1)
+        self.assertGreater(df.loc[1, 'time'], 0.0)
+        # both traces lose the same rays
+        num_errors = sum(sum(errs.values())
+                         for errs in stats.errors.values())
+        self.assertEqual(num_errors, 2*num_failed)
+        self.assertEqual(num_failed, np.count_nonzero(bundle.status))
+
+        # nothing is recorded once disabled
+        trace.trace_bundle(opm, pupils, fld, wvl)
+        self.assertEqual(stats.summary().loc[1, 'rays'], 2*len(pupils))
+
+    def test_newton_iterations(self):
+        root_pth = Path(ro.__file__).resolve().parent
+        opm = open_model(root_pth/'codev/tests/asp46.seq')
+        fld, wvl, foc = opm['osp'].lookup_fld_wvl_focus(-1)
+        grid = np.linspace(-1., 1., 5)
+        pupils = [(x, y) for x in grid for y in grid if x*x + y*y <= 1.]
+
+        with tracestats.TraceStats() as stats:
+            for pupil in pupils:
+                trace.trace_base(opm, pupil, fld, wvl)
+        with tracestats.TraceStats() as batch_stats:
+            trace.trace_bundle(opm, pupils, fld, wvl)
+
+        # only the aspheric surface is intersected iteratively
+        self.assertIsInstance(opm['sm'].ifcs[1].profile, EvenPolynomial)
+        self.assertEqual(list(stats.newton_iters), [1])
+        self.assertEqual(stats.newton_iters, batch_stats.newton_iters)
+        counts, iters = stats.iteration_histogram(1)
+        self.assertEqual(counts.sum(), len(pupils))
+        self.assertGreater(iters[0], 0)
+        df = stats.summary()
+        self.assertEqual(df.loc[1, 'max iters'], iters[-1])
+        self.assertTrue(np.isnan(df.loc[2, 'mean iters']))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
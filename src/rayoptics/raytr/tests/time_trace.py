@@ -1,29 +1,80 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
+Benchmark suite for ray tracing and analysis
+
+Times the core model building, ray tracing and analysis functions for every
+model in models/*.roa and codev/tests/*.seq. The results are saved as JSON,
+together with metadata describing the environment the benchmarks were run
+in. If a baseline results file is given, the per-call times are compared
+to it and slowdowns larger than a threshold are reported as regressions;
+the exit status is 1 if there are any.
+
+Usage::
+
+    python time_trace.py [-o results.json] [-b baseline.json]
+                         [--threshold 0.2] [-k pattern] [--quick]
+
 Created on Thu Oct 25 12:16:36 2018
 
 @author: Mike
 """
-import math
-import numpy as np
-from pathlib import Path
-import csv
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
 import timeit
+from pathlib import Path
+
+import numpy as np
+import scipy
+import matplotlib
 
 # ray-optics
 import rayoptics as ro
 from rayoptics.gui.appcmds import open_model
+from rayoptics.mpl.axisarrayfigure import (RayFanFigure, SpotDiagramFigure,
+                                           WavefrontFigure)
+from rayoptics.parax.firstorder import compute_first_order
 import rayoptics.raytr.raytrace as rt
+from rayoptics.raytr import analyses
+from rayoptics.raytr import trace
+from rayoptics.raytr import vigcalc
+from rayoptics.raytr.mtf import DiffractionMTF
+from rayoptics.raytr.throughfocus import ThroughFocus
 from rayoptics.util.misc_math import normalize
 
+root_pth = Path(ro.__file__).resolve().parent
+
+model_globs = ('models/*.roa', 'codev/tests/*.seq')
+
+
+def find_models(pattern=None):
+    """ returns the benchmark model paths, relative to the package root """
+    filenames = []
+    for model_glob in model_globs:
+        for pth in sorted(root_pth.glob(model_glob)):
+            filename = pth.relative_to(root_pth).as_posix()
+            if pattern is None or fnmatch.fnmatch(filename, pattern):
+                filenames.append(filename)
+    return filenames
+
 
 def setup(filename):
-    root_pth = Path(ro.__file__).resolve().parent
+    """ returns the trace args for a single ray from the edge field """
     opm = open_model(root_pth/filename)
+    return single_ray_args(opm)
+
+
+def single_ray_args(opm):
     sm = opm.seq_model
     osp = opm.optical_spec
-    fld, wvl, foc = osp.lookup_fld_wvl_focus(1)
+    fld, wvl, foc = osp.lookup_fld_wvl_focus(-1)
     vig_pupil = fld.apply_vignetting([0.5, 0.5])
     fod = opm['analysis_results']['parax_data'].fod
     eprad = fod.enp_radius
@@ -34,100 +85,188 @@ def setup(filename):
     return (sm, pt0, dir0, wvl)
 
 
-def run_test(tst_name, setup_stmt, trials, repeat=5, file=None):
-    output = '{:s} - {} trials: min time {:.2f}, ' \
-             'max time {:.2f}, spread {:.2f}%'
-    t = timeit.repeat('ray=rt.trace(*trace_args)', setup=setup_stmt,
-                      number=trials, repeat=repeat, globals=globals())
-    pcnt_sprd = 100*(max(t) - min(t))/min(t)
-    print(output.format(tst_name, trials, min(t), max(t), pcnt_sprd),
-          file=file)
-    return [tst_name, trials, min(t), max(t), pcnt_sprd, t]
+def benchmark_cases(filename, opm):
+    """ returns a list of (case name, callable) to be timed for **opm**
+
+    The cases that modify the model, i.e. setting vignetting and
+    apertures, are placed at the end of the list.
+    """
+    sm = opm['seq_model']
+    osp = opm['optical_spec']
+    fld, wvl, foc = osp.lookup_fld_wvl_focus(-1)
+    grid_def = [np.array([-1., -1.]), np.array([1., 1.]), 21]
+    trace_args = single_ray_args(opm)
+    pupil_grid = analyses.RayGrid(opm, f=fld, wl=wvl, foc=foc, num_rays=32)
+    wavefront = pupil_grid.grid[2]
+    _, mft_samples = analyses.psf_image_window(pupil_grid, 256)
+
+    def build_figure(figure_type, **kwargs):
+        fig = figure_type(opm, **kwargs)
+        return fig.update_data
+
+    cases = [
+        ('open_model', lambda: open_model(root_pth/filename)),
+        ('update_model', lambda: opm.update_model()),
+        ('compute_first_order',
+         lambda: compute_first_order(opm, sm.stop_surface, wvl)),
+        ('trace_ray', lambda: rt.trace(*trace_args)),
+        ('aim_chief_ray', lambda: trace.aim_chief_ray(opm, fld, wvl)),
+        ('aim_chief_rays',
+         lambda: trace.aim_chief_rays(opm, osp['fov'].fields)),
+        ('eval_fan', lambda: analyses.eval_fan(opm, fld, wvl, foc, 1)),
+        ('eval_wavefront',
+         lambda: analyses.eval_wavefront(opm, fld, wvl, foc, num_rays=32)),
+        ('trace_ray_grid',
+         lambda: analyses.trace_ray_grid(opm, grid_def, fld, wvl, foc)),
+        ('through_focus',
+         lambda: ThroughFocus(opm, np.linspace(-0.1, 0.1, 21), f=fld, wl=wvl,
+                              num_rays=32)),
+        ('diffraction_mtf',
+         lambda: DiffractionMTF(opm, np.linspace(0., 100., 21),
+                                np.linspace(-0.1, 0.1, 21))),
+        ('calc_psf', lambda: analyses.calc_psf(wavefront, 32, 256)),
+        ('calc_psf_mft',
+         lambda: analyses.calc_psf_mft(wavefront, 32, mft_samples)),
+        ('ray_fan_figure', build_figure(RayFanFigure, data_type='Ray')),
+        ('opd_fan_figure', build_figure(RayFanFigure, data_type='OPD')),
+        ('spot_diagram_figure', build_figure(SpotDiagramFigure)),
+        ('wavefront_figure', build_figure(WavefrontFigure)),
+        ('set_vig', lambda: vigcalc.set_vig(opm)),
+        ('set_apertures', lambda: vigcalc.set_ape(opm)),
+        ]
+    return cases
+
+
+def time_case(fct, repeat=5, min_time=0.2):
+    """ returns the timing statistics, per call, of **fct** """
+    timer = timeit.Timer(fct)
+    number, _ = timer.autorange()
+    # autorange targets 0.2 sec; scale the number of calls to min_time
+    number = max(1, round(number*min_time/0.2))
+    t = [tt/number for tt in timer.repeat(repeat=repeat, number=number)]
+    return {'number': number,
+            'repeat': repeat,
+            'min': min(t),
+            'median': statistics.median(t),
+            'max': max(t),
+            'spread': 100*(max(t) - min(t))/min(t) if min(t) > 0 else 0.0,
+            }
+
+
+def run_model(filename, repeat=5, min_time=0.2, file=None):
+    """ returns a dict of timing results for all of the cases for a model """
+    results = {}
+    try:
+        opm = open_model(root_pth/filename)
+        cases = benchmark_cases(filename, opm)
+    except Exception as err:
+        print(f'{filename}: setup failed: {err!r}', file=file)
+        return {'error': repr(err)}
+
+    for case_name, fct in cases:
+        try:
+            results[case_name] = time_case(fct, repeat=repeat,
+                                           min_time=min_time)
+            r = results[case_name]
+            print(f'{filename} - {case_name}: {r["min"]*1e3:.3f} ms '
+                  f'({r["number"]}x{r["repeat"]}, '
+                  f'spread {r["spread"]:.1f}%)', file=file)
+        except Exception as err:
+            results[case_name] = {'error': repr(err)}
+            print(f'{filename} - {case_name}: failed: {err!r}', file=file)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root_pth,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_metadata():
+    """ returns a dict describing the software and hardware environment """
+    return {'timestamp': datetime.datetime.now().isoformat(),
+            'rayoptics': ro.__version__,
+            'git_commit': git_commit(),
+            'python': sys.version,
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'matplotlib': matplotlib.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            }
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """ returns a list of the cases that are slower than the baseline
+
+    Each regression is a tuple (model, case, baseline time, time, ratio).
+    Times are the minimum per-call times; a case regresses if its ratio to
+    the baseline exceeds 1 + **threshold**. Cases missing from either set of
+    results are skipped.
+    """
+    regressions = []
+    for filename, model_results in results['results'].items():
+        base_results = baseline['results'].get(filename, {})
+        for case_name, r in model_results.items():
+            if not isinstance(r, dict) or 'min' not in r:
+                continue
+            base = base_results.get(case_name, {})
+            if 'min' not in base or base['min'] <= 0.0:
+                continue
+            ratio = r['min']/base['min']
+            if ratio > 1.0 + threshold:
+                regressions.append((filename, case_name, base['min'],
+                                    r['min'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', type=Path,
+                        default=root_pth/'raytr/tests/benchmark_results.json',
+                        help='JSON file for the benchmark results')
+    parser.add_argument('-b', '--baseline', type=Path, default=None,
+                        help='JSON results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fractional slowdown reported as a regression')
+    parser.add_argument('-k', '--models', default=None,
+                        help='glob pattern to select models, '
+                        'e.g. "models/*"')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer, shorter repetitions')
+    args = parser.parse_args(argv)
+
+    repeat, min_time = (args.repeat, 0.2) if not args.quick else (3, 0.05)
+
+    results = {'metadata': environment_metadata(), 'results': {}}
+    for filename in find_models(args.models):
+        results['results'][filename] = run_model(filename, repeat=repeat,
+                                                 min_time=min_time)
+
+    with open(args.output, mode='w') as f:
+        json.dump(results, f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline,
+                                          threshold=args.threshold)
+        for filename, case_name, base_t, t, ratio in regressions:
+            print(f'REGRESSION {filename} - {case_name}: '
+                  f'{base_t*1e3:.3f} ms -> {t*1e3:.3f} ms ({ratio:.2f}x)')
+        if regressions:
+            return 1
+        print('no regressions wrt baseline '
+              f'{baseline["metadata"].get("git_commit")}')
+    return 0
 
 
 if __name__ == '__main__':
-    trials10 = 10000
-    trials15 = 15000
-    trials20 = 20000
-    trials25 = 25000
-    trials30 = 30000
-    trials40 = 40000
-    trials50 = 50000
-    trials80 = 80000
-    trials100 = 100000
-    setup_str = 'trace_args=setup("{:s}")'
-
-    results = []
-    rpt = 5
-
-    root_pth = Path(ro.__file__).resolve().parent
-    with open(root_pth/'raytr/tests/trace_results.txt', mode='w') as f:
-
-        tst_name = 'singlet'
-        trials = trials100
-        setup_stmt = setup_str.format("codev/tests/singlet.seq")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = 'landscape lens'
-        trials = trials80
-        setup_stmt = setup_str.format("codev/tests/landscape_lens.seq")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = 'Sasian triplet'
-        trials = trials50
-        setup_stmt = setup_str.format("models/Sasian Triplet.roa")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = 'double gauss'
-        trials = trials30
-        setup_stmt = setup_str.format("codev/tests/ag_dblgauss.seq")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = '2 spherical mirrors (spheres)'
-        trials = trials100
-        setup_stmt = setup_str.format("models/TwoSphericalMirror.roa")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = '2 spherical mirrors (conics)'
-        trials = trials100
-        setup_stmt = setup_str.format("models/TwoMirror.roa")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = 'paraboloid'
-        trials = trials100
-        setup_stmt = setup_str.format("codev/tests/paraboloid.seq")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = 'Cassegrain'
-        trials = trials100
-        setup_stmt = setup_str.format("models/Cassegrain.roa")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = 'Ritchey-Chretien'
-        trials = trials100
-        setup_stmt = setup_str.format("models/Ritchey_Chretien.roa")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-        tst_name = 'cell phone camera'
-        trials = trials10
-        setup_stmt = setup_str.format("optical/tests/cell_phone_camera.roa")
-        results.append(run_test(tst_name, setup_stmt, trials, file=f,
-                                repeat=rpt))
-
-    with open(root_pth/'raytr/tests/trace_data.csv', mode='w') as f:
-        w = csv.writer(f, delimiter=',', quotechar='"',
-                       quoting=csv.QUOTE_MINIMAL)
-        for tst in results:
-            w.writerow(tst[:5])
-
-    with open(root_pth/'raytr/tests/trace_data.txt', mode='w') as f:
-        print(results, file=f)
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Through-focus evaluation of wavefront and spot data
+
+    The OPD calculation is split into a part that is independent of focus,
+    :func:`~.waveabr.wave_abr_pre_calc_array`, and a cheap part that depends
+    on the reference sphere, :func:`~.waveabr.wave_abr_calc_array`. This
+    module uses the split to evaluate a grid of rays, traced once, at a whole
+    vector of focus shifts. The OPD and transverse aberrations for all of the
+    focus shifts are returned as stacked arrays by :func:`focus_stack`.
+
+    The :class:`ThroughFocus` class packages the trace and the stack, and
+    provides the through-focus RMS wavefront error, Strehl ratio and RMS
+    spot size, and a search for the best focus::
+
+        tf = ThroughFocus(opm, np.linspace(-0.1, 0.1, 21), f=0)
+        best_foc = tf.best_focus('rms_spot')
+"""
+
+import numpy as np
+from scipy.optimize import minimize_scalar
+
+from rayoptics.raytr import analyses
+from rayoptics.raytr import trace
+from rayoptics.raytr import traceerror as terr
+from rayoptics.raytr import waveabr
+
+
+def focus_stack(opt_model, grid_pkg, fld, wvl, focus_shifts,
+                image_pt_2d=None, image_delta=None):
+    """Refocus a traced grid of rays to each of **focus_shifts**.
+
+    The chief ray is retrieved once; only the reference sphere is computed
+    for each focus shift.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        grid_pkg: the ray grid returned by :func:`~.analyses.trace_wavefront`
+        fld: :class:`~.Field` the grid was traced from
+        wvl: wavelength (nm) the grid was traced in
+        focus_shifts: sequence of focus shifts to evaluate
+        image_pt_2d: base image point. if None, the chief ray is used
+        image_delta: image offset to apply to image_pt_2d
+
+    Returns:
+        (**opd**, **ta**)
+
+        - **opd** - (nfoc, num_rays, num_rays) array of OPD, in waves at the
+          central wavelength
+        - **ta** - (nfoc, num_rays, num_rays, 2) array of the transverse
+          aberrations wrt the reference image point
+
+        Rays that failed are NaN.
+    """
+    fod = opt_model['analysis_results']['parax_data'].fod
+    pupils, bundle, pre_opd_pkg = grid_pkg
+    grid_shape = pupils.shape[:2]
+    cr_pkg = trace.get_chief_ray_pkg(opt_model, fld, wvl, None)
+    central_wvl = opt_model.optical_spec.spectral_region.central_wvl
+    convert_to_opd = 1/opt_model.nm_to_sys_units(central_wvl)
+
+    failed = bundle.status != terr.ok
+    last_pt, last_dir = bundle.p[:, -1], bundle.d[:, -1]
+
+    focus_shifts = np.atleast_1d(focus_shifts)
+    opd = np.empty((len(focus_shifts),) + grid_shape)
+    ta = np.empty((len(focus_shifts),) + grid_shape + (2,))
+    for k, foc in enumerate(focus_shifts):
+        ref_sphere = waveabr.calculate_reference_sphere(
+            opt_model, fld, wvl, foc, cr_pkg,
+            image_pt_2d=image_pt_2d, image_delta=image_delta)
+        opdelta = waveabr.wave_abr_calc_array(fod, fld, wvl, foc, cr_pkg,
+                                              pre_opd_pkg, ref_sphere)
+        opdelta[failed] = np.nan
+        opd[k] = (convert_to_opd*opdelta).reshape(grid_shape)
+
+        dist = foc/last_dir[:, 2]
+        defocused_pt = last_pt + dist[:, np.newaxis]*last_dir
+        t_abr = defocused_pt[:, :2] - ref_sphere[0][:2]
+        t_abr[failed] = np.nan
+        ta[k] = t_abr.reshape(grid_shape + (2,))
+
+    return opd, ta
+
+
+def rms_wavefront(opd):
+    """ returns the RMS, about the mean, of each OPD map in the **opd** stack
+    """
+    opd = np.reshape(opd, (len(opd), -1))
+    return np.nanstd(opd, axis=1)
+
+
+def strehl(opd, wvl_ratio=1.0):
+    """ returns the Strehl ratio of each OPD map in the **opd** stack
+
+    The Strehl ratio is approximated from the RMS wavefront error using the
+    Marechal approximation, which is good for Strehl ratios above about 0.1.
+
+    Args:
+        opd: stack of OPD maps, in waves
+        wvl_ratio: ratio of the wavelength the OPD is measured in to the
+                   wavelength of the rays, e.g. central_wvl/wvl
+    """
+    sigma = wvl_ratio*rms_wavefront(opd)
+    return np.exp(-(2*np.pi*sigma)**2)
+
+
+def rms_spot(ta):
+    """ returns the RMS radius, about the centroid, of each spot in **ta** """
+    ta = np.reshape(ta, (len(ta), -1, 2))
+    centroid = np.nanmean(ta, axis=1)
+    r2 = np.sum((ta - centroid[:, np.newaxis, :])**2, axis=2)
+    return np.sqrt(np.nanmean(r2, axis=1))
+
+
+class ThroughFocus():
+    """A grid of rays evaluated at a vector of focus shifts.
+
+    The grid of rays is traced once; the OPD and transverse aberration
+    stacks are computed by :func:`focus_stack`.
+
+    Attributes:
+        opt_model: :class:`~.OpticalModel` instance
+        focus_shifts: (nfoc,) array of focus shifts
+        f: index into :class:`~.FieldSpec` or a :class:`~.Field` instance
+        wl: wavelength (nm) to trace the grid, or central wavelength if None
+        image_pt_2d: base image point. if None, the chief ray is used
+        image_delta: image offset to apply to image_pt_2d
+        num_rays: number of samples along the side of the grid
+        opd: (nfoc, num_rays, num_rays) array of OPD, in waves at the central
+             wavelength
+        ta: (nfoc, num_rays, num_rays, 2) array of transverse aberrations
+    """
+
+    metrics = ('rms_wavefront', 'strehl', 'rms_spot')
+
+    def __init__(self, opt_model, focus_shifts, f=0, wl=None,
+                 image_pt_2d=None, image_delta=None, num_rays=21):
+        self.opt_model = opt_model
+        osp = opt_model.optical_spec
+        self.fld = osp.field_of_view.fields[f] if isinstance(f, int) else f
+        self.wvl = osp.spectral_region.central_wvl if wl is None else wl
+        self.focus_shifts = np.atleast_1d(focus_shifts)
+        self.image_pt_2d = image_pt_2d
+        self.image_delta = image_delta
+        self.num_rays = num_rays
+
+        self.update_data()
+
+    def __json_encode__(self):
+        attrs = dict(vars(self))
+        del attrs['opt_model']
+        del attrs['grid_pkg']
+        return attrs
+
+    def update_data(self, **kwargs):
+        build = kwargs.get('build', 'rebuild')
+        if build == 'rebuild':
+            self.grid_pkg = analyses.trace_wavefront(
+                self.opt_model, self.fld, self.wvl, 0.,
+                image_pt_2d=self.image_pt_2d, image_delta=self.image_delta,
+                num_rays=self.num_rays)
+
+        self.opd, self.ta = self.focus_stack(self.focus_shifts)
+        return self
+
+    def focus_stack(self, focus_shifts):
+        """ returns the (opd, ta) stacks for **focus_shifts** """
+        return focus_stack(self.opt_model, self.grid_pkg, self.fld, self.wvl,
+                           focus_shifts, image_pt_2d=self.image_pt_2d,
+                           image_delta=self.image_delta)
+
+    def rms_wavefront(self):
+        """ returns the RMS wavefront error, in waves, at each focus shift """
+        return rms_wavefront(self.opd)
+
+    def strehl(self):
+        """ returns the Strehl ratio at each focus shift """
+        return strehl(self.opd, wvl_ratio=self.wvl_ratio())
+
+    def rms_spot(self):
+        """ returns the RMS spot radius at each focus shift """
+        return rms_spot(self.ta)
+
+    def wvl_ratio(self):
+        """ ratio of the central wavelength to the trace wavelength """
+        central_wvl = self.opt_model.optical_spec.spectral_region.central_wvl
+        return central_wvl/self.wvl
+
+    def _metric_values(self, metric, opd, ta):
+        """ returns values of **metric** to be minimized """
+        if metric == 'rms_wavefront':
+            return rms_wavefront(opd)
+        elif metric == 'strehl':
+            return -strehl(opd, wvl_ratio=self.wvl_ratio())
+        elif metric == 'rms_spot':
+            return rms_spot(ta)
+        else:
+            raise ValueError(f"unknown focus metric '{metric}', "
+                             f"expected one of {self.metrics}")
+
+    def best_focus(self, metric='rms_wavefront', xatol=1e-6):
+        """ returns the focus shift optimizing **metric**
+
+        The best sample of the stack is found first. The focus is then
+        refined between the neighboring focus shifts, in increasing order,
+        by a bounded scalar minimization; the refinement refocuses the
+        traced rays, it doesn't retrace them.
+
+        Args:
+            metric: one of 'rms_wavefront', 'strehl' or 'rms_spot'
+            xatol: absolute tolerance on the focus shift
+        """
+        order = np.argsort(self.focus_shifts)
+        focs = self.focus_shifts[order]
+        values = self._metric_values(metric, self.opd, self.ta)[order]
+        i = np.nanargmin(values)
+        if len(focs) < 2:
+            return focs[i]
+        bounds = (focs[max(i-1, 0)], focs[min(i+1, len(focs)-1)])
+
+        def fct(foc):
+            opd, ta = self.focus_stack([foc])
+            return self._metric_values(metric, opd, ta)[0]
+
+        soln = minimize_scalar(fct, bounds=bounds, method='bounded',
+                               options={'xatol': xatol})
+        return soln.x if soln.fun <= values[i] else focs[i]
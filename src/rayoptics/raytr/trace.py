@@ -8,15 +8,19 @@
 .. codeauthor: Michael J. Hayford
 """
 
+import copy
 import itertools
 import warnings
 import math
+from collections import OrderedDict
 import numpy as np
 from numpy.linalg import norm
 from scipy.optimize import newton, fsolve
 import pandas as pd
 
 from . import raytrace as rt
+from . import batchtrace as bt
+from . import traceerror as terr
 from . import RayPkg, RaySeg
 from .waveabr import (wave_abr_full_calc, calculate_reference_sphere, 
                       transfer_to_exit_pupil)
@@ -97,8 +101,12 @@ def trace_safe(opt_model, pupil, fld, wvl,
 
     try:
         ray_pkg = trace_base(opt_model, pupil, fld, wvl,
-                                   **kwargs)
+                             raise_errors=False, **kwargs)
     except TraceError as rayerr:
+        ray_pkg = rayerr
+
+    if isinstance(ray_pkg, TraceError):
+        rayerr = ray_pkg
         if rayerr_filter is None:
             pass
         elif rayerr_filter == 'full':
@@ -129,6 +137,125 @@ def trace_safe(opt_model, pupil, fld, wvl,
     return ray_result
 
 
+def pupil_aim_points(opt_model, pupils, fld):
+    """ returns the aim points of the relative **pupils** of **fld**
+
+    The aim points are on the paraxial entrance pupil plane. With real
+    aiming, the field's :class:`~.PupilMap` maps the pupil coordinates onto
+    the stop; otherwise they are scaled by the entrance pupil radius and
+    offset by the field's aim point.
+
+    Args:
+        opt_model: instance of :class:`~.OpticalModel`
+        pupils: (N, 2) array of relative pupil coordinates, including any
+                vignetting
+        fld: instance of :class:`~.Field`
+
+    Returns:
+        an (N, 2) array of aim points
+    """
+    osp = opt_model.optical_spec
+    pupil_map = osp.pupil_map(fld)
+    if pupil_map is not None:
+        return pupil_map.aim_points(pupils)
+    pupils = np.asarray(pupils, dtype=float).reshape(-1, 2)
+    eprad = opt_model['analysis_results']['parax_data'].fod.enp_radius
+    aim_pt = osp.aim_point(fld)
+    if aim_pt is None:
+        aim_pt = np.array([0., 0.])
+    return eprad*pupils + aim_pt
+
+
+def bundle_start_rays(opt_model, pupils, fld):
+    """ returns the starting points and directions of rays through **pupils**
+
+    Args:
+        opt_model: instance of :class:`~.OpticalModel`
+        pupils: (N, 2) array of relative pupil coordinates, including any
+                vignetting
+        fld: instance of :class:`~.Field`
+
+    Returns:
+        (**pt0**, **dir0**), (N, 3) arrays of the starting points and
+        direction cosines, in the coordinates of the object surface
+    """
+    osp = opt_model.optical_spec
+    fod = opt_model['analysis_results']['parax_data'].fod
+    pt1 = np.empty((len(pupils), 3))
+    pt1[:, :2] = pupil_aim_points(opt_model, pupils, fld)
+    pt1[:, 2] = fod.obj_dist + fod.enp_dist
+    pt0 = osp.obj_coords(fld)
+    dir0 = pt1 - pt0
+    dir0 /= norm(dir0, axis=1)[:, np.newaxis]
+    # To handle virtual object distances, always propagate from 
+    #  the object in a positive Z direction.
+    flip = dir0[:, 2] * opt_model.seq_model.z_dir[0] < 0
+    dir0[flip] = -dir0[flip]
+    return np.broadcast_to(pt0, dir0.shape), dir0
+
+
+def trace_bundle(opt_model, pupils, fld, wvl, apply_vignetting=True,
+                 **kwargs):
+    """Trace a bundle of rays specified by relative aperture and field point.
+
+    This is the array counterpart of :func:`trace_base`. Ray failures don't
+    raise exceptions; they are recorded in the status and fail_surf arrays
+    of the returned bundle.
+
+    Args:
+        opt_model: instance of :class:`~.OpticalModel` to trace
+        pupils: (N, 2) array of relative pupil coordinates
+        fld: instance of :class:`~.Field`
+        wvl: ray trace wavelength in nm, or a sequence of wavelengths. In the
+             latter case, the (wavelength x pupil) product is traced in a
+             single pass by :func:`~.batchtrace.trace_spectral_batch`
+        apply_vignetting: if True, apply the **fld** vignetting factors
+        **kwargs: keyword arguments passed to
+                  :func:`~.batchtrace.trace_batch`
+
+    Returns:
+        a :class:`~.batchtrace.RayBundle`
+    """
+    pupils = np.asarray(pupils, dtype=float).reshape(-1, 2)
+    vig_pupils = (fld.apply_vignetting_array(pupils) if apply_vignetting
+                  else pupils)
+    pt0, dir0 = bundle_start_rays(opt_model, vig_pupils, fld)
+    sm = opt_model.seq_model
+    if np.ndim(wvl) > 0:
+        return bt.trace_spectral_batch(sm, pt0, dir0, wvl, **kwargs)
+    return bt.trace_batch(sm, pt0, dir0, wvl, **kwargs)
+
+
+def ray_results_from_bundle(bundle, output_filter, rayerr_filter):
+    """Return a list of ray_results, one for each ray in **bundle**.
+
+    The filters are applied in the same way as in :func:`trace_safe`. Failed
+    rays are reported, per **rayerr_filter**, using the
+    :class:`~.TraceError` subclass corresponding to the ray's status code.
+    """
+    ray_results = []
+    for i in range(len(bundle)):
+        status = bundle.status[i]
+        if status == terr.ok:
+            ray_pkg = bundle.ray_pkg(i)
+            if output_filter is None:
+                ray_result = ray_pkg
+            elif output_filter == 'last':
+                ray, op_delta, wvl = ray_pkg
+                ray_result = (ray[-1], op_delta, wvl)
+            else:
+                ray_result = output_filter(ray_pkg)
+        elif rayerr_filter == 'full':
+            ray_result = terr.error_for_status(status, int(bundle.fail_surf[i]),
+                                               bundle.ray_pkg(i))
+        elif rayerr_filter == 'summary':
+            ray_result = terr.error_for_status(status, int(bundle.fail_surf[i]))
+        else:
+            ray_result = None
+        ray_results.append(ray_result)
+    return ray_results
+
+
 def retrieve_ray(ray_result):
     """ Retrieve the ray (the list of ray segs) from ray_result.
     
@@ -200,12 +327,8 @@ def trace_base(opt_model, pupil, fld, wvl, apply_vignetting=True, **kwargs):
     vig_pupil = fld.apply_vignetting(pupil) if apply_vignetting else pupil
     osp = opt_model.optical_spec
     fod = opt_model['analysis_results']['parax_data'].fod
-    eprad = fod.enp_radius
-    aim_pt = np.array([0., 0.])
-    if hasattr(fld, 'aim_pt') and fld.aim_pt is not None:
-        aim_pt = fld.aim_pt
-    pt1 = np.array([eprad*vig_pupil[0]+aim_pt[0], eprad*vig_pupil[1]+aim_pt[1],
-                    fod.obj_dist+fod.enp_dist])
+    aim_pt = pupil_aim_points(opt_model, vig_pupil, fld)[0]
+    pt1 = np.array([aim_pt[0], aim_pt[1], fod.obj_dist+fod.enp_dist])
     pt0 = osp.obj_coords(fld)
     dir0 = pt1 - pt0
     length = norm(dir0)
@@ -218,12 +341,22 @@ def trace_base(opt_model, pupil, fld, wvl, apply_vignetting=True, **kwargs):
     return rt.trace(sm, pt0, dir0, wvl, **kwargs)
 
 
-def iterate_ray(opt_model, ifcx, xy_target, fld, wvl, **kwargs):
+# the default tolerance on the aim point of scipy.optimize.newton, used by
+# iterate_ray
+AIM_XTOL = 1.48e-8
+
+
+def iterate_ray(opt_model, ifcx, xy_target, fld, wvl, start_coords=None,
+                **kwargs):
     """ iterates a ray to xy_target on interface ifcx, returns aim points on
     the paraxial entrance pupil plane
 
     If idcx is None, i.e. a floating stop surface, returns xy_target.
 
+    The iteration starts from **start_coords** on the paraxial entrance pupil
+    plane, if given, else from the origin. If the iteration from
+    start_coords fails, it is repeated from the origin.
+
     If the iteration fails, a TraceError will be raised
     """
     def y_stop_coordinate(y1, *args):
@@ -269,6 +402,7 @@ def iterate_ray(opt_model, ifcx, xy_target, fld, wvl, **kwargs):
     dist = fod.obj_dist + fod.enp_dist
 
     pt0 = osp.obj_coords(fld)
+    x0 = np.array([0., 0.]) if start_coords is None else start_coords
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         if ifcx is not None:
@@ -276,7 +410,7 @@ def iterate_ray(opt_model, ifcx, xy_target, fld, wvl, **kwargs):
                 # do 1D iteration if field and target points are zero in x
                 y_target = xy_target[1]
                 try:
-                    start_y, results = newton(y_stop_coordinate, 0.,
+                    start_y, results = newton(y_stop_coordinate, x0[1],
                                             args=(seq_model, ifcx, pt0,
                                                     dist, wvl, y_target),
                                             disp=False, full_output=True)
@@ -285,17 +419,23 @@ def iterate_ray(opt_model, ifcx, xy_target, fld, wvl, **kwargs):
                     # print(rte)
                     start_y = results.root
                 except TraceError:
+                    if start_coords is not None:
+                        return iterate_ray(opt_model, ifcx, xy_target,
+                                           fld, wvl)
                     start_y = 0.0
                 start_coords = np.array([0., start_y])
             else:
                 # do 2D iteration. epsfcn is a parameter increment,
                 #  make proportional to pupil radius
                 try:
-                    start_coords = fsolve(surface_coordinate, np.array([0., 0.]),
+                    start_coords = fsolve(surface_coordinate, x0,
                                         epsfcn=0.0001*fod.enp_radius,
                                         args=(seq_model, ifcx, pt0, dist,
                                                 wvl, xy_target))
                 except TraceError:
+                    if start_coords is not None:
+                        return iterate_ray(opt_model, ifcx, xy_target,
+                                           fld, wvl)
                     start_coords = np.array([0., 0.])
         else:  # floating stop surface - use entrance pupil for aiming
             start_coords = np.array([0., 0.]) + xy_target
@@ -308,18 +448,14 @@ def trace_with_opd(opt_model, pupil, fld, wvl, foc, **kwargs):
     chief_ray_pkg = get_chief_ray_pkg(opt_model, fld, wvl, foc)
     image_pt_2d = kwargs.get('image_pt', None)
     image_delta = kwargs.get('image_delta', None)
-    ref_sphere = calculate_reference_sphere(opt_model, fld, wvl, foc,
-                                            chief_ray_pkg,
-                                            image_pt_2d=image_pt_2d,
-                                            image_delta=image_delta)
+    ref_sphere = opt_model.chief_ray_cache.ref_sphere(
+        opt_model, fld, wvl, foc, chief_ray_pkg,
+        image_pt_2d=image_pt_2d, image_delta=image_delta)
 
     ray, op, wvl = trace_base(opt_model, pupil, fld, wvl, **kwargs)
     # opl = rt.calc_optical_path(ray, opt_model.seq_model.path())
     ray_pkg = ray, op, wvl
 
-    fld.chief_ray = chief_ray_pkg
-    fld.ref_sphere = ref_sphere
-
     fod = opt_model['analysis_results']['parax_data'].fod
     opd = wave_abr_full_calc(fod, fld, wvl, foc, ray_pkg,
                              chief_ray_pkg, ref_sphere)
@@ -412,37 +548,54 @@ def trace_chief_ray(opt_model, fld, wvl, foc):
     return cr, cr_exp_seg
 
 
-def trace_fan(opt_model, fan_rng, fld, wvl, foc, img_filter=None,
-              **kwargs):
-    start = np.array(fan_rng[0])
-    stop = fan_rng[1]
-    num = fan_rng[2]
+def fan_pupils(fan_rng):
+    """ returns an (num, 2) array of the pupil points of a ray fan """
+    start, stop, num = fan_rng
+    start = np.array(start, dtype=float)
     step = (stop - start)/(num - 1)
+    return start + np.arange(num)[:, np.newaxis]*step
+
+
+def grid_pupils(grid_rng):
+    """ returns an (num*num, 2) array of the pupil points of a ray grid
+
+    The y coordinate varies fastest, i.e. the points are in row order.
+    """
+    start, stop, num = grid_rng
+    start = np.array(start, dtype=float)
+    step = np.array((stop - start)/(num - 1))
+    i, j = np.meshgrid(np.arange(num), np.arange(num), indexing='ij')
+    return np.column_stack((start[0] + i.ravel()*step[0],
+                            start[1] + j.ravel()*step[1]))
+
+
+def fan_from_bundle(pupils, bundle, img_filter=None, offset=0):
+    """ assemble a ray fan from the rays in **bundle**
+
+    Ray i of the fan is bundle ray offset+i. A failed ray raises the
+    corresponding :class:`~.TraceError`, as :func:`trace_base` would.
+    """
     fan = []
-    for r in range(num):
-        pupil = np.array(start)
-        ray, op, wvl = trace_base(opt_model, pupil, fld, wvl, **kwargs)
-        # opl = rt.calc_optical_path(ray, opt_model.seq_model.path())
-        ray_pkg = ray, op, wvl
+    for i, pupil in enumerate(pupils):
+        k = offset + i
+        if bundle.status[k] != terr.ok:
+            raise terr.error_for_status(bundle.status[k],
+                                        int(bundle.fail_surf[k]),
+                                        bundle.ray_pkg(k))
+        ray_pkg = bundle.ray_pkg(k)
 
         if img_filter:
             result = img_filter(pupil, ray_pkg)
             fan.append([pupil, result])
         else:
             fan.append([pupil, ray_pkg])
-
-        start += step
     return fan
 
 
-def trace_grid(opt_model, grid_rng, fld, wvl, foc, img_filter=None,
-               form='grid', append_if_none=True, **kwargs):
-    output_filter = kwargs.get('output_filter', None)
-    rayerr_filter = kwargs.get('rayerr_filter', None)
-    start = np.array(grid_rng[0])
-    stop = grid_rng[1]
-    num = grid_rng[2]
-    step = np.array((stop - start)/(num - 1))
+def grid_from_ray_results(pupils, ray_results, num, img_filter=None,
+                          form='grid', append_if_none=True):
+    """ assemble a ray grid from a list of ray_results, see :func:`trace_grid`
+    """
     grid = []
     for i in range(num):
         if form == 'list':
@@ -452,10 +605,8 @@ def trace_grid(opt_model, grid_rng, fld, wvl, foc, img_filter=None,
             working_grid = grid_row
 
         for j in range(num):
-            pupil = np.array(start)
-            ray_result = trace_safe(opt_model, pupil, fld, wvl, 
-                                    output_filter, rayerr_filter, 
-                                    check_apertures=True, **kwargs)
+            pupil = pupils[i*num + j]
+            ray_result = ray_results[i*num + j]
             if ray_result is not None:
                 if img_filter:
                     result = img_filter(pupil, ray_result)
@@ -471,35 +622,379 @@ def trace_grid(opt_model, grid_rng, fld, wvl, foc, img_filter=None,
                     if append_if_none:
                         working_grid.append([pupil[0], pupil[1], None])
 
-            start[1] += step[1]
         if form == 'grid':
             grid.append(grid_row)
-        start[0] += step[0]
-        start[1] = grid_rng[0][1]
     return np.array(grid)
 
 
+def trace_fan(opt_model, fan_rng, fld, wvl, foc, img_filter=None,
+              **kwargs):
+    pupils = fan_pupils(fan_rng)
+    bundle = trace_bundle(opt_model, pupils, fld, wvl, **kwargs)
+    return fan_from_bundle(pupils, bundle, img_filter=img_filter)
+
+
+def trace_grid(opt_model, grid_rng, fld, wvl, foc, img_filter=None,
+               form='grid', append_if_none=True, **kwargs):
+    output_filter = kwargs.get('output_filter', None)
+    rayerr_filter = kwargs.get('rayerr_filter', None)
+    pupils = grid_pupils(grid_rng)
+    bundle = trace_bundle(opt_model, pupils, fld, wvl,
+                          check_apertures=True, **kwargs)
+    ray_results = ray_results_from_bundle(bundle, output_filter,
+                                          rayerr_filter)
+    return grid_from_ray_results(pupils, ray_results, grid_rng[2],
+                                 img_filter=img_filter, form=form,
+                                 append_if_none=append_if_none)
+
+
 def setup_pupil_coords(opt_model, fld, wvl, foc, 
                        image_pt=None, image_delta=None):
+    """ returns the reference sphere and chief ray package for **fld**
+
+    Both are taken from the model's :class:`ChiefRayCache`, and computed
+    only if necessary.
+    """
     chief_ray_pkg = get_chief_ray_pkg(opt_model, fld, wvl, foc)
     image_pt_2d = None if image_pt is None else image_pt[:2]
-    ref_sphere = calculate_reference_sphere(opt_model, fld, wvl, foc,
-                                            chief_ray_pkg,
-                                            image_pt_2d=image_pt_2d,
-                                            image_delta=image_delta)
+    ref_sphere = opt_model.chief_ray_cache.ref_sphere(
+        opt_model, fld, wvl, foc, chief_ray_pkg,
+        image_pt_2d=image_pt_2d, image_delta=image_delta)
     return ref_sphere, chief_ray_pkg
 
 
-def aim_chief_ray(opt_model, fld, wvl=None):
-    """ aim chief ray at center of stop surface and save results on **fld** """
+def field_with_chief_ray(fld, chief_ray_pkg, ref_sphere):
+    """ returns a copy of **fld** carrying the chief ray and reference sphere
+
+    Callback functions, e.g. for :meth:`~.SequentialModel.trace_fan`, read
+    the chief ray and reference sphere from the field's attributes. Setting
+    them on a copy leaves the model's field unchanged.
+    """
+    fld_copy = copy.copy(fld)
+    fld_copy.chief_ray = chief_ray_pkg
+    fld_copy.ref_sphere = ref_sphere
+    return fld_copy
+
+
+def aim_chief_ray(opt_model, fld, wvl=None, start=None):
+    """ aim chief ray at center of stop surface and return the aim point
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        fld: :class:`~.Field` to be aimed
+        wvl: wavelength (nm), defaults to the central wavelength
+        start: optional initial aim point for the iteration
+    """
     seq_model = opt_model.seq_model
     if wvl is None:
         wvl = seq_model.central_wavelength()
     stop = seq_model.stop_surface
-    aim_pt = iterate_ray(opt_model, stop, np.array([0., 0.]), fld, wvl)
+    aim_pt = iterate_ray(opt_model, stop, np.array([0., 0.]), fld, wvl,
+                         start_coords=start)
     return aim_pt
 
 
+def _trace_to_stop(opt_model, pt0, aim_pts, wvls, rndx):
+    """ trace rays from **pt0** through **aim_pts** as far as the stop
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        pt0: (N, 3) array of object points
+        aim_pts: (N, 2) array of aim points
+        wvls: (N,) array of wavelengths
+        rndx: (nsurf, N) array of refractive indices up to the stop
+
+    Returns:
+        ((N, 2) array of stop intercepts, (N,) boolean array, True if the
+        ray reached the stop)
+    """
+    seq_model = opt_model.seq_model
+    stop = seq_model.stop_surface
+    fod = opt_model['analysis_results']['parax_data'].fod
+    pt1 = np.empty_like(pt0)
+    pt1[:, :2] = aim_pts
+    pt1[:, 2] = fod.obj_dist + fod.enp_dist
+    dir0 = pt1 - pt0
+    dir0 /= norm(dir0, axis=1)[:, np.newaxis]
+    dir0[dir0[:, 2]*seq_model.z_dir[0] < 0] *= -1
+    path = seq_model.trace_plan(stop=stop+1)
+    bundle = bt.trace_raw_batch(path, pt0, dir0, wvls, rndx=rndx)
+    xy = bundle.p[:, stop, :2]
+    # a ray that reflects or misses a surface after the stop is still valid
+    valid = (((bundle.status == terr.ok) | (bundle.fail_surf >= stop)) &
+             np.isfinite(xy).all(axis=1))
+    return xy, valid
+
+
+def _stop_rndx(seq_model, wvls):
+    """ returns the refractive indices, up to the stop, for **wvls** """
+    return seq_model.spectral_rndx(wvls)[:seq_model.stop_surface+1]
+
+
+def stop_intercepts(opt_model, flds, wvl, aim_pts):
+    """ returns the x, y intercepts on the stop of the rays through **aim_pts**
+
+    The rays are only traced as far as the stop surface, so the result
+    depends only on the part of the model upstream of the stop.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        flds: list of :class:`~.Field`
+        wvl: wavelength (nm)
+        aim_pts: list of the aim points of **flds**
+
+    Returns:
+        a list of the stop intercepts; the intercept is None if there is no
+        stop surface or the ray failed
+    """
+    seq_model = opt_model.seq_model
+    if seq_model.stop_surface is None or len(flds) == 0:
+        return [None]*len(flds)
+    osp = opt_model.optical_spec
+    pt0 = np.array([osp.obj_coords(fld) for fld in flds], dtype=float)
+    wvls = np.full(len(flds), wvl, dtype=float)
+    rndx = np.repeat(_stop_rndx(seq_model, [wvl]), len(flds), axis=1)
+    xy, valid = _trace_to_stop(opt_model, pt0,
+                               np.array(aim_pts, dtype=float), wvls, rndx)
+    return [xy[i].copy() if valid[i] else None for i in range(len(flds))]
+
+
+def stop_intercept(opt_model, fld, wvl, aim_pt):
+    """ returns the x, y intercept on the stop of the ray through **aim_pt**
+
+    Returns None if there is no stop surface or the ray fails. See
+    :func:`stop_intercepts`.
+    """
+    return stop_intercepts(opt_model, [fld], wvl, [aim_pt])[0]
+
+
+def solve_aim_points(opt_model, pt0, wvls, xy_targets, aim_pts, tol=1e-10,
+                     maxiter=20, stall_tol=None):
+    """ iterate a batch of rays from **pt0** to **xy_targets** on the stop
+
+    The aim points are found by a 2D Newton iteration run for all of the
+    rays at once. The Jacobian of the stop intercept wrt the aim point is
+    computed by finite differences: each iteration traces the rays through
+    the current aim points, and through aim points offset in x and y, to the
+    stop in a single batched trace. A ray is converged when its stop
+    intercept is within **tol** of its target.
+
+    A ray whose Newton step no longer reduces the miss distance has stalled.
+    It is accepted only if the miss is within half of the change of the
+    stop intercept for an aim point change of the larger of
+    :data:`AIM_XTOL`, the tolerance of the scalar solver in
+    :func:`iterate_ray`, and the resolution of the aim point in floating
+    point, which limits objects at large distances, unless **stall_tol** is
+    given. Other stalled rays are returned as failed.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        pt0: (N, 3) array of object points
+        wvls: (N,) array of wavelengths (nm)
+        xy_targets: (N, 2) array of target points on the stop surface
+        aim_pts: (N, 2) array of starting aim points on the paraxial
+                 entrance pupil plane, updated in place
+        tol: tolerance of the stop intercept, in lens units
+        maxiter: maximum number of Newton iterations
+        stall_tol: if not None, the largest miss accepted for a stalled ray,
+                   in lens units
+
+    Returns:
+        an (N,) boolean array, True for the rays that failed or didn't
+        converge
+    """
+    seq_model = opt_model.seq_model
+    x = aim_pts
+    num_rays = len(x)
+    uniq_wvls, wvl_indx = np.unique(wvls, return_inverse=True)
+    rndx = _stop_rndx(seq_model, uniq_wvls)
+    # 1D iteration if the object and target points lie in the y-z plane
+    planar = (pt0[:, 0] == 0.0) & (xy_targets[:, 0] == 0.0)
+    fod = opt_model['analysis_results']['parax_data'].fod
+    h = 1e-4*fod.enp_radius
+    miss = np.full(num_rays, np.inf)
+    prev_x = x.copy()
+    done = np.zeros(num_rays, dtype=bool)
+    failed = np.zeros(num_rays, dtype=bool)
+    for i in range(maxiter):
+        active = np.flatnonzero(~(done | failed))
+        n = len(active)
+        if n == 0:
+            break
+        xa = x[active]
+        coords = np.concatenate((xa, xa + [h, 0.], xa + [0., h]))
+        rays = np.tile(active, 3)
+        xy, valid = _trace_to_stop(opt_model, pt0[rays], coords, wvls[rays],
+                                   rndx[:, wvl_indx[rays]])
+        base_ok = valid[:n]
+        # retreat toward the last good aim point if the ray failed
+        retreat = active[~base_ok]
+        if i == 0:
+            failed[retreat] = True
+        else:
+            x[retreat] = 0.5*(x[retreat] + prev_x[retreat])
+
+        good = base_ok & valid[n:2*n] & valid[2*n:]
+        failed[active[base_ok & ~good]] = True
+        active, xy = active[good], xy.reshape(3, n, 2)[:, good]
+        r = xy[0] - xy_targets[active]
+        new_miss = norm(r, axis=1)
+        jac = np.stack(((xy[1] - xy[0])/h, (xy[2] - xy[0])/h), axis=-1)
+
+        # stop when converged or no longer improving
+        converged = new_miss <= tol
+        stalled = (new_miss >= miss[active]) & ~converged
+        stalled_rays = active[stalled]
+        x[stalled_rays] = prev_x[stalled_rays]
+        if stall_tol is None:
+            # the aim point resolution is limited by the size of the object
+            # coordinates, which are subtracted from it
+            aim_res = np.spacing(np.max(np.abs(pt0[stalled_rays, :2]),
+                                        axis=1))
+            jac_max = np.max(np.abs(jac[stalled]), axis=(1, 2))
+            accept = (miss[stalled_rays] <=
+                      0.5*jac_max*np.maximum(AIM_XTOL, aim_res))
+        else:
+            accept = miss[stalled_rays] <= stall_tol
+        done[stalled_rays[accept]] = True
+        failed[stalled_rays[~accept]] = True
+        done[active[converged]] = True
+        keep = ~(stalled | converged)
+        active, xy, r, jac = active[keep], xy[:, keep], r[keep], jac[keep]
+        miss[active] = new_miss[keep]
+
+        step = np.zeros_like(r)
+        flat = planar[active]
+        step[flat, 1] = -r[flat, 1]/jac[flat, 1, 1]
+        det = np.linalg.det(jac[~flat])
+        nonsingular = np.flatnonzero(~flat)[det != 0.]
+        step[nonsingular] = -np.linalg.solve(
+            jac[nonsingular], r[nonsingular][..., np.newaxis])[..., 0]
+        singular = ~np.isfinite(step).all(axis=1)
+        singular[np.flatnonzero(~flat)[det == 0.]] = True
+        failed[active[singular]] = True
+        prev_x[active] = x[active]
+        x[active[~singular]] += step[~singular]
+    else:
+        # out of iterations, continue from the last aim point checked
+        unconverged = ~(done | failed)
+        x[unconverged] = prev_x[unconverged]
+        failed |= unconverged
+    return failed
+
+
+def aim_chief_rays(opt_model, flds, wvls=None, start=None, tol=1e-10,
+                   maxiter=20):
+    """ aim the chief rays of several fields, and wavelengths, together
+
+    The chief rays are aimed at the center of the stop in a single batch by
+    :func:`solve_aim_points`. Rays that fail or don't converge are aimed
+    individually by :func:`aim_chief_ray`.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        flds: list of :class:`~.Field` to be aimed
+        wvls: list of wavelengths (nm), defaults to the central wavelength
+        start: optional initial aim points, either one per field, shape
+               (nflds, 2), or one per field and wavelength, shape
+               (nflds, nwvls, 2)
+        tol: tolerance of the stop intercept, in lens units
+        maxiter: maximum number of Newton iterations
+
+    Returns:
+        an (nflds, 2) array of aim points, or (nflds, nwvls, 2) if **wvls**
+        is given
+    """
+    seq_model = opt_model.seq_model
+    osp = opt_model.optical_spec
+    stop = seq_model.stop_surface
+    single_wvl = wvls is None
+    if single_wvl:
+        wvls = [seq_model.central_wavelength()]
+    wvls = np.asarray(wvls, dtype=float)
+    num_flds, num_wvls = len(flds), len(wvls)
+
+    aim_pts = np.zeros((num_flds, num_wvls, 2))
+    if start is not None:
+        aim_pts[:] = np.reshape(start, (num_flds, -1, 2))
+
+    # floating stop surface - use entrance pupil for aiming
+    if stop is None or num_flds == 0:
+        return aim_pts[:, 0] if single_wvl else aim_pts
+
+    # the rays are ordered by field and then wavelength
+    x = aim_pts.reshape(-1, 2)
+    x_start = x.copy()
+    pt0 = np.repeat(np.array([osp.obj_coords(fld) for fld in flds],
+                             dtype=float), num_wvls, axis=0)
+    ray_wvls = np.tile(wvls, num_flds)
+    failed = solve_aim_points(opt_model, pt0, ray_wvls, np.zeros_like(x), x,
+                              tol=tol, maxiter=maxiter)
+
+    # restart the failures from the initial aim points; the last aim point
+    # of a stalled ray would stall the scalar solver too
+    for k in np.flatnonzero(failed):
+        x[k] = aim_chief_ray(opt_model, flds[k // num_wvls], ray_wvls[k],
+                             start=x_start[k])
+    return aim_pts[:, 0] if single_wvl else aim_pts
+
+
+def reaim_chief_rays(opt_model, flds, wvl, aim_pts, stop_pts):
+    """ returns the aim points of **flds**, reusing previous aim points if valid
+
+    The rays through the previous **aim_pts** are traced as far as the stop.
+    If a ray hits the stop at its **stop_pts** entry, the same place as when
+    the aim point was computed, nothing upstream of the stop has changed and
+    the aim point is reused. The remaining fields are aimed together by
+    :func:`aim_chief_rays`, starting from their previous aim points.
+
+    Args:
+        opt_model: :class:`~.OpticalModel` instance
+        flds: list of :class:`~.Field` to be aimed
+        wvl: wavelength (nm)
+        aim_pts: list of the previous aim points, or None entries
+        stop_pts: list of the stop intercepts of the previous aim points, or
+                  None entries
+
+    Returns:
+        (**aim_pts**, **stop_pts**), lists of the aim points and the stop
+        intercepts of the rays through them
+    """
+    aim_pts, stop_pts = list(aim_pts), list(stop_pts)
+    known = [i for i, (a, s) in enumerate(zip(aim_pts, stop_pts))
+             if a is not None and s is not None]
+    new_stop_pts = stop_intercepts(opt_model, [flds[i] for i in known], wvl,
+                                   [aim_pts[i] for i in known])
+    reused = {i for i, new_stop_pt in zip(known, new_stop_pts)
+              if new_stop_pt is not None and
+              np.allclose(new_stop_pt, stop_pts[i], rtol=0., atol=1e-12)}
+
+    reaim = [i for i in range(len(flds)) if i not in reused]
+    if len(reaim) > 0:
+        start = [np.zeros(2) if aim_pts[i] is None else aim_pts[i]
+                 for i in reaim]
+        reaim_flds = [flds[i] for i in reaim]
+        new_aim_pts = aim_chief_rays(opt_model, reaim_flds, wvls=[wvl],
+                                     start=start)[:, 0]
+        new_stop_pts = stop_intercepts(opt_model, reaim_flds, wvl,
+                                       new_aim_pts)
+        for i, aim_pt, stop_pt in zip(reaim, new_aim_pts, new_stop_pts):
+            aim_pts[i], stop_pts[i] = aim_pt, stop_pt
+    return aim_pts, stop_pts
+
+
+def reaim_chief_ray(opt_model, fld, wvl, aim_pt=None, stop_pt=None):
+    """ returns the aim point of **fld**, reusing a previous aim point if valid
+
+    Returns:
+        (**aim_pt**, **stop_pt**), the aim point and the stop intercept of
+        the ray through it; see :func:`reaim_chief_rays`
+    """
+    aim_pts, stop_pts = reaim_chief_rays(opt_model, [fld], wvl, [aim_pt],
+                                         [stop_pt])
+    return aim_pts[0], stop_pts[0]
+
+
 def apply_paraxial_vignetting(opt_model):
     fov = opt_model.optical_spec.field_of_view
     pm = opt_model.parax_model
@@ -517,9 +1012,97 @@ def apply_paraxial_vignetting(opt_model):
         #     j, rel_fov, fld.vly, fld.vuy))
         
 
+class ChiefRayCache:
+    """ Model-owned cache of chief ray packages and reference spheres
+
+    Chief rays are keyed by the object point, the aim point and the
+    wavelength, plus the paraxial pupil locations used to launch the ray and
+    to find its exit pupil segment. Reference spheres are keyed by their
+    chief ray key, the focus and the image point. The cache is emptied when
+    the revision of the sequential model changes.
+
+    The cache holds results for any number of fields and wavelengths, so
+    cycling through the wavelengths of a field never retraces a chief ray,
+    and the :class:`~.Field` instances are not modified.
+
+    Attributes:
+        maxsize: the maximum number of chief rays and of reference spheres
+        hits: the number of chief rays found in the cache
+        misses: the number of chief rays traced
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self.revision = None
+        self.chief_rays = OrderedDict()
+        self.ref_spheres = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def check_revision(self, opt_model):
+        """ empty the cache if the sequential model has been updated """
+        revision = opt_model.seq_model.revision
+        if revision != self.revision:
+            self.chief_rays.clear()
+            self.ref_spheres.clear()
+            self.revision = revision
+
+    def chief_ray_key(self, opt_model, fld, wvl):
+        fod = opt_model['analysis_results']['parax_data'].fod
+        # the chief ray is traced through pupil coordinates (0, 0)
+        aim_pt = tuple(pupil_aim_points(opt_model, [0., 0.], fld)[0])
+        obj_pt = tuple(opt_model.optical_spec.obj_coords(fld))
+        return (obj_pt, aim_pt, wvl, fod.obj_dist+fod.enp_dist, fod.exp_dist)
+
+    def _insert(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def chief_ray_pkg(self, opt_model, fld, wvl):
+        """ returns the chief ray package for **fld** and **wvl** """
+        self.check_revision(opt_model)
+        key = self.chief_ray_key(opt_model, fld, wvl)
+        chief_ray_pkg = self.chief_rays.get(key)
+        if chief_ray_pkg is None:
+            self.misses += 1
+            chief_ray_pkg = trace_chief_ray(opt_model, fld, wvl, None)
+            self._insert(self.chief_rays, key, chief_ray_pkg)
+        else:
+            self.hits += 1
+            self.chief_rays.move_to_end(key)
+        return chief_ray_pkg
+
+    def ref_sphere(self, opt_model, fld, wvl, foc, chief_ray_pkg,
+                   image_pt_2d=None, image_delta=None):
+        """ returns the reference sphere for **fld**, **wvl** and **foc**
+
+        **chief_ray_pkg** must be the chief ray package for fld and wvl.
+        """
+        self.check_revision(opt_model)
+        key = (self.chief_ray_key(opt_model, fld, wvl), foc,
+               None if image_pt_2d is None else tuple(image_pt_2d),
+               None if image_delta is None else tuple(image_delta))
+        ref_sphere = self.ref_spheres.get(key)
+        if ref_sphere is None:
+            ref_sphere = calculate_reference_sphere(opt_model, fld, wvl, foc,
+                                                    chief_ray_pkg,
+                                                    image_pt_2d=image_pt_2d,
+                                                    image_delta=image_delta)
+            self._insert(self.ref_spheres, key, ref_sphere)
+        else:
+            self.ref_spheres.move_to_end(key)
+        return ref_sphere
+
+
 def get_chief_ray_pkg(opt_model, fld, wvl, foc):
     """Get the chief ray package at **fld**, computing it if necessary.
 
+    The chief ray package is taken from the model's :class:`ChiefRayCache`.
+
     Args:
         opt_model: :class:`~.OpticalModel` instance
         fld: :class:`~.Field` point for wave aberration calculation
@@ -537,14 +1120,7 @@ def get_chief_ray_pkg(opt_model, fld, wvl, foc):
                 - dist: distance from interface to the exit pupil point
 
     """
-    if fld.chief_ray is None:
-        aim_chief_ray(opt_model, fld, wvl=wvl)
-        chief_ray_pkg = trace_chief_ray(opt_model, fld, wvl, foc)
-    elif fld.chief_ray[0][2] != wvl:
-        chief_ray_pkg = trace_chief_ray(opt_model, fld, wvl, foc)
-    else:
-        chief_ray_pkg = fld.chief_ray
-    return chief_ray_pkg
+    return opt_model.chief_ray_cache.chief_ray_pkg(opt_model, fld, wvl)
 
 
 def refocus(opt_model):
@@ -576,14 +1152,14 @@ def trace_coddington_fan(opt_model, ray_pkg, foc=None):
 .. note:: spherical surfaces only
     """
     seq_model = opt_model.seq_model
-    wl = seq_model.index_for_wavelength(ray_pkg.wvl)
+    rndx = seq_model.rndx_for_wavelength(ray_pkg.wvl)
 
     path = itertools.zip_longest(ray_pkg.ray, seq_model.ifcs,
-                                 [n[wl] for n in seq_model.rndx],
+                                 rndx,
                                  seq_model.lcl_tfrms,
                                  seq_model.z_dir)
 
-    before_rind = seq_model.rndx[0][wl]
+    before_rind = rndx[0]
     before_dir = None
     s_before, t_before = None, None
     for r, ifc, after_rind, tfrm, z_dir in path:
@@ -669,10 +1245,6 @@ def trace_astigmatism_curve(opt_model, num_points=21, **kwargs):
     max_field = osp['fov'].max_field()[0]
     for f in np.linspace(0., max_field, num=num_points):
         fld.y = f
-        ref_sphere, cr_pkg = setup_pupil_coords(opt_model, fld, wvl, foc)
-        fld.chief_ray = cr_pkg
-        fld.ref_sphere = ref_sphere
-        
         s_foc, t_foc = trace_astigmatism(opt_model, fld, wvl, foc, **kwargs)
         s_data.append(s_foc)
         t_data.append(t_foc)
@@ -8,13 +8,19 @@
 .. codeauthor: Michael J. Hayford
 """
 
+# per-ray status codes, for reporting ray failures without exceptions
+ok, missed_surface, tir, blocked, evanescent = range(5)
+
 
 class TraceError(Exception):
     """ Exception raised when ray tracing a model """
+    status = None
 
 
 class TraceMissedSurfaceError(TraceError):
     """ Exception raised when ray misses an interface """
+    status = missed_surface
+
     def __init__(self, ifc=None, prev_seg=None):
         self.ifc = ifc
         self.prev_seg = prev_seg
@@ -22,6 +28,8 @@ class TraceMissedSurfaceError(TraceError):
 
 class TraceTIRError(TraceError):
     """ Exception raised when ray TIRs at an interface """
+    status = tir
+
     def __init__(self, inc_dir, normal, prev_indx, follow_indx):
         self.ifc = None
         self.int_pt = None
@@ -33,6 +41,8 @@ class TraceTIRError(TraceError):
 
 class TraceEvanescentRayError(TraceError):
     """ Exception raised when ray diffracts evanescently at an interface """
+    status = evanescent
+
     def __init__(self, ifc, int_pt, inc_dir, normal, prev_indx, follow_indx):
         self.ifc = ifc
         self.int_pt = int_pt
@@ -44,6 +54,34 @@ class TraceEvanescentRayError(TraceError):
 
 class TraceRayBlockedError(TraceError):
     """ Exception raised when ray is blocked by an aperture on an interface """
+    status = blocked
+
     def __init__(self, ifc, int_pt):
         self.ifc = ifc
         self.int_pt = int_pt
+
+
+def status_for_error(rayerr):
+    """ returns the status code corresponding to the exception *rayerr* """
+    return rayerr.status
+
+
+def error_for_status(status, surf=None, ray_pkg=None):
+    """ returns a :class:`TraceError` instance corresponding to *status*
+
+    The exception is only created, not raised. The *surf* and *ray_pkg*
+    attributes are set as they would be by :func:`~.raytrace.trace_raw`.
+    """
+    if status == missed_surface:
+        rayerr = TraceMissedSurfaceError()
+    elif status == tir:
+        rayerr = TraceTIRError(None, None, None, None)
+    elif status == blocked:
+        rayerr = TraceRayBlockedError(None, None)
+    elif status == evanescent:
+        rayerr = TraceEvanescentRayError(None, None, None, None, None, None)
+    else:
+        return None
+    rayerr.surf = surf
+    rayerr.ray_pkg = ray_pkg
+    return rayerr
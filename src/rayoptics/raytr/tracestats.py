@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Opt-in, per-surface instrumentation of the ray trace
+
+    When a :class:`TraceStats` instance is enabled, :func:`~.raytrace.trace_raw`,
+    :func:`~.batchtrace.trace_raw_batch` and the iterative profile
+    intersections report to it. The following are collected for each surface:
+
+        - the number of intersection calls and of rays intersected
+        - the cumulative time spent in the intersection calculation
+        - a histogram of the Newton iteration counts of
+          :meth:`~.profiles.SurfaceProfile.intersect_spencer`
+        - the number of rays lost to each :class:`~.TraceError` subclass
+
+    The hook is the module level variable :data:`recorder`. The trace code
+    only checks whether it is None, so instrumentation costs essentially
+    nothing when it is disabled. The recorder is process wide; the statistics
+    are keyed by the surface index in the path being traced.
+
+    Usually the instrumentation is accessed via the
+    :class:`~.OpticalModel`::
+
+        stats = opm.enable_trace_stats()
+        ... trace rays ...
+        opm.disable_trace_stats()
+        print(opm.trace_stats.summary())
+
+    A TraceStats instance can also be used as a context manager that
+    enables it for the duration of the with block.
+"""
+
+from collections import Counter, defaultdict
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from rayoptics.raytr import traceerror as terr
+
+# the active TraceStats instance, or None if instrumentation is disabled
+recorder = None
+
+
+def enable(trace_stats):
+    """ make **trace_stats** the active recorder """
+    global recorder
+    recorder = trace_stats
+    return trace_stats
+
+
+def disable():
+    """ turn off trace instrumentation """
+    global recorder
+    recorder = None
+
+
+class TraceStats:
+    """ Per-surface ray trace statistics
+
+    Attributes:
+        calls: Counter of intersection calls, keyed by surface index
+        rays: Counter of rays intersected, keyed by surface index
+        intersect_time: dict of cumulative intersection time in seconds
+        newton_iters: dict of Counters of the Newton iteration counts
+        errors: dict of Counters of the TraceError subclass names of the
+                rays that failed at the surface
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.rays = Counter()
+        self.intersect_time = defaultdict(float)
+        self.newton_iters = defaultdict(Counter)
+        self.errors = defaultdict(Counter)
+        # surface currently being intersected
+        self.surf = None
+
+    def __enter__(self):
+        return enable(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        disable()
+        return False
+
+    def intersect(self, surf, ifc, p, d, eps, z_dir):
+        """ time the intersection of a single ray with **ifc** """
+        self.surf = surf
+        self.calls[surf] += 1
+        self.rays[surf] += 1
+        t0 = perf_counter()
+        try:
+            return ifc.intersect(p, d, eps=eps, z_dir=z_dir)
+        finally:
+            self.intersect_time[surf] += perf_counter() - t0
+            self.surf = None
+
+    def intersect_array(self, surf, ifc, p, d, eps, z_dir):
+        """ time the intersection of an array of rays with **ifc** """
+        self.surf = surf
+        self.calls[surf] += 1
+        self.rays[surf] += len(p)
+        t0 = perf_counter()
+        try:
+            return ifc.intersect_array(p, d, eps=eps, z_dir=z_dir)
+        finally:
+            self.intersect_time[surf] += perf_counter() - t0
+            self.surf = None
+
+    def record_iterations(self, num_iters):
+        """ record the Newton iteration count of a single ray """
+        self.newton_iters[self.surf][num_iters] += 1
+
+    def record_iterations_array(self, num_iters):
+        """ record the Newton iteration counts of an array of rays """
+        counts = np.bincount(np.asarray(num_iters, dtype=int))
+        hist = self.newton_iters[self.surf]
+        for n in np.flatnonzero(counts):
+            hist[int(n)] += int(counts[n])
+
+    def record_error(self, surf, rayerr):
+        """ record a ray failure at **surf** """
+        self.errors[surf][type(rayerr).__name__] += 1
+
+    def record_status(self, surf, status, num_rays):
+        """ record num_rays failures at **surf** with status code **status** """
+        if num_rays > 0:
+            err_name = type(terr.error_for_status(status)).__name__
+            self.errors[surf][err_name] += int(num_rays)
+
+    def surfaces(self):
+        """ returns a sorted list of the surface indices with data """
+        srfs = set(self.calls) | set(self.newton_iters) | set(self.errors)
+        srfs.discard(None)
+        return sorted(srfs)
+
+    def iteration_histogram(self, surf):
+        """ returns a (counts, iterations) pair of arrays for **surf** """
+        hist = self.newton_iters.get(surf, Counter())
+        iters = np.array(sorted(hist), dtype=int)
+        counts = np.array([hist[n] for n in iters], dtype=int)
+        return counts, iters
+
+    def summary(self):
+        """ returns a pandas DataFrame with one row of statistics per surface
+        """
+        err_names = sorted({name for errs in self.errors.values()
+                            for name in errs})
+        rows = []
+        for s in self.surfaces():
+            num_rays = self.rays[s]
+            t = self.intersect_time.get(s, 0.0)
+            counts, iters = self.iteration_histogram(s)
+            num_solves = counts.sum()
+            row = {'calls': self.calls[s],
+                   'rays': num_rays,
+                   'time': t,
+                   'time/ray': t/num_rays if num_rays > 0 else np.nan,
+                   'mean iters': (np.dot(counts, iters)/num_solves
+                                  if num_solves > 0 else np.nan),
+                   'max iters': iters[-1] if num_solves > 0 else np.nan,
+                   }
+            for name in err_names:
+                row[name] = self.errors[s][name] if s in self.errors else 0
+            rows.append(row)
+        return pd.DataFrame(rows, index=pd.Index(self.surfaces(),
+                                                 name='surf'))
+
+    def __str__(self):
+        return self.summary().to_string()
@@ -11,11 +11,14 @@ import logging
 
 import numpy as np
 from numpy import sqrt
+from numpy.linalg import norm
 from scipy.optimize import newton
 
 import rayoptics.optical.model_constants as mc
 
+from rayoptics.elem.surface import Rectangular
 from rayoptics.raytr import trace, RayPkg, RaySeg
+from rayoptics.raytr import batchtrace as bt
 from rayoptics.raytr import traceerror as terr
 from rayoptics.parax import etendue
 
@@ -23,47 +26,123 @@ from rayoptics.parax import etendue
 xy_str = 'xy'
 
 
-def set_ape(opm):
+def set_ape(opm, num_rays=None):
     """ From existing fields and vignetting, calculate clear apertures. 
     
     This function modifies the max_aperture maintained by the list of
     :class:`~.interface.Interface` in the 
-    :class:`~.sequential.SequentialModel`. For each interface, the smallest 
-    aperture that will pass all of the (vignetted) boundary rays, for each 
-    field, is chosen.
-    
+    :class:`~.sequential.SequentialModel`, see :func:`set_clear_apertures`.
+
     The change of the apertures is propagated to the 
     :class:`~.elements.ElementModel` via 
     :meth:`~.elements.ElementModel.sync_to_seq`.
+
+    Args:
+        opm: :class:`~.OpticalModel` instance
+        num_rays: the number of rays around the rim of the pupil to trace in
+                  addition to the pupil rays; see :func:`trace_aperture_rays`
     """
-    rayset = trace.trace_boundary_rays(opm, use_named_tuples=True)
-
-    for i, ifc in enumerate(opm['sm'].ifcs):
-        max_ap = -1.0e+10
-        update = True
-        for f in rayset:
-            for p in f:
-                ray = p.ray
-                if len(ray) > i:
-                    ap = sqrt(ray[i].p[0]**2 + ray[i].p[1]**2)
-                    if ap > max_ap:
-                        max_ap = ap
-                else:  # ray failed before this interface, don't update
-                    update = False
-        if update:
-            ifc.set_max_aperture(max_ap)
+    set_clear_apertures(opm, num_rays=num_rays)
 
     # sync the element model with the new clear apertures
     opm['em'].sync_to_seq(opm['sm'])
 
 
+def set_clear_apertures(opm, num_rays=None):
+    """ Size the clear apertures of the interfaces to pass the aperture rays.
+
+    For each interface, the smallest aperture that will pass all of the
+    (vignetted) aperture rays, for each field, is chosen. The x and y half
+    widths of :class:`~.surface.Rectangular` clear apertures are set to the
+    extents of the rays. Interfaces that some ray fails to reach are left
+    unchanged.
+
+    Args:
+        opm: :class:`~.OpticalModel` instance
+        num_rays: the number of rays around the rim of the pupil to trace in
+                  addition to the pupil rays; see :func:`trace_aperture_rays`
+    """
+    bundle, reached = trace_aperture_rays(opm, num_rays=num_rays)
+    x, y = bundle.p[..., 0], bundle.p[..., 1]
+    max_aps = np.max(np.sqrt(x*x + y*y), axis=0)
+
+    for i in np.flatnonzero(reached):
+        ifc = opm['sm'].ifcs[i]
+        ifc.set_max_aperture(max_aps[i])
+        for ca in getattr(ifc, 'clear_apertures', []):
+            if isinstance(ca, Rectangular):
+                ca.set_dimension(np.max(np.abs(x[:, i] - ca.x_offset)),
+                                 np.max(np.abs(y[:, i] - ca.y_offset)))
+
+
+def trace_aperture_rays(opm, num_rays=None, wvl=None):
+    """ Trace the rays that determine the clear apertures, for all fields.
+
+    The pupil rays of the :class:`~.PupilSpec` are traced for each field.
+    If **num_rays** is given, that many rays, evenly spaced around the rim
+    of the pupil, are traced as well. The pupil rays only sample the
+    pupil's x and y axes, so the apertures of surfaces limited by skew rays
+    are underestimated; sampling the rim fixes this. The rays of all of the
+    fields are traced together and vignetting is applied.
+
+    As a side effect, the pupil rays of each field are saved as the
+    field's `pupil_rays` attribute, as in :func:`~.trace.trace_boundary_rays`.
+
+    Args:
+        opm: :class:`~.OpticalModel` instance
+        num_rays: the number of additional rays around the pupil rim
+        wvl: wavelength (nm), defaults to the central wavelength
+
+    Returns:
+        (**bundle**, **reached**)
+
+        - **bundle** - a :class:`~.batchtrace.RayBundle` with the rays of
+          all of the fields
+        - **reached** - boolean array, True for the interfaces reached by
+          every ray
+    """
+    osp = opm['osp']
+    sm = opm['sm']
+    if wvl is None:
+        wvl = sm.central_wavelength()
+    flds = osp['fov'].fields
+    pupil_rays = np.array(osp['pupil'].pupil_rays, dtype=float)
+    pupils = pupil_rays
+    if num_rays:
+        theta = np.linspace(0., 2*np.pi, num_rays, endpoint=False)
+        pupils = np.concatenate((pupils, np.column_stack((np.cos(theta),
+                                                          np.sin(theta)))))
+    num_pupils = len(pupils)
+
+    pt0 = np.empty((len(flds)*num_pupils, 3))
+    dir0 = np.empty((len(flds)*num_pupils, 3))
+    for fi, fld in enumerate(flds):
+        rays = slice(fi*num_pupils, (fi+1)*num_pupils)
+        vig_pupils = fld.apply_vignetting_array(pupils)
+        pt0[rays], dir0[rays] = trace.bundle_start_rays(opm, vig_pupils, fld)
+    bundle = bt.trace_batch(sm, pt0, dir0, wvl)
+
+    for fi, fld in enumerate(flds):
+        rim_rays = [bundle.ray_pkg(fi*num_pupils + j)
+                    for j in range(len(pupil_rays))]
+        fld.pupil_rays = trace.boundary_ray_dict(opm, rim_rays)
+
+    # the number of segments traced by each ray, cf. RayBundle.num_segments
+    num_segs = np.where(bundle.status == terr.ok, bundle.num_surfs,
+                        np.where(bundle.status == terr.missed_surface,
+                                 bundle.fail_surf, bundle.fail_surf + 1))
+    min_segs = np.min(num_segs) if len(num_segs) > 0 else 0
+    reached = np.arange(bundle.num_surfs) < min_segs
+    return bundle, reached
+
+
 def set_vig(opm):
     """ From existing fields and clear apertures, calculate vignetting. """
     osp = opm['osp']
-    for fi in range(len(osp['fov'].fields)):
-        fld, wvl, foc = osp.lookup_fld_wvl_focus(fi)
-        # print(f"field {fi}:")
-        calc_vignetting_for_field(opm, fld, wvl)
+    flds = osp['fov'].fields
+    if len(flds) > 0:
+        fld, wvl, foc = osp.lookup_fld_wvl_focus(0)
+        calc_vignetting(opm, flds, wvl)
 
 
 def set_pupil(opm):
@@ -125,27 +204,170 @@ def set_pupil(opm):
                 osp['pupil'].value = -1/(2*slpk)
 
     if pupil_value_orig != osp['pupil'].value:
-        opm.update_model()
+        opm.update_model(changed='pupil')
         set_vig(opm)
 
 
 def calc_vignetting_for_field(opm, fld, wvl):
     """Calculate and set the vignetting parameters for `fld`. """
-    pupil_starts = opm['osp']['pupil'].pupil_rays[1:]
-    vig_factors = [0.]*4
-    for i in range(4):
-        xy = i//2
-        start = pupil_starts[i]
-        vig, last_indx, ray_pkg = calc_vignetted_ray(opm, xy, start, fld, wvl)
-        # print(f"ray: ({start[0]:2.0f}, {start[1]:2.0f}), vig={vig:8.4f}, "
-        #       f"limited at ifcs[{last_indx}]")
-        vig_factors[i] = vig
-
-    # update the field's vignetting factors
-    fld.vux = vig_factors[0]
-    fld.vlx = vig_factors[1]
-    fld.vuy = vig_factors[2]
-    fld.vly = vig_factors[3]
+    calc_vignetting(opm, [fld], wvl)
+
+
+def calc_vignetting(opm, flds, wvl, max_iter_count=10):
+    """Calculate and set the vignetting parameters for all of `flds`.
+
+    This is a batched version of :func:`calc_vignetted_ray`, applied to the
+    4 pupil directions of each field. The rays of all of the fields and
+    directions are traced together, and each ray follows the same steps as
+    the scalar search: a ray blocked by an aperture is iterated to the edge
+    of the blocking interface, and a ray that passes the first time is
+    iterated to the edge of the stop. The search for a ray ends when it
+    passes after an iteration, or is blocked by the same interface twice
+    in a row.
+
+    Args:
+        opm: :class:`~.OpticalModel` instance
+        flds: list of :class:`~.Field`
+        wvl: wavelength of rays (nm)
+        max_iter_count: fail-safe limit on aperture search
+    """
+    sm = opm['sm']
+    stop = sm.stop_surface
+    pupil_starts = np.array(opm['osp']['pupil'].pupil_rays[1:5], dtype=float)
+    num_dirs = len(pupil_starts)
+    # the rays are ordered by field and then pupil direction
+    fld_indx = np.repeat(np.arange(len(flds)), num_dirs)
+    xy = np.tile(np.arange(num_dirs)//2, len(flds))
+    start_coords = np.tile(pupil_starts, (len(flds), 1))[np.arange(len(xy)),
+                                                          xy]
+    rel_p1 = start_coords.copy()
+    last_indx = np.full(len(xy), -1)
+    done = np.zeros(len(xy), dtype=bool)
+    for iter_count in range(max_iter_count):
+        active = np.flatnonzero(~done)
+        if len(active) == 0:
+            break
+        bundle = _trace_pupil_rays(opm, flds, fld_indx[active], xy[active],
+                                   rel_p1[active], wvl, check_apertures=True)
+        blocked = bundle.status != terr.ok
+        # a ray that passed is iterated to the edge of the stop, once
+        indx = np.where(blocked, bundle.fail_surf, -1 if stop is None else stop)
+        finished = np.where(blocked, indx == last_indx[active],
+                            (last_indx[active] >= 0) | (indx < 0))
+        done[active[finished]] = True
+
+        iterate, indx = active[~finished], indx[~finished]
+        if len(iterate) == 0:
+            break
+        last_indx[iterate] = indx
+        r_targets = np.array([sm.ifcs[i].surface_od() for i in indx])
+        rel_p1[iterate] = _iterate_pupil_rays(opm, flds, fld_indx[iterate],
+                                              xy[iterate], rel_p1[iterate],
+                                              indx, r_targets, wvl)
+
+    vig_factors = (1.0 - rel_p1/start_coords).reshape(len(flds), num_dirs)
+    # update the fields' vignetting factors
+    for fld, vig in zip(flds, vig_factors):
+        fld.vux, fld.vlx, fld.vuy, fld.vly = (float(v) for v in vig)
+
+
+def _trace_pupil_rays(opm, flds, fld_indx, xy, rel_p1, wvl, stop=None,
+                      **kwargs):
+    """ trace rays with pupil coordinate `rel_p1` along the `xy` axis
+
+    Ray i is from field flds[fld_indx[i]]; the rays of all of the fields are
+    traced together. If `stop` is given, the rays are only traced up to
+    interface stop-1.
+
+    Returns:
+        a :class:`~.batchtrace.RayBundle`
+    """
+    num_rays = len(rel_p1)
+    pupils = np.zeros((num_rays, 2))
+    pupils[np.arange(num_rays), xy] = rel_p1
+    pt0 = np.empty((num_rays, 3))
+    dir0 = np.empty((num_rays, 3))
+    for fi in np.unique(fld_indx):
+        rays = fld_indx == fi
+        pt0[rays], dir0[rays] = trace.bundle_start_rays(opm, pupils[rays],
+                                                        flds[fi])
+    sm = opm['sm']
+    if stop is None:
+        return bt.trace_batch(sm, pt0, dir0, wvl, **kwargs)
+    return bt.trace_raw_batch(sm.trace_plan(wvl, stop=stop), pt0, dir0, wvl,
+                              **kwargs)
+
+
+def _iterate_pupil_rays(opm, flds, fld_indx, xy, start_r0, indx, r_targets,
+                        wvl, tol=1e-6, maxiter=10):
+    """ iterates rays to `r_targets` on interfaces `indx`, as a batch
+
+    This is a batched version of :func:`iterate_pupil_ray`. Each ray takes
+    the same secant steps as :func:`scipy.optimize.newton` does in the
+    scalar version, so that the iterated rays land on the same side of the
+    aperture edges. Rays that fail, or that haven't converged after
+    `maxiter` steps, are iterated individually by :func:`iterate_pupil_ray`.
+
+    Returns:
+        the pupil coordinates along the `xy` axis of the rays through
+        `r_targets`
+    """
+    num_rays = len(start_r0)
+    last_surf = np.max(indx)
+
+    def radius_error(rays, rel_p1):
+        bundle = _trace_pupil_rays(opm, flds, fld_indx[rays], xy[rays],
+                                   rel_p1, wvl, stop=last_surf+1)
+        # the point is NaN if the ray failed before the target interface
+        pts = bundle.p[np.arange(len(rays)), indx[rays], :2]
+        return norm(pts, axis=1) - r_targets[rays]
+
+    # the second starting point is chosen as in scipy.optimize.newton
+    all_rays = np.arange(num_rays)
+    p0 = np.array(start_r0, dtype=float)
+    p1 = p0*(1 + 1e-4)
+    p1 += np.where(p1 >= 0, 1e-4, -1e-4)
+    q = radius_error(np.concatenate((all_rays, all_rays)),
+                     np.concatenate((p0, p1)))
+    q0, q1 = q[:num_rays], q[num_rays:]
+    swap = np.abs(q1) < np.abs(q0)
+    p0[swap], p1[swap] = p1[swap], p0[swap]
+    q0[swap], q1[swap] = q1[swap], q0[swap]
+
+    root = p1.copy()
+    done = np.zeros(num_rays, dtype=bool)
+    failed = ~(np.isfinite(q0) & np.isfinite(q1))
+    for i in range(maxiter):
+        rays = np.flatnonzero(~(done | failed))
+        if len(rays) == 0:
+            break
+        # the error no longer changes, i.e. it's at the resolution of the
+        # trace; take the midpoint of the last two points
+        stalled = q1[rays] == q0[rays]
+        root[rays[stalled]] = 0.5*(p0[rays[stalled]] + p1[rays[stalled]])
+        done[rays[stalled]] = True
+        rays = rays[~stalled]
+
+        a0, a1, b0, b1 = p0[rays], p1[rays], q0[rays], q1[rays]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.where(np.abs(b1) > np.abs(b0),
+                         (-b0/b1*a1 + a0)/(1 - b0/b1),
+                         (-b1/b0*a0 + a1)/(1 - b1/b0))
+        root[rays] = p
+        converged = np.abs(p - a1) <= tol
+        done[rays[converged]] = True
+        rays, p = rays[~converged], p[~converged]
+
+        p0[rays], q0[rays] = p1[rays], q1[rays]
+        p1[rays] = p
+        q1[rays] = radius_error(rays, p)
+        failed[rays[~np.isfinite(q1[rays])]] = True
+
+    for k in np.flatnonzero(failed | ~done):
+        fld = flds[fld_indx[k]]
+        root[k] = iterate_pupil_ray(opm, indx[k], xy[k], start_r0[k],
+                                    r_targets[k], fld, wvl)[xy[k]]
+    return root
 
 
 def calc_vignetted_ray(opm, xy, start_dir, fld, wvl, max_iter_count=10):
@@ -14,7 +14,9 @@ from math import sqrt
 import numpy as np
 
 from rayoptics.optical import model_constants as mc
-from rayoptics.elem.transform import transform_after_surface
+from rayoptics.elem.transform import (transform_after_surface,
+                                      transform_after_surface_array)
+from rayoptics.raytr import traceerror as terr
 
 from rayoptics.util.misc_math import normalize
 
@@ -221,3 +223,110 @@ def wave_abr_calc(fod, fld, wvl, foc, ray_pkg, chief_ray_pkg,
 
     opd = pre_opd - abs(fod.n_img)*ep
     return opd
+
+
+# --- Wavefront aberration, array versions
+def eic_distance_array(p, d, p0, d0):
+    """ calculate equally inclined chord distances from rays to one ray
+
+    This is the array counterpart of :func:`eic_distance`.
+
+    Args:
+        p: (N, 3) array of points on the rays
+        d: (N, 3) array of direction cosines of the rays
+        p0: a point on the ray r0
+        d0: the direction cosine of r0
+
+    Returns:
+        (N,) array of the distances along the rays from the equally
+        inclined chord points to p
+    """
+    # eq 3.9
+    return (np.einsum('ij,ij->i', d + d0, p - p0) / (1. + d.dot(d0)))
+
+
+def wave_abr_full_calc_array(fod, fld, wvl, foc, ray_bundle, chief_ray_pkg,
+                             ref_sphere):
+    """Given a bundle of rays, a chief ray and an image pt, evaluate the OPDs.
+
+    This is the array counterpart of :func:`wave_abr_full_calc`; the OPD of
+    every ray in **ray_bundle** is calculated in one pass.
+
+    Args:
+        fod: :class:`~.FirstOrderData` for object and image space refractive
+             indices
+        fld: :class:`~.Field` point for wave aberration calculation
+        wvl: wavelength of ray (nm)
+        foc: defocus amount
+        ray_bundle: a :class:`~.batchtrace.RayBundle` of rays from **fld**
+        chief_ray_pkg: input tuple of chief_ray, cr_exp_seg
+        ref_sphere: input tuple of image_pt, ref_dir, ref_sphere_radius
+
+    Returns:
+        (N,) array of the OPDs of the rays wrt the chief ray at **fld**;
+        the OPD of a failed ray is NaN
+    """
+    pre_opd_pkg = wave_abr_pre_calc_array(fod, fld, wvl, foc, ray_bundle,
+                                          chief_ray_pkg)
+    return wave_abr_calc_array(fod, fld, wvl, foc, chief_ray_pkg,
+                               pre_opd_pkg, ref_sphere)
+
+
+def wave_abr_pre_calc_array(fod, fld, wvl, foc, ray_bundle, chief_ray_pkg):
+    """Pre-calculate the part of the OPD calc independent of focus.
+
+    This is the array counterpart of :func:`wave_abr_pre_calc`. The data of
+    failed rays are NaN.
+
+    Returns:
+        (**pre_opd**, **p_coord**, **b4_pt**, **b4_dir**), arrays of length N
+    """
+    cr, cr_exp_seg = chief_ray_pkg
+    chief_ray, chief_ray_op, wvl = cr
+    cr_exp_pt, cr_exp_dir, cr_exp_dist, ifc, cr_b4_pt, cr_b4_dir = cr_exp_seg
+
+    k = -2  # last interface in sequence
+    p, d = ray_bundle.p, ray_bundle.d
+
+    # eq 3.12
+    e1 = eic_distance_array(p[:, 1], d[:, 0],
+                            chief_ray[1][mc.p], chief_ray[0][mc.d])
+    # eq 3.13
+    ekp = eic_distance_array(p[:, k], d[:, k],
+                             chief_ray[k][mc.p], chief_ray[k][mc.d])
+
+    pre_opd = (-abs(fod.n_obj)*e1 - ray_bundle.op_delta + abs(fod.n_img)*ekp
+               + chief_ray_op)
+    # a ray may fail after the last interface, at the image
+    pre_opd[ray_bundle.status != terr.ok] = np.nan
+
+    b4_pt, b4_dir = transform_after_surface_array(ifc, p[:, k], d[:, k])
+    dst = ekp - cr_exp_dist
+    eic_exp_pt = b4_pt - dst[:, np.newaxis]*b4_dir
+    p_coord = eic_exp_pt - cr_exp_pt
+
+    return pre_opd, p_coord, b4_pt, b4_dir
+
+
+def wave_abr_calc_array(fod, fld, wvl, foc, chief_ray_pkg, pre_opd_pkg,
+                        ref_sphere):
+    """Given pre-calculated info and a ref. sphere, return the rays' OPDs.
+
+    This is the array counterpart of :func:`wave_abr_calc`.
+    """
+    cr, cr_exp_seg = chief_ray_pkg
+    image_pt, ref_dir, ref_sphere_radius = ref_sphere
+    pre_opd, p_coord, b4_pt, b4_dir = pre_opd_pkg
+
+    F = b4_dir.dot(ref_dir) - np.einsum('ij,ij->i', b4_dir,
+                                        p_coord)/ref_sphere_radius
+    J = (np.einsum('ij,ij->i', p_coord, p_coord)/ref_sphere_radius -
+         2.0*p_coord.dot(ref_dir))
+
+    sign_soln = -1 if ref_dir[2]*cr.ray[-1][mc.d][2] < 0 else 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = F + sign_soln*np.sqrt(F**2 + J/ref_sphere_radius)
+        ep = np.where(denom == 0, 0., J/denom)
+
+    opd = pre_opd - abs(fod.n_img)*ep
+    return opd
@@ -8,9 +8,12 @@
 .. codeauthor: Michael J. Hayford
 """
 
+import numpy as np
 from numpy import sqrt
 from enum import Enum, auto
 
+from rayoptics.raytr.traceerror import TraceMissedSurfaceError
+
 
 class InteractionMode(Enum):
     """ enum for different interact_mode specifications
@@ -138,6 +141,49 @@ class Interface:
         """Returns the unit normal of the interface at point *p*. """
         pass
 
+    def intersect_array(self, p0, d, eps=1.0e-12, z_dir=1):
+        """ Intersect an array of rays with the :class:`~.Interface`.
+
+        The default implementation calls :meth:`intersect` for each ray.
+        Subclasses can override this with a vectorized version.
+
+        Args:
+            p0:  (N, 3) array of ray start points in the interface's
+                 coordinate system
+            d:  (N, 3) array of ray direction cosines
+            z_dir: +1 if propagation positive direction, -1 if otherwise
+            eps: numeric tolerance for convergence of any iterative procedure
+
+        Returns:
+            tuple: (N,) distances *s1*, (N, 3) intersection points *p*, and
+            an (N,) boolean mask that is True for rays that missed the
+            interface
+        """
+        num_rays = len(p0)
+        s1 = np.full(num_rays, np.nan)
+        p = np.full((num_rays, 3), np.nan)
+        miss = np.zeros(num_rays, dtype=bool)
+        for i in range(num_rays):
+            try:
+                s1[i], p[i] = self.intersect(p0[i], d[i], eps=eps, z_dir=z_dir)
+            except TraceMissedSurfaceError:
+                miss[i] = True
+        return s1, p, miss
+
+    def normal_array(self, p):
+        """Returns an (N, 3) array of unit normals at the (N, 3) points *p*. """
+        nrml = np.empty((len(p), 3))
+        for i in range(len(p)):
+            nrml[i] = self.normal(p[i])
+        return nrml
+
+    def point_inside_array(self, x, y, fuzz=1e-5):
+        """ Returns a boolean array, True if (x[i], y[i]) is inside the
+        clear aperture. """
+        x = np.asarray(x)
+        y = np.asarray(y)
+        return np.sqrt(x*x + y*y) <= self.max_aperture + fuzz
+
     def phase(self, pt, in_dir, srf_nrml, ifc_cntxt):
         z_dir, wvl, n_in, n_out, interact_mode = ifc_cntxt
         """Returns a diffracted ray direction and phase increment.
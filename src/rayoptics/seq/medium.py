@@ -10,11 +10,13 @@
 import json
 import difflib
 import logging
+from collections import OrderedDict
 
 import deprecation
 import rayoptics
 
-from scipy.interpolate import interp1d
+import numpy as np
+from scipy.interpolate import interp1d, CubicSpline
 
 from rayoptics.util.misc_math import isanumber
 
@@ -110,6 +112,185 @@ def decode_medium(*inputs, **kwargs):
     return mat
 
 
+# --- refractive index cache
+def _model_glass_key(medium):
+    return (type(medium).__name__, medium.n, medium.v)
+
+
+def _catalog_glass_key(medium):
+    return (type(medium).__name__, medium.catalog_name(), medium.name())
+
+
+def _key_fct_for_type(medium_type):
+    """ returns the cache key function for **medium_type**, or None """
+    if issubclass(medium_type, mg.ModelGlass):
+        return _model_glass_key
+    elif issubclass(medium_type, cat_glass.GlassPandas):
+        return _catalog_glass_key
+    return None
+
+
+class RIndexCache:
+    """ Bounded LRU cache of refractive indices, shared by all models.
+
+    Evaluating a catalog glass dispersion formula is much slower than a
+    dictionary lookup, and the same indices are requested every time a
+    model is updated, e.g. repeatedly during tolerancing or optimization.
+
+    Entries are keyed by the identity of the material and the wavelength in
+    nm. Catalog glasses are identified by type, catalog name and glass name.
+    A :class:`~opticalglass.modelglass.ModelGlass` is identified by its
+    current index and V-number, so changing them, e.g. with `update()`,
+    automatically selects different cache entries. Other media, e.g.
+    :class:`~opticalglass.opticalmedium.Air`, constant index and
+    interpolated media, are cheap to evaluate or defined by mutable data
+    tables; they are not cached.
+
+    Attributes:
+        maxsize: the maximum number of cached indices
+        hits: the number of lookups found in the cache
+        misses: the number of lookups that evaluated the medium
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._key_fcts = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def medium_key(self, medium):
+        """ returns a hashable key identifying **medium**, or None """
+        # isinstance checks against the opticalglass classes are slow;
+        # resolve the key function once per medium type.
+        medium_type = type(medium)
+        try:
+            key_fct = self._key_fcts[medium_type]
+        except KeyError:
+            key_fct = self._key_fcts[medium_type] = (
+                _key_fct_for_type(medium_type))
+        return None if key_fct is None else key_fct(medium)
+
+    def rindex(self, medium, wvl):
+        """ returns the refractive index of **medium** at **wvl**
+
+        Args:
+            medium: a material responding to `rindex`
+            wvl: either the wavelength in nm or a string with a spectral line
+                 identifier
+        """
+        mat_key = self.medium_key(medium)
+        if mat_key is None:
+            return medium.rindex(wvl)
+
+        wv_nm = get_wavelength(wvl) if isinstance(wvl, str) else float(wvl)
+        key = mat_key + (wv_nm,)
+        # the individual OrderedDict operations are atomic, so the cache
+        # can be shared by threads without a lock; an entry evicted by
+        # another thread is simply evaluated again.
+        try:
+            n = self._cache[key]
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return n
+        except KeyError:
+            self.misses += 1
+
+        n = medium.rindex(wv_nm)
+        self._cache[key] = n
+        try:
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        except KeyError:
+            pass
+        return n
+
+    def clear(self):
+        """ empty the cache and reset the statistics """
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# the process wide refractive index cache
+rindex_cache = RIndexCache()
+
+
+def cached_rindex(medium, wvl):
+    """ returns the refractive index of **medium** at **wvl**, using the
+    process wide :data:`rindex_cache`
+    """
+    return rindex_cache.rindex(medium, wvl)
+
+
+def tabulate_rindex(medium, wvls):
+    """ returns an array of the refractive indices of **medium** at **wvls**
+
+    The medium's dispersion formula is evaluated for all of the wavelengths
+    at once if it supports arrays, otherwise one wavelength at a time.
+
+    Args:
+        medium: a material responding to `rindex`
+        wvls: array of wavelengths in nm
+    """
+    wvls = np.asarray(wvls, dtype=float)
+    try:
+        rndx = np.asarray(medium.calc_rindex(wvls), dtype=float)
+        return np.broadcast_to(rndx, wvls.shape).copy()
+    except (AttributeError, TypeError):
+        # the medium has no calc_rindex or it can't evaluate an array
+        return np.array([medium.rindex(w) for w in wvls], dtype=float)
+
+
+class SpectralIndexTable:
+    """ Refractive indices of a list of media sampled on a dense spectrum
+
+    The indices of all the media are tabulated on an evenly spaced grid of
+    wavelengths and interpolated with a cubic spline. Reading an index from
+    the table avoids evaluating a dispersion formula, so that analyses can
+    be sampled finely across a broad band.
+
+    Attributes:
+        media: the list of tabulated media
+        wvls: array of the sample wavelengths in nm
+        rndx: (num media, num wvls) array of refractive indices
+    """
+
+    def __init__(self, media, wvl_range, num_wvls=200):
+        self.media = list(media)
+        self.wvls = np.linspace(wvl_range[0], wvl_range[1], num_wvls)
+        self.rndx = np.array([tabulate_rindex(m, self.wvls)
+                              for m in self.media], dtype=float)
+        self.rndx = self.rndx.reshape(len(self.media), num_wvls)
+        self.spline = CubicSpline(self.wvls, self.rndx, axis=1)
+
+    def __len__(self):
+        return len(self.media)
+
+    @property
+    def wvl_range(self):
+        return self.wvls[0], self.wvls[-1]
+
+    def covers(self, wvl):
+        """ returns True if **wvl**, in nm, is within the tabulated range """
+        return self.wvls[0] <= wvl <= self.wvls[-1]
+
+    def rindex(self, wvl):
+        """ returns the refractive indices of the media at **wvl**
+
+        Args:
+            wvl: a wavelength or array of wavelengths in nm
+
+        Returns:
+            an array of shape (num media,) for a single wavelength, or
+            (num media, num wvls) for an array of wavelengths
+        """
+        return self.spline(wvl)
+
+
 # --- glass finder base class
 class GlassHandlerBase():
     """Base class for glass matching capability.
@@ -8,6 +8,7 @@
 
 import itertools
 import logging
+from collections import OrderedDict
 
 from anytree import Node
 
@@ -16,6 +17,7 @@ from . import gap
 from . import medium
 from rayoptics.raytr import raytrace as rt
 from rayoptics.raytr import trace as trace
+from rayoptics.raytr import vigcalc
 from rayoptics.raytr import waveabr
 from rayoptics.elem import transform as trns
 from opticalglass import glassfactory as gfact
@@ -24,7 +26,7 @@ from opticalglass import modelglass as mg
 from opticalglass import opticalmedium as om
 
 import numpy as np
-from math import copysign, sqrt
+from math import copysign
 from rayoptics.util.misc_math import isanumber
 
 
@@ -63,12 +65,17 @@ class SequentialModel:
         gaps: list of :class:`~rayoptics.seq.gap.Gap`
         lcl_tfrms: forward transform, interface to interface
         rndx: a list with refractive indices for all **wvls**
+        spectral_sampling: None, or a (wvl_range, num_wvls) tuple defining
+                           a dense :class:`~.SpectralIndexTable` used for
+                           wavelengths that aren't in the spectral region
         z_dir: -1 if gap follows an odd number of reflections, otherwise +1
         gbl_tfrms: global coordinates of each interface wrt the 1st interface
         stop_surface (int): index of stop interface
         cur_surface (int): insertion index for next interface
     """
 
+    trace_plans_maxsize = 64
+
     def __init__(self, opt_model, do_init=True, **kwargs):
         self.opt_model = opt_model
 
@@ -77,6 +84,8 @@ class SequentialModel:
         self.z_dir = []
 
         self.do_apertures = True
+        # the number of pupil rim rays used to size the clear apertures
+        self.aperture_rays = None
         
         self.stop_surface = None
         self.cur_surface = None
@@ -89,6 +98,19 @@ class SequentialModel:
         self.wvlns = []  # sampling wavelengths in nm
         self.rndx = []  # refractive index vs wv and gap
 
+        # optional dense spectral sampling of the gap media
+        self.spectral_sampling = None
+        self._spectral_table = None
+
+        # incremented when derived data is updated; used to invalidate caches
+        self.revision = 0
+        self._trace_plans = OrderedDict()
+        self._reverse_tfrms = None
+        # transform cache, see compute_transforms()
+        self._tfrm_keys = []
+        self._gbl_cache = []
+        self._lcl_cache = []
+
         if do_init:
             self._initialize_arrays()
 
@@ -99,6 +121,11 @@ class SequentialModel:
         del attrs['lcl_tfrms']
         del attrs['wvlns']
         del attrs['rndx']
+        attrs.pop('revision', None)
+        attrs.pop('_trace_plans', None)
+        attrs.pop('_spectral_table', None)
+        for a in ('_reverse_tfrms', '_tfrm_keys', '_gbl_cache', '_lcl_cache'):
+            attrs.pop(a, None)
         return attrs
 
     def _initialize_arrays(self):
@@ -149,13 +176,7 @@ class SequentialModel:
         else:
             gap_start = start
 
-        wl_idx = self.index_for_wavelength(wl)
-        try:
-            rndx = [n[wl_idx] for n in self.rndx[start:stop:step]]
-        except IndexError:
-            self.wvlns = self.opt_model['osp']['wvls'].wavelengths
-            self.rndx = self.calc_ref_indices_for_spectrum(self.wvlns)
-            rndx = [n[wl_idx] for n in self.rndx[start:stop:step]]
+        rndx = self.rndx_for_wavelength(wl)[start:stop:step]
 
         path = itertools.zip_longest(self.ifcs[start:stop:step],
                                      self.gaps[gap_start:stop:step],
@@ -164,6 +185,64 @@ class SequentialModel:
                                      self.z_dir[start:stop:step])
         return path
 
+    def spectral_rndx(self, wvls=None):
+        """ returns an (nsurf, nwvl) array of refractive indices for **wvls**
+
+        Each column holds the refractive indices following each interface
+        for one wavelength, see :meth:`rndx_for_wavelength`. The
+        index following the image surface is NaN.
+
+        Args:
+            wvls: list of wavelengths in nm, defaults to the wavelengths of
+                  the model's spectral region
+        """
+        if wvls is None:
+            wvls = self.opt_model['osp']['wvls'].wavelengths
+        spec_wvls = self.opt_model['osp']['wvls'].wavelengths
+        spectral_table = self.spectral_table
+        rndx = np.empty((len(self.gaps), len(wvls)))
+        # interpolate all the tabulated wavelengths in a single call
+        interp = [i for i, wl in enumerate(wvls)
+                  if (wl not in spec_wvls and spectral_table is not None and
+                      spectral_table.covers(wl))]
+        if len(interp) > 0:
+            rndx[:, interp] = spectral_table.rindex(
+                np.asarray(wvls, dtype=float)[interp])
+        for i in sorted(set(range(len(wvls))) - set(interp)):
+            rndx[:, i] = self.rndx_for_wavelength(wvls[i])
+        # there's no gap, and so no index, following the last interface
+        num_missing = len(self.ifcs) - len(rndx)
+        missing = np.full((num_missing, len(wvls)), np.nan)
+        return np.concatenate((rndx, missing))
+
+    def trace_plan(self, wl=None, start=None, stop=None, step=1):
+        """ returns a cached :class:`~.raytrace.TracePlan` for a path range
+
+        The plans are cached for each wavelength and range until the model
+        revision changes, e.g. by calling :meth:`update_model`. At most
+        :attr:`trace_plans_maxsize` plans are kept; the least recently used
+        plan is discarded first.
+
+        Args:
+            wl: wavelength in nm for path, defaults to central wavelength
+            start: start of range
+            stop: first value beyond the end of the range
+            step: increment or stride of range
+        """
+        if wl is None:
+            wl = self.central_wavelength()
+        key = wl, start, stop, step, len(self.ifcs)
+        plan = self._trace_plans.get(key)
+        if plan is None:
+            plan = rt.TracePlan(self.path(wl, start, stop, step), wl,
+                                revision=self.revision)
+            self._trace_plans[key] = plan
+            if len(self._trace_plans) > SequentialModel.trace_plans_maxsize:
+                self._trace_plans.popitem(last=False)
+        else:
+            self._trace_plans.move_to_end(key)
+        return plan
+
     def reverse_path(self, wl=None, start=None, stop=None, step=-1):
         """ returns an iterable path tuple for a range in the sequential model
     
@@ -189,9 +268,8 @@ class SequentialModel:
         else:
             gap_start = start
     
-        tfrms = self.compute_local_transforms(step=-1)
-        wl_idx = self.index_for_wavelength(wl)
-        rndx = [n[wl_idx] for n in self.rndx[rndx_start:stop:step]]
+        tfrms = self.reverse_transforms()
+        rndx = self.rndx_for_wavelength(wl)[rndx_start:stop:step]
         z_dir = [-z_dir for z_dir in self.z_dir[start:stop:step]]
         path = itertools.zip_longest(self.ifcs[start:stop:step],
                                      self.gaps[gap_start:stop:step],
@@ -211,7 +289,7 @@ class SequentialModel:
             ri = []
             mat = g.medium
             for w in wvls:
-                rndx = mat.rindex(w)
+                rndx = medium.cached_rindex(mat, w)
                 ri.append(rndx)
             indices.append(ri)
 
@@ -228,6 +306,71 @@ class SequentialModel:
         self.wvlns = spectral_region.wavelengths
         return self.wvlns.index(wvl)
 
+    def rndx_for_wavelength(self, wl):
+        """ returns a list of the refractive indices of the gaps at **wl**
+
+        The indices for the wavelengths of the model's spectral region are
+        read from the rndx table. Other wavelengths are interpolated from
+        the spectral index table, if spectral sampling is set and covers
+        **wl**; otherwise the gap media are evaluated directly.
+
+        Args:
+            wl: wavelength in nm
+        """
+        spectral_region = self.opt_model['optical_spec'].spectral_region
+        if wl in spectral_region.wavelengths:
+            wl_idx = self.index_for_wavelength(wl)
+            try:
+                return [n[wl_idx] for n in self.rndx]
+            except IndexError:
+                self.wvlns = spectral_region.wavelengths
+                self.rndx = self.calc_ref_indices_for_spectrum(self.wvlns)
+                return [n[wl_idx] for n in self.rndx]
+
+        spectral_table = self.spectral_table
+        if spectral_table is not None and spectral_table.covers(wl):
+            return spectral_table.rindex(wl).tolist()
+        return [medium.cached_rindex(g.medium, wl) for g in self.gaps]
+
+    def set_spectral_sampling(self, wvl_range=None, num_wvls=200):
+        """ tabulate the gap media on a dense grid of wavelengths
+
+        Once set, tracing at wavelengths that aren't part of the spectral
+        region interpolates the refractive indices from the table, rather
+        than evaluating each medium's dispersion formula. The table is
+        rebuilt when the model is updated.
+
+        Args:
+            wvl_range: (min, max) wavelengths in nm; defaults to the range
+                       of the model's spectral region
+            num_wvls: the number of sample wavelengths
+        """
+        if wvl_range is not None:
+            wvl_range = tuple(wvl_range)
+        self.spectral_sampling = wvl_range, num_wvls
+        self._spectral_table = None
+        return self.spectral_table
+
+    def clear_spectral_sampling(self):
+        """ remove the spectral index table """
+        self.spectral_sampling = None
+        self._spectral_table = None
+
+    @property
+    def spectral_table(self):
+        """ the :class:`~.SpectralIndexTable` of the gap media, or None """
+        if self.spectral_sampling is None:
+            return None
+        if (self._spectral_table is None or
+                len(self._spectral_table) != len(self.gaps)):
+            wvl_range, num_wvls = self.spectral_sampling
+            if wvl_range is None:
+                wvls = self.opt_model['osp']['wvls'].wavelengths
+                wvl_range = min(wvls), max(wvls)
+            self._spectral_table = medium.SpectralIndexTable(
+                [g.medium for g in self.gaps], wvl_range, num_wvls=num_wvls)
+        return self._spectral_table
+
     def central_rndx(self, i):
         """ returns the central refractive index of the model's ``WvlSpec`` """
         spectral_region = self.opt_model['optical_spec'].spectral_region
@@ -285,7 +428,7 @@ class SequentialModel:
         self.lcl_tfrms.insert(idx, tfrm)
 
         wvls = self.opt_model.optical_spec.spectral_region.wavelengths
-        rindex = [gap.medium.rindex(w) for w in wvls]
+        rindex = [medium.cached_rindex(gap.medium, w) for w in wvls]
         self.rndx.insert(idx, rindex)
 
         if ifc.interact_mode == 'reflect':
@@ -426,8 +569,28 @@ class SequentialModel:
                 
         if not hasattr(self, 'do_apertures'):
             self.do_apertures = True
+        if not hasattr(self, 'aperture_rays'):
+            self.aperture_rays = None
+
+        if not hasattr(self, 'spectral_sampling'):
+            self.spectral_sampling = None
+        self._spectral_table = None
+
+        self.revision = 0
+        self._trace_plans = OrderedDict()
+        self._reverse_tfrms = None
+        self._tfrm_keys = []
+        self._gbl_cache = []
+        self._lcl_cache = []
 
     def update_model(self, **kwargs):
+        self.update_indices()
+        self.update_transforms()
+        self.new_revision()
+
+    def update_indices(self):
+        """ recompute refractive indices, z_dir and delta_n, then update ifcs
+        """
         # delta n across each surface interface must be set to some
         #  reasonable default value. use the index at the central wavelength
         spectral_region = self.opt_model['optical_spec'].spectral_region
@@ -435,6 +598,7 @@ class SequentialModel:
 
         self.wvlns = spectral_region.wavelengths
         self.rndx = self.calc_ref_indices_for_spectrum(self.wvlns)
+        self._spectral_table = None
         n_before = self.rndx[0][ref_wl]
 
         z_dir_before = self.z_dir[0]
@@ -461,8 +625,15 @@ class SequentialModel:
             # call update() on the surface interface
             ifc.update()
 
-        self.gbl_tfrms = self.compute_global_coords()
-        self.lcl_tfrms = self.compute_local_transforms()
+    def update_transforms(self):
+        """ recompute the global and local interface transforms """
+        self.gbl_tfrms, self.lcl_tfrms = self.compute_transforms()
+
+    def new_revision(self):
+        """ increment the model revision and clear cached trace data """
+        self.revision += 1
+        self._trace_plans = OrderedDict()
+        self._reverse_tfrms = None
 
     def update_optical_properties(self, **kwargs):
         if self.do_apertures:
@@ -476,8 +647,8 @@ class SequentialModel:
             if g:
                 g.apply_scale_factor(scale_factor)
 
-        self.gbl_tfrms = self.compute_global_coords()
-        self.lcl_tfrms = self.compute_local_transforms()
+        self.gbl_tfrms, self.lcl_tfrms = self.compute_transforms()
+        self.new_revision()
 
     def flip(self, idx1: int, idx2: int) -> None:
         """Flip interfaces and gaps from *idx1* thru *idx2*."""
@@ -724,7 +895,13 @@ class SequentialModel:
         return o_str
 
     def trace_fan(self, fct, fi, xy, num_rays=21, **kwargs):
-        """ xy determines whether x (=0) or y (=1) fan """
+        """ xy determines whether x (=0) or y (=1) fan
+
+        The fan is traced for all wavelengths as one batch. **fct** is
+        usually a closure, and so this doesn't take an executor; fields are
+        evaluated in parallel by the callers, e.g. :class:`~.AxisArrayFigure`
+        and :func:`~.analyses.eval_field_wvl_array`.
+        """
         osp = self.opt_model.optical_spec
         fld = osp.field_of_view.fields[fi]
         wvl = self.central_wavelength()
@@ -732,8 +909,6 @@ class SequentialModel:
 
         rs_pkg, cr_pkg = trace.setup_pupil_coords(self.opt_model,
                                                   fld, wvl, foc)
-        fld.chief_ray = cr_pkg
-        fld.ref_sphere = rs_pkg
 
         # Use the central wavelength reference image point for the wavefront error calculations
         ref_img_pt = rs_pkg[0]
@@ -749,17 +924,22 @@ class SequentialModel:
         max_rho_val = 0.0
         max_y_val = 0.0
         rc = []
+
+        # trace the fan in all wavelengths in a single pass
+        pupils = trace.fan_pupils(fan_def)
+        bundle = trace.trace_bundle(self.opt_model, pupils, fld,
+                                    wvls.wavelengths, **kwargs)
         for wi, wvl in enumerate(wvls.wavelengths):
             rc.append(wvls.render_colors[wi])
 
             rs_pkg, cr_pkg = trace.setup_pupil_coords(self.opt_model,
                                                       fld, wvl, foc,
                                                       image_pt=ref_img_pt)
-            fld.chief_ray = cr_pkg
-            fld.ref_sphere = rs_pkg
-            fan = trace.trace_fan(self.opt_model, fan_def, fld, wvl, foc,
-                                  img_filter=lambda p, ray_pkg:
-                                  fct(p, xy, ray_pkg, fld, wvl, foc), **kwargs)
+            fld_cr = trace.field_with_chief_ray(fld, cr_pkg, rs_pkg)
+            fan = trace.fan_from_bundle(pupils, bundle,
+                                        img_filter=lambda p, ray_pkg:
+                                        fct(p, xy, ray_pkg, fld_cr, wvl, foc),
+                                        offset=wi*len(pupils))
             f_x = []
             f_y = []
             for p, y_val in fan:
@@ -777,7 +957,11 @@ class SequentialModel:
 
     def trace_grid(self, fct, fi, wl=None, num_rays=21, form='grid',
                    append_if_none=True, **kwargs):
-        """ fct is applied to the raw grid and returned as a grid  """
+        """ fct is applied to the raw grid and returned as a grid
+
+        The grid is traced for all wavelengths as one batch; see
+        :meth:`trace_fan` for evaluating fields in parallel.
+        """
         osp = self.opt_model.optical_spec
         wvls = osp.spectral_region
         wvl = self.central_wavelength()
@@ -787,19 +971,28 @@ class SequentialModel:
 
         rs_pkg, cr_pkg = trace.setup_pupil_coords(self.opt_model,
                                                   fld, wvl, foc)
-        fld.chief_ray = cr_pkg
-        fld.ref_sphere = rs_pkg
+        fld_cr = trace.field_with_chief_ray(fld, cr_pkg, rs_pkg)
 
         grids = []
         grid_start = np.array([-1., -1.])
         grid_stop = np.array([1., 1.])
         grid_def = [grid_start, grid_stop, num_rays]
+
+        # trace the grid in all wavelengths in a single pass
+        pupils = trace.grid_pupils(grid_def)
+        num_pupils = len(pupils)
+        bundle = trace.trace_bundle(self.opt_model, pupils, fld, wv_list,
+                                    check_apertures=True, **kwargs)
+        ray_results = trace.ray_results_from_bundle(
+            bundle, kwargs.get('output_filter', None),
+            kwargs.get('rayerr_filter', None))
         for wi, wvl in enumerate(wv_list):
-            grid = trace.trace_grid(self.opt_model, grid_def, fld, wvl, foc,
-                                    form=form, append_if_none=append_if_none,
-                                    img_filter=lambda p, ray_pkg:
-                                    fct(p, wi, ray_pkg, fld, wvl, foc),
-                                    **kwargs)
+            wvl_results = ray_results[wi*num_pupils:(wi+1)*num_pupils]
+            grid = trace.grid_from_ray_results(
+                pupils, wvl_results, num_rays, form=form,
+                append_if_none=append_if_none,
+                img_filter=lambda p, ray_pkg:
+                fct(p, wi, ray_pkg, fld_cr, wvl, foc))
             grids.append(grid)
         rc = wvls.render_colors
         return grids, rc
@@ -812,8 +1005,7 @@ class SequentialModel:
             if ray_pkg is not None:
                 fod = self.opt_model['analysis_results']['parax_data'].fod
                 opd = waveabr.wave_abr_full_calc(fod, fld, wvl, foc, ray_pkg,
-                                                 fld.chief_ray,
-                                                 fld.ref_sphere)
+                                                 cr_pkg, rs_pkg)
                 opd = opd/self.opt_model.nm_to_sys_units(wvl)
             else:
                 opd = 0.0
@@ -821,8 +1013,6 @@ class SequentialModel:
 
         rs_pkg, cr_pkg = trace.setup_pupil_coords(self.opt_model,
                                                   fld, wvl, foc)
-        fld.chief_ray = cr_pkg
-        fld.ref_sphere = rs_pkg
 
         grid_start = np.array([-1., -1.])
         grid_stop = np.array([1., 1.])
@@ -858,30 +1048,80 @@ class SequentialModel:
             sd = abs(ax_ray[i][0]) + abs(pr_ray[i][0])
             ifc.set_max_aperture(sd)
 
-    def set_clear_apertures(self):
-        rayset = trace.trace_boundary_rays(self.opt_model,
-                                           use_named_tuples=True)
+    def set_clear_apertures(self, num_rays=None):
+        """ set the clear apertures of each interface to pass the boundary rays
 
-        for i, s in enumerate(self.ifcs):
-            max_ap = -1.0e+10
-            update = True
-            for f in rayset:
-                for p in f:
-                    ray = p.ray
-                    if len(ray) > i:
-                        ap = sqrt(ray[i].p[0]**2 + ray[i].p[1]**2)
-                        if ap > max_ap:
-                            max_ap = ap
-                    else:  # ray failed before this interface, don't update
-                        update = False
-            if update:
-                s.set_max_aperture(max_ap)
+        Args:
+            num_rays: the number of rays around the rim of the pupil to trace
+                      in addition to the pupil rays, defaults to
+                      :attr:`aperture_rays`; see
+                      :func:`~.vigcalc.trace_aperture_rays`
+        """
+        if num_rays is None:
+            num_rays = self.aperture_rays
+        vigcalc.set_clear_apertures(self.opt_model, num_rays=num_rays)
 
     def trace(self, pt0, dir0, wvl, **kwargs):
         return rt.trace(self, pt0, dir0, wvl, **kwargs)
 
-    def compute_global_coords(self, glo=1):
-        """ Return global surface coordinates (rot, t) wrt surface glo. """
+    def compute_transforms(self):
+        """ Return the global and local transforms of the interfaces.
+
+        The transforms are cached. Each segment of the model is identified by
+        its thickness and the decenters of the interfaces bounding it. Only
+        the transforms following the first segment that changed since the
+        last call are recomputed.
+
+        Returns:
+            (**gbl_tfrms**, **lcl_tfrms**), the global coordinates wrt the
+            first interface and the forward local transforms
+        """
+        keys = [segment_key(b4_ifc, b4_gap, ifc) for b4_ifc, b4_gap, ifc
+                in zip(self.ifcs, self.gaps, self.ifcs[1:])]
+        old_keys = self._tfrm_keys
+        num_same = min(len(keys), len(old_keys))
+        start = 0
+        while start < num_same and keys[start] == old_keys[start]:
+            start += 1
+
+        if start == len(keys) == len(old_keys):
+            pass
+        elif start == 0:
+            self._gbl_cache = self.compute_global_coords(use_cache=False)
+            self._lcl_cache = self.compute_local_transforms()
+        else:
+            seq = itertools.zip_longest(self.ifcs[start:], self.gaps[start:])
+            lcl = self._lcl_cache[:start] + self.compute_local_transforms(seq)
+            # accumulate the global coordinates from the last valid one
+            gbl = self._gbl_cache[:start+1]
+            for r, t in lcl[start:-1]:
+                prev = gbl[-1]
+                gbl.append((prev[0].dot(r.transpose()),
+                            prev[0].dot(t) + prev[1]))
+            self._gbl_cache, self._lcl_cache = gbl, lcl
+        self._tfrm_keys = keys
+        return list(self._gbl_cache), list(self._lcl_cache)
+
+    def reverse_transforms(self):
+        """ Return the local transforms for a reverse path.
+
+        The transforms are memoized until the model revision changes.
+        """
+        if (self._reverse_tfrms is None or
+                len(self._reverse_tfrms) != len(self.ifcs)):
+            self._reverse_tfrms = self.compute_local_transforms(step=-1)
+        return self._reverse_tfrms
+
+    def compute_global_coords(self, glo=1, use_cache=True):
+        """ Return global surface coordinates (rot, t) wrt surface glo.
+
+        The coordinates wrt the first interface are returned from the
+        transform cache, see :meth:`compute_transforms`, unless
+        **use_cache** is False.
+        """
+        if glo == 1 and use_cache:
+            return self.compute_transforms()[0]
+
         tfrms = []
         r, t = np.identity(3), np.array([0., 0., 0.])
         prev = r, t
@@ -965,6 +1205,20 @@ class SequentialModel:
         return matches
 
 
+def decenter_key(ifc):
+    """ returns a hashable key for the decenter state of **ifc** """
+    dec = ifc.decenter
+    if dec is None:
+        return None
+    rot_mat = None if dec.rot_mat is None else dec.rot_mat.tobytes()
+    return dec.dtype, dec.dec.tobytes(), rot_mat
+
+
+def segment_key(b4_ifc, b4_gap, ifc):
+    """ returns a hashable key for the transform between b4_ifc and ifc """
+    return b4_gap.thi, decenter_key(b4_ifc), decenter_key(ifc)
+
+
 def gen_sequence(surf_data_list, **kwargs):
     """ create a sequence iterator from the surf_data_list
 
@@ -1081,7 +1335,7 @@ def create_surface_and_gap(surf_data, radius_mode=False, prev_medium=None,
         s.set_max_aperture(kwargs.get('sd'))
     thi = surf_data[1]
     g = gap.Gap(thi, mat)
-    rndx = mat.rindex(wvl)
+    rndx = medium.cached_rindex(mat, wvl)
     tfrm = np.identity(3), np.array([0., 0., thi])
 
     return s, g, z_dir, rndx, tfrm